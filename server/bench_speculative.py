@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Speculative decoding benchmark
+같은 프롬프트를 기존 경로(plain)와 speculative 경로로 번갈아 생성하여 tokens/sec와 채택률을 비교하고,
+greedy(temperature=0) 출력이 두 경로에서 같은지 확인합니다.
+
+Usage:
+    python bench_speculative.py --mode prompt_lookup
+    SPECULATIVE_DRAFT_MODEL_PATH=models/draft.gguf python bench_speculative.py --mode both prompts.jsonl
+"""
+import argparse
+import os
+import time
+from pathlib import Path
+
+DEFAULT_PROMPTS = [
+    "Explain what a token embedding is.",
+    "What is the capital of France? Answer with the city name repeated three times.",
+    "List the days of the week.",
+    "Summarize: The quick brown fox jumps over the lazy dog. The quick brown fox jumps again.",
+    "Translate 'good morning' into Spanish, French and German.",
+]
+
+
+def _generate(llama, prompt: str, max_tokens: int, seed: int):
+    from utils import SYSTEM_PROMPT
+
+    # 실행마다 KV 캐시를 비워 이전 프롬프트의 prefix 재사용이 결과에 섞이지 않게 함
+    llama.reset()
+    started = time.perf_counter()
+    response = llama.create_chat_completion(
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ],
+        max_tokens=max_tokens,
+        temperature=0.0,
+        seed=seed,
+    )
+    elapsed = time.perf_counter() - started
+    return response["choices"][0]["message"]["content"], response["usage"]["completion_tokens"], elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare plain and speculative decoding")
+    parser.add_argument("prompts", type=Path, nargs="?", default=None,
+                        help="JSONL file with input texts (default: built-in prompts)")
+    parser.add_argument("--mode", choices=["prompt_lookup", "draft", "both"], default="prompt_lookup")
+    parser.add_argument("--max-tokens", type=int, default=128)
+    parser.add_argument("--repeat", type=int, default=2, help="Runs per prompt and path")
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    # config.py가 import되기 전에 모드를 지정해야 함
+    os.environ["SPECULATIVE_MODE"] = args.mode
+    from model import ensure_model_loaded
+    import model
+    from speculative import speculative_decoding, speculative_stats, is_speculative_available
+
+    if not ensure_model_loaded(timeout=3600):
+        raise SystemExit("Model could not be loaded")
+    if not is_speculative_available():
+        raise SystemExit(f"Speculative mode '{args.mode}' is not available (see [SPECULATIVE] log above)")
+    llama = model.llama
+
+    if args.prompts is not None:
+        from precompute import read_inputs
+        prompts = read_inputs(args.prompts)
+    else:
+        prompts = DEFAULT_PROMPTS
+
+    totals = {False: [0, 0.0], True: [0, 0.0]}
+    mismatches = 0
+    for prompt in prompts:
+        outputs = {}
+        for _ in range(args.repeat):
+            # 순서에 따른 캐시 효과를 줄이기 위해 두 경로를 번갈아 실행
+            for speculative in (False, True):
+                with speculative_decoding(llama, speculative):
+                    text, tokens, elapsed = _generate(llama, prompt, args.max_tokens, args.seed)
+                totals[speculative][0] += tokens
+                totals[speculative][1] += elapsed
+                outputs.setdefault(speculative, text)
+        same = outputs[False] == outputs[True]
+        mismatches += 0 if same else 1
+        print(f"[BENCH] {'same' if same else 'DIFFERENT'} output: {prompt[:50]!r}")
+
+    stats = speculative_stats.snapshot()
+    print()
+    print(f"Mode: {args.mode}, prompts: {len(prompts)}, runs per path: {args.repeat}")
+    print(f"{'Path':<12} {'Tokens':>8} {'Seconds':>9} {'Tokens/s':>9}")
+    for speculative, label in ((False, "plain"), (True, "speculative")):
+        tokens, seconds = totals[speculative]
+        print(f"{label:<12} {tokens:>8} {seconds:>9.2f} {tokens / seconds if seconds else 0:>9.2f}")
+    plain_rate = totals[False][0] / totals[False][1] if totals[False][1] else 0
+    spec_rate = totals[True][0] / totals[True][1] if totals[True][1] else 0
+    if plain_rate:
+        print(f"Speedup: {spec_rate / plain_rate:.2f}x")
+    print(f"Acceptance rate: {stats['acceptance_rate']} ({stats['accepted_tokens']}/{stats['drafted_tokens']} drafted tokens)")
+    print(f"Greedy outputs identical: {len(prompts) - mismatches}/{len(prompts)}")
+
+
+if __name__ == "__main__":
+    main()
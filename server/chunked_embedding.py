@@ -0,0 +1,97 @@
+"""
+Chunked embedding - 컨텍스트/배치보다 긴 입력을 겹치는 윈도우로 나누어 토큰별 벡터 계산
+llama.embed()는 입력 전체를 한 번의 배치로 평가하므로 n_batch보다 긴 문서는 실패합니다.
+
+    윈도우 1: [BOS t0 ... t(W-1)]                          모든 벡터 사용
+    윈도우 2: [BOS | 이전 윈도우 끝 overlap개 | 새 토큰들]     새 토큰 벡터만 사용
+
+겹치는 구간은 앞 윈도우에서 더 긴 문맥으로 계산된 벡터를 쓰고, 뒤 윈도우에서는 왼쪽 문맥으로만
+사용합니다. 여러 윈도우를 서로 다른 시퀀스로 한 배치에 묶어 평가하고(n_batch // window개씩),
+메모리는 문서 길이 x n_embd 결과 배열과 배치 하나 분량의 KV 캐시로 제한됩니다.
+기본 설정(LLAMA_N_BATCH 512, EMBED_WINDOW_TOKENS 256)에서는 디코드마다 윈도우 두 개를 평가합니다.
+
+Llama.embed()는 문자열만 받으므로 윈도우별 토큰열을 직접 배치에 넣기 위해 llama-cpp-python
+내부(_batch, _ctx)를 사용합니다. requirements.txt의 고정 버전(0.3.2) 기준입니다.
+"""
+from typing import List, Tuple
+
+import numpy as np
+
+
+def window_size(llama) -> int:
+    """Tokens per window (at most one batch)"""
+    from config import EMBED_WINDOW_TOKENS
+
+    return max(2, min(EMBED_WINDOW_TOKENS, llama.n_batch))
+
+
+def plan_windows(n_tokens: int, window: int, overlap: int) -> List[Tuple[int, int, int]]:
+    """Split [0, n_tokens) into windows of (context_start, keep_start, end)
+
+    The first window starts with the document's BOS token. Later windows get a BOS of their
+    own followed by `overlap` tokens of left context, so each holds at most `window` tokens.
+    """
+    overlap = max(0, min(overlap, window - 2))
+    windows = [(0, 0, min(window, n_tokens))]
+    while windows[-1][2] < n_tokens:
+        keep_start = windows[-1][2]
+        context_start = keep_start - overlap
+        windows.append((context_start, keep_start, min(context_start + window - 1, n_tokens)))
+    return windows
+
+
+def embed_long(llama, tokens: List[int]) -> np.ndarray:
+    """Per-token hidden states for a tokenized document of any length (up to MAX_DOCUMENT_TOKENS)"""
+    import llama_cpp
+    from config import EMBED_WINDOW_OVERLAP
+
+    window = window_size(llama)
+    windows = plan_windows(len(tokens), window, EMBED_WINDOW_OVERLAP)
+    n_embd = llama.n_embd()
+    bos = llama.token_bos()
+    # 결과 배열을 미리 할당 - 메모리는 문서 길이에만 비례
+    vectors = np.empty((len(tokens), n_embd), dtype=np.float32)
+    per_batch = max(1, llama.n_batch // window)
+
+    # Llama.embed()와 같은 방식: 윈도우마다 시퀀스 ID를 달리해 한 배치로 디코드
+    batch = llama._batch
+    for group_start in range(0, len(windows), per_batch):
+        group = windows[group_start:group_start + per_batch]
+        batch.reset()
+        layout = []
+        for seq_id, (context_start, keep_start, end) in enumerate(group):
+            if keep_start == 0:
+                sequence = tokens[:end]
+            else:
+                sequence = [bos] + tokens[context_start:end]
+            batch.add_sequence(sequence, seq_id, True)
+            layout.append((len(sequence), len(sequence) - (end - keep_start), keep_start, end))
+
+        llama._ctx.kv_cache_clear()
+        llama._ctx.decode(batch)
+        total = sum(length for length, _, _, _ in layout)
+        outputs = np.ctypeslib.as_array(llama_cpp.llama_get_embeddings(llama.ctx), shape=(total * n_embd,))
+        outputs = outputs.reshape(total, n_embd)
+
+        offset = 0
+        for length, skip, keep_start, end in layout:
+            vectors[keep_start:end] = outputs[offset + skip:offset + length]
+            offset += length
+
+    batch.reset()
+    llama._ctx.kv_cache_clear()
+    llama.reset()
+    return vectors
+
+
+def generation_input(llama, text: str, tokens: List[int], max_tokens: int = 512) -> str:
+    """Input text for chat generation, keeping only the tail when it would not fit in the context"""
+    # 시스템 프롬프트와 채팅 템플릿 토큰을 위한 여유분
+    budget = llama.n_ctx() - max_tokens - 64
+    if len(tokens) <= budget:
+        return text
+    print(f"[VISUALIZE] Input has {len(tokens)} tokens, generating from the last {budget}")
+    tail = tokens[-budget:]
+    if tail and tail[0] == llama.token_bos():
+        tail = tail[1:]
+    return llama.detokenize(tail).decode("utf-8", errors="replace")
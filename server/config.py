@@ -19,4 +19,172 @@ SERVICE_NAME = "GPT Visualizer"
 # 환경변수 LLAMA_N_THREADS로 오버라이드 가능 (Docker에서는 ENV로 설정)
 # 기본값: 1 (로컬과 Docker 모두)
 LLAMA_N_THREADS = int(os.getenv("LLAMA_N_THREADS", "1"))
+# 한 번에 디코드할 최대 토큰 수 (llama-cpp 기본값 512)
+LLAMA_N_BATCH = int(os.getenv("LLAMA_N_BATCH", "512"))
 
+
+# 요청 스케줄링(클라이언트별 공정 큐잉 / 부하 차단) 설정
+# 모델은 스레드 안전하지 않은 단일 Llama 인스턴스이므로 동시 실행 수는 1로 고정
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "1"))
+if ADMISSION_MAX_CONCURRENCY != 1:
+    print(f"[CONFIG] ADMISSION_MAX_CONCURRENCY={ADMISSION_MAX_CONCURRENCY} ignored: the shared Llama instance is not thread-safe, using 1")
+    ADMISSION_MAX_CONCURRENCY = 1
+ADMISSION_MAX_QUEUE_PER_CLIENT = int(os.getenv("ADMISSION_MAX_QUEUE_PER_CLIENT", "4"))
+# 예상 대기 시간이 이 값(초)을 넘으면 즉시 429로 거절
+ADMISSION_MAX_QUEUE_WAIT = float(os.getenv("ADMISSION_MAX_QUEUE_WAIT", "20"))
+# 클라이언트별 토큰 버킷 (0이면 속도 제한 비활성화)
+ADMISSION_RATE_PER_MINUTE = float(os.getenv("ADMISSION_RATE_PER_MINUTE", "30"))
+ADMISSION_BURST = int(os.getenv("ADMISSION_BURST", "5"))
+# 처리 이력이 없을 때 사용할 요청당 예상 처리 시간(초)
+ADMISSION_DEFAULT_SERVICE_TIME = float(os.getenv("ADMISSION_DEFAULT_SERVICE_TIME", "5"))
+
+
+def _parse_client_weights(value: str) -> dict:
+    """Parse "client:weight,..." skipping malformed entries and non-positive weights"""
+    weights = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        client, _, weight = item.rpartition(":")
+        client = client.strip()
+        try:
+            weight = float(weight)
+        except ValueError:
+            weight = None
+        if not client or weight is None or not 0 < weight < float("inf"):
+            print(f"[CONFIG] Ignoring ADMISSION_CLIENT_WEIGHTS entry {item.strip()!r} (expected client:weight with weight > 0)")
+            continue
+        weights[client] = weight
+    return weights
+
+
+# 클라이언트 가중치: "key:weight,key:weight" 형식 (API 키 클라이언트는 "key:<api-key>")
+ADMISSION_CLIENT_WEIGHTS = _parse_client_weights(os.getenv("ADMISSION_CLIENT_WEIGHTS", ""))
+# 클라이언트 식별에 사용할 API 키 목록 (쉼표 구분). 가중치가 설정된 키도 포함되며,
+# 등록되지 않은 X-API-Key는 무시하고 접속 주소로 식별 (요청마다 새 키로 제한을 우회하지 못하도록)
+ADMISSION_API_KEYS = {
+    key.strip() for key in os.getenv("ADMISSION_API_KEYS", "").split(",") if key.strip()
+} | {client[len("key:"):] for client in ADMISSION_CLIENT_WEIGHTS if client.startswith("key:")}
+# 신뢰할 수 있는 프록시(Cloud Run, router.py) 뒤에서만 true로 설정 - X-Forwarded-For의 마지막 값 사용
+ADMISSION_TRUST_FORWARDED_FOR = os.getenv("ADMISSION_TRUST_FORWARDED_FOR", "false").lower() == "true"
+
+# 디버그 프로파일링 엔드포인트 (/debug/profile) - 기본 비활성화
+DEBUG_PROFILE_ENABLED = os.getenv("DEBUG_PROFILE_ENABLED", "false").lower() == "true"
+# 요청의 X-Debug-Token 헤더가 일치해야 실행 - 모든 스레드의 스택이 노출되므로 토큰 없이는 켜지 않음
+DEBUG_PROFILE_TOKEN = os.getenv("DEBUG_PROFILE_TOKEN", "")
+if DEBUG_PROFILE_ENABLED and not DEBUG_PROFILE_TOKEN:
+    print("[CONFIG] DEBUG_PROFILE_ENABLED ignored: set DEBUG_PROFILE_TOKEN to enable /debug/profile")
+    DEBUG_PROFILE_ENABLED = False
+DEBUG_PROFILE_MAX_SECONDS = float(os.getenv("DEBUG_PROFILE_MAX_SECONDS", "30"))
+
+# 사전 계산된 갤러리 저장소 (precompute.py로 생성, 모델 호출 없이 응답)
+GALLERY_STORE_PATH = os.getenv(
+    "GALLERY_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "gallery", "gallery.bin"),
+)
+
+# 어휘 최근접 이웃 인덱스 (python vocab_index.py build 로 생성)
+VOCAB_INDEX_DIR = os.getenv(
+    "VOCAB_INDEX_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "vocab_index"),
+)
+# 요청에서 모드를 지정하지 않았을 때 사용할 검색 모드: "exact" 또는 "approx"
+# approx는 빠르지만 recall이 낮을 수 있으므로(합성 어휘 기준 recall@5 약 0.57) 기본값은 exact
+VOCAB_NEIGHBORS_MODE = os.getenv("VOCAB_NEIGHBORS_MODE", "exact").lower()
+if VOCAB_NEIGHBORS_MODE not in ("exact", "approx"):
+    print(f"[CONFIG] Unknown VOCAB_NEIGHBORS_MODE '{VOCAB_NEIGHBORS_MODE}', using 'exact'")
+    VOCAB_NEIGHBORS_MODE = "exact"
+VOCAB_NEIGHBORS_MAX_K = int(os.getenv("VOCAB_NEIGHBORS_MAX_K", "20"))
+
+# 모델 로딩 설정 (부팅 시 백그라운드 로드, 실패 시 지수 백오프로 재시도)
+MODEL_LOAD_MAX_ATTEMPTS = int(os.getenv("MODEL_LOAD_MAX_ATTEMPTS", "5"))
+MODEL_LOAD_RETRY_BASE = float(os.getenv("MODEL_LOAD_RETRY_BASE", "2"))
+MODEL_LOAD_RETRY_MAX = float(os.getenv("MODEL_LOAD_RETRY_MAX", "60"))
+# 요청이 모델 준비를 기다리는 최대 시간(초) - 기본 0은 기다리지 않고 바로 503 + Retry-After
+# (precompute.py / bench_speculative.py 같은 스크립트는 직접 긴 timeout을 넘김)
+MODEL_READY_TIMEOUT = float(os.getenv("MODEL_READY_TIMEOUT", "0"))
+# 모델 로딩 중 503 응답의 Retry-After(초) - 재시도 대기 중이면 남은 백오프 시간을 사용
+MODEL_NOT_READY_RETRY_AFTER = float(os.getenv("MODEL_NOT_READY_RETRY_AFTER", "5"))
+
+# 토큰화 미리보기 (/api/tokenize) - vocab_only 로드한 별도 프로세스에서 처리
+TOKENIZE_MAX_CHARS = int(os.getenv("TOKENIZE_MAX_CHARS", "20000"))
+TOKENIZE_CACHE_SIZE = int(os.getenv("TOKENIZE_CACHE_SIZE", "1024"))
+TOKENIZE_TIMEOUT = float(os.getenv("TOKENIZE_TIMEOUT", "5"))
+# 토크나이저 프로세스 수 (동시 미리보기 요청을 병렬로 처리)
+TOKENIZE_WORKERS = int(os.getenv("TOKENIZE_WORKERS", "2"))
+
+# 임베딩 전용 모드 (/api/embed) - 요청당 최대 텍스트 수
+EMBED_MAX_TEXTS = int(os.getenv("EMBED_MAX_TEXTS", "16"))
+
+# 레플리카 간 공유 결과 저장소 (예: sqlite:///data/results.db, file:///data/results) - 비어 있으면 비활성화
+RESULT_STORE_URL = os.getenv("RESULT_STORE_URL", "")
+# 저장된 결과의 유효 시간(초), 0이면 만료 없음
+RESULT_STORE_TTL = float(os.getenv("RESULT_STORE_TTL", "86400"))
+
+# 라우터 (router.py) 설정 - 입력 텍스트의 consistent hash로 레플리카 선택
+# 예: "http://10.0.0.2:8080,http://10.0.0.3:8080"
+ROUTER_NODES = [n.strip().rstrip("/") for n in os.getenv("ROUTER_NODES", "").split(",") if n.strip()]
+ROUTER_PORT = int(os.getenv("ROUTER_PORT", "8090"))
+ROUTER_VIRTUAL_NODES = int(os.getenv("ROUTER_VIRTUAL_NODES", "64"))
+ROUTER_HEALTH_INTERVAL = float(os.getenv("ROUTER_HEALTH_INTERVAL", "5"))
+ROUTER_REQUEST_TIMEOUT = float(os.getenv("ROUTER_REQUEST_TIMEOUT", "180"))
+ROUTER_POOL_SIZE = int(os.getenv("ROUTER_POOL_SIZE", "8"))
+
+# 멀티턴 세션 (/api/visualize의 session_id) - 세션마다 llama 상태(KV 캐시)를 보관
+SESSION_MAX_RESIDENT = int(os.getenv("SESSION_MAX_RESIDENT", "8"))
+# LRU로 밀려난 세션을 저장할 디렉토리 (비어 있으면 밀려난 세션은 폐기)
+SESSION_SPILL_DIR = os.getenv("SESSION_SPILL_DIR", "")
+# 마지막 사용 이후 세션 유지 시간(초)
+SESSION_TTL = float(os.getenv("SESSION_TTL", "3600"))
+# 세션 ID 최대 길이
+SESSION_ID_MAX_LENGTH = 128
+# 세션 시각화 궤적에 유지할 최대 토큰 수 (넘으면 오래된 턴부터 제외, 메모리: 토큰 수 x n_embd x 4 bytes)
+SESSION_MAX_TOKENS = int(os.getenv("SESSION_MAX_TOKENS", "2048"))
+
+# 입력 prefix 재사용 캐시 - 최근 입력의 평가 상태 보관 개수 (생성/임베딩 각각, 0이면 비활성화)
+PREFIX_CACHE_ENTRIES = int(os.getenv("PREFIX_CACHE_ENTRIES", "8"))
+# 이보다 짧은 공통 prefix는 상태를 복원하지 않고 처음부터 평가
+PREFIX_CACHE_MIN_TOKENS = int(os.getenv("PREFIX_CACHE_MIN_TOKENS", "4"))
+# 저장된 상태(KV 캐시 등)의 총 메모리 한도(bytes), 0이면 개수 제한만 사용
+PREFIX_CACHE_MAX_BYTES = int(os.getenv("PREFIX_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# 이보다 짧은 입력은 다시 평가하는 비용이 작으므로 상태를 저장하지 않음
+PREFIX_CACHE_STORE_MIN_TOKENS = int(os.getenv("PREFIX_CACHE_STORE_MIN_TOKENS", "64"))
+
+# Speculative decoding - off | prompt_lookup | draft | both
+# off가 아니면 메인 모델을 logits_all=True로 로드하므로 (검증에 모든 위치의 logits 필요)
+# n_ctx x n_vocab x 4 bytes(Llama 3.2, n_ctx=4096 기준 약 2 GB)가 모든 요청에 대해 추가로 필요.
+# 켜져 있으면 요청은 기본으로 사용하고 "speculative": false로 제외할 수 있음
+SPECULATIVE_MODE = os.getenv("SPECULATIVE_MODE", "off").lower()
+# 한 번에 제안할 초안 토큰 수 / prompt lookup의 최대 n-gram 크기
+SPECULATIVE_NUM_PRED_TOKENS = int(os.getenv("SPECULATIVE_NUM_PRED_TOKENS", "8"))
+SPECULATIVE_MAX_NGRAM = int(os.getenv("SPECULATIVE_MAX_NGRAM", "2"))
+# draft 모드에서 사용할 작은 GGUF (메인 모델과 같은 어휘여야 함)
+SPECULATIVE_DRAFT_MODEL_PATH = os.getenv("SPECULATIVE_DRAFT_MODEL_PATH", "")
+SPECULATIVE_DRAFT_N_THREADS = int(os.getenv("SPECULATIVE_DRAFT_N_THREADS", str(LLAMA_N_THREADS)))
+
+# 비동기 작업 (/api/jobs) - 재시작에도 유지되는 SQLite 작업 큐
+JOBS_DB_PATH = os.getenv(
+    "JOBS_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "jobs.db"),
+)
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "1"))
+# 완료된 작업 결과 보관 시간(초), 0이면 만료 없음
+JOBS_RESULT_TTL = float(os.getenv("JOBS_RESULT_TTL", "86400"))
+# GET /api/jobs/{id}?wait=N 롱 폴링 최대 대기 시간(초)
+JOBS_MAX_WAIT = float(os.getenv("JOBS_MAX_WAIT", "30"))
+# 재시작으로 중단된 작업을 다시 실행하는 최대 횟수
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))
+# 대기 중인 작업 최대 개수 (0이면 제한 없음)
+JOBS_MAX_QUEUED = int(os.getenv("JOBS_MAX_QUEUED", "1000"))
+# 클라이언트 하나가 대기열에 둘 수 있는 작업 수 (0이면 제한 없음)
+JOBS_MAX_QUEUED_PER_CLIENT = int(os.getenv("JOBS_MAX_QUEUED_PER_CLIENT", "50"))
+# Idempotency-Key 헤더 최대 길이
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+# 긴 입력의 윈도우 분할 임베딩 - 윈도우보다 긴 입력은 겹치는 윈도우로 나누어 평가
+# 한 배치에 LLAMA_N_BATCH // EMBED_WINDOW_TOKENS개 윈도우를 서로 다른 시퀀스로 묶어 한 번에 디코드
+# 기본값(512 // 256)은 디코드마다 윈도우 두 개 - 윈도우를 키우려면 LLAMA_N_BATCH도 배수로 늘려야 함
+EMBED_WINDOW_TOKENS = int(os.getenv("EMBED_WINDOW_TOKENS", "256"))
+EMBED_WINDOW_OVERLAP = int(os.getenv("EMBED_WINDOW_OVERLAP", "64"))
+# 입력 문서 최대 토큰 수 (결과 배열 메모리: 토큰 수 x n_embd x 4 bytes)
+MAX_DOCUMENT_TOKENS = int(os.getenv("MAX_DOCUMENT_TOKENS", "8192"))
@@ -0,0 +1,246 @@
+"""
+Precomputed visualization store (gallery)
+precompute.py가 만든 컬럼형 바이너리 파일을 mmap으로 열어 모델 호출 없이 응답합니다.
+
+File layout (little-endian, sections aligned to 8 bytes):
+    header   magic, entry_count, token_count, 8 section offsets
+    keys     uint64[entry_count]        sorted hash of the normalized input text
+    entries  uint64[entry_count, 2]     (token_start, token_count) per key
+    coords   float16[token_count, 3]    destination coordinates
+    flags    uint8[token_count]         bit 0 = is_input
+    tok_off  uint64[token_count + 1]    offsets into the token string blob
+    tok_blob bytes                      UTF-8 token strings
+    text_off uint64[entry_count + 1]    offsets into the input text blob
+    text_blob bytes                     UTF-8 normalized input texts
+"""
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import unicodedata
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+_MAGIC = b"GVGAL\x00\x01\x00"
+_HEADER = struct.Struct("<8sQQ8Q")
+_FLAG_IS_INPUT = 1
+
+# (token, destination, is_input)
+TokenRow = Tuple[str, List[float], bool]
+
+
+def normalize_input_text(text: str) -> str:
+    """Canonical form of an input text used for cache and gallery keys"""
+    return unicodedata.normalize("NFC", text).strip()
+
+
+def text_key(text: str) -> int:
+    """64-bit key of a normalized input text"""
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def write_gallery_store(path, entries: Iterable[Tuple[str, List[TokenRow]]]) -> int:
+    """Write entries to `path` atomically; returns the number of entries written"""
+    by_key: Dict[int, Tuple[str, List[TokenRow]]] = {}
+    for text, rows in entries:
+        text = normalize_input_text(text)
+        by_key[text_key(text)] = (text, rows)  # 같은 입력은 마지막 값 사용
+
+    keys = sorted(by_key)
+    entry_count = len(keys)
+    token_count = sum(len(by_key[k][1]) for k in keys)
+
+    key_array = np.array(keys, dtype="<u8")
+    entry_array = np.zeros((entry_count, 2), dtype="<u8")
+    coords = np.zeros((token_count, 3), dtype="<f2")
+    flags = np.zeros(token_count, dtype="u1")
+    token_offsets = np.zeros(token_count + 1, dtype="<u8")
+    text_offsets = np.zeros(entry_count + 1, dtype="<u8")
+    token_blob = bytearray()
+    text_blob = bytearray()
+
+    position = 0
+    for i, key in enumerate(keys):
+        text, rows = by_key[key]
+        entry_array[i] = (position, len(rows))
+        for token, destination, is_input in rows:
+            coords[position] = destination
+            flags[position] = _FLAG_IS_INPUT if is_input else 0
+            token_blob += token.encode("utf-8")
+            position += 1
+            token_offsets[position] = len(token_blob)
+        text_blob += text.encode("utf-8")
+        text_offsets[i + 1] = len(text_blob)
+
+    sections = [
+        key_array.tobytes(),
+        entry_array.tobytes(),
+        coords.tobytes(),
+        flags.tobytes(),
+        token_offsets.tobytes(),
+        bytes(token_blob),
+        text_offsets.tobytes(),
+        bytes(text_blob),
+    ]
+    offsets = []
+    cursor = _align(_HEADER.size)
+    for section in sections:
+        offsets.append(cursor)
+        cursor = _align(cursor + len(section))
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, entry_count, token_count, *offsets))
+        for offset, section in zip(offsets, sections):
+            f.write(b"\x00" * (offset - f.tell()))
+            f.write(section)
+    # 서버가 읽는 중이어도 안전하도록 원자적으로 교체
+    os.replace(tmp_path, path)
+    return entry_count
+
+
+class GalleryStore:
+    """Read-only, memory-mapped view of a gallery file"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.entry_count, self.token_count, *offsets = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"Not a gallery store file: {self.path}")
+        (keys_off, entries_off, coords_off, flags_off,
+         tok_off_off, tok_blob_off, text_off_off, text_blob_off) = offsets
+
+        n, t = self.entry_count, self.token_count
+        self._keys = np.frombuffer(self._mm, dtype="<u8", count=n, offset=keys_off)
+        self._entries = np.frombuffer(self._mm, dtype="<u8", count=n * 2, offset=entries_off).reshape(n, 2)
+        self._coords = np.frombuffer(self._mm, dtype="<f2", count=t * 3, offset=coords_off).reshape(t, 3)
+        self._flags = np.frombuffer(self._mm, dtype="u1", count=t, offset=flags_off)
+        self._token_offsets = np.frombuffer(self._mm, dtype="<u8", count=t + 1, offset=tok_off_off)
+        self._text_offsets = np.frombuffer(self._mm, dtype="<u8", count=n + 1, offset=text_off_off)
+        self._token_blob_off = tok_blob_off
+        self._text_blob_off = text_blob_off
+        # 이 저장소를 읽는 중인 요청 수 (파일이 교체돼도 0이 될 때까지 닫지 않음)
+        self._readers = 0
+
+    def __len__(self) -> int:
+        return self.entry_count
+
+    def _text(self, index: int) -> str:
+        start = self._text_blob_off + int(self._text_offsets[index])
+        end = self._text_blob_off + int(self._text_offsets[index + 1])
+        return self._mm[start:end].decode("utf-8")
+
+    def _find(self, text: str) -> Optional[int]:
+        text = normalize_input_text(text)
+        key = np.uint64(text_key(text))
+        index = int(np.searchsorted(self._keys, key))
+        if index < self.entry_count and self._keys[index] == key and self._text(index) == text:
+            return index
+        return None
+
+    def __contains__(self, text: str) -> bool:
+        return self._find(text) is not None
+
+    def rows(self, index: int) -> List[TokenRow]:
+        """Token rows of the entry at `index`"""
+        start, count = (int(v) for v in self._entries[index])
+        offsets = self._token_offsets[start:start + count + 1].tolist()
+        blob_off = self._token_blob_off
+        tokens = [
+            self._mm[blob_off + offsets[i]:blob_off + offsets[i + 1]].decode("utf-8")
+            for i in range(count)
+        ]
+        destinations = np.round(self._coords[start:start + count].astype(np.float64), 4).tolist()
+        flags = (self._flags[start:start + count] & _FLAG_IS_INPUT).tolist()
+        return [(tokens[i], destinations[i], bool(flags[i])) for i in range(count)]
+
+    def lookup(self, text: str) -> Optional[Dict[str, Any]]:
+        """Precomputed /api/visualize response for `text`, or None"""
+        index = self._find(text)
+        if index is None:
+            return None
+        return {
+            "tokens": [
+                {"token": token, "destination": destination, "is_input": is_input}
+                for token, destination, is_input in self.rows(index)
+            ]
+        }
+
+    def texts(self) -> List[str]:
+        """All input texts in the store (key order)"""
+        return [self._text(i) for i in range(self.entry_count)]
+
+    def items(self) -> Iterable[Tuple[str, List[TokenRow]]]:
+        for i in range(self.entry_count):
+            yield self._text(i), self.rows(i)
+
+    def close(self):
+        # numpy 뷰가 남아 있으면 mmap을 닫을 수 없으므로 먼저 해제
+        self._keys = self._entries = self._coords = self._flags = None
+        self._token_offsets = self._text_offsets = None
+        self._mm.close()
+
+
+_gallery_store = None
+_gallery_store_mtime = None
+_gallery_lock = threading.Lock()
+
+
+def _acquire_gallery_store() -> Optional[GalleryStore]:
+    """Current store with a reader reference held, reopened when precompute.py replaces the file"""
+    global _gallery_store, _gallery_store_mtime
+    from config import GALLERY_STORE_PATH
+
+    try:
+        mtime = os.stat(GALLERY_STORE_PATH).st_mtime_ns
+    except OSError:
+        mtime = None
+
+    with _gallery_lock:
+        if mtime is not None and (_gallery_store is None or mtime != _gallery_store_mtime):
+            try:
+                store = GalleryStore(GALLERY_STORE_PATH)
+            except Exception as e:
+                print(f"[GALLERY] Failed to open gallery store: {e}")
+                return None
+            previous, _gallery_store, _gallery_store_mtime = _gallery_store, store, mtime
+            print(f"[GALLERY] Loaded {len(store)} entries from {GALLERY_STORE_PATH}")
+            # 이전 mmap은 읽는 요청이 없으면 바로, 있으면 마지막 요청이 끝날 때 닫음
+            if previous is not None and previous._readers == 0:
+                previous.close()
+        if mtime is None or _gallery_store is None:
+            return None
+        _gallery_store._readers += 1
+        return _gallery_store
+
+
+def _release_gallery_store(store: GalleryStore):
+    with _gallery_lock:
+        store._readers -= 1
+        if store._readers == 0 and store is not _gallery_store:
+            store.close()
+
+
+@contextmanager
+def get_gallery_store() -> Iterator[Optional[GalleryStore]]:
+    """Shared gallery store (or None), kept open for the duration of the block"""
+    store = _acquire_gallery_store()
+    try:
+        yield store
+    finally:
+        if store is not None:
+            _release_gallery_store(store)
@@ -0,0 +1,403 @@
+"""
+Asynchronous jobs - 프록시 유휴 타임아웃보다 오래 걸리는 요청을 작업 큐로 처리
+POST /api/jobs는 작업 ID를 바로 돌려주고, 워커 스레드가 SQLite 큐를 비웁니다.
+결과는 GET /api/jobs/{id} (?wait=N 롱 폴링)으로 가져갑니다.
+워커는 클라이언트를 번갈아 가며 작업을 꺼내므로(라운드 로빈) 한 클라이언트가 큐를 채워도
+다른 클라이언트의 작업이 뒤로 밀리지 않습니다.
+
+큐는 디스크(JOBS_DB_PATH)에 있으므로 컨테이너가 재시작되어도 접수된 작업은 유지되고,
+재시작 시점에 실행 중이던 작업은 다시 대기열로 돌아갑니다.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from routing import routing_hash
+from scheduler import AdmissionRejected
+
+# 모델이 아직 준비되지 않았을 때 작업을 다시 시도하기까지 대기 시간(초)
+_MODEL_NOT_READY_RETRY = 5.0
+# 다른 프로세스가 넣은 작업 / 롱 폴링 상태 확인 주기(초)
+_POLL_INTERVAL = 0.5
+# 워커가 만료된 결과를 정리하는 주기(초)
+_PURGE_INTERVAL = 60.0
+
+FINISHED_STATUSES = ("succeeded", "failed")
+
+
+class JobConflict(Exception):
+    """Idempotency key reused with a different request"""
+
+
+class QueueFull(Exception):
+    """Too many queued jobs"""
+
+
+class ClientQueueFull(QueueFull):
+    """Too many queued jobs for one client"""
+
+
+def new_job_id(kind: str, payload: Dict[str, Any]) -> str:
+    """Job ID prefixed with the request's routing hash, so router.py can route lookups to this replica"""
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    return f"{routing_hash(f'/api/{kind}', body):016x}-{uuid.uuid4().hex[:16]}"
+
+
+class JobStore:
+    """SQLite-backed job queue and result table (one connection per thread, WAL mode)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, kind TEXT NOT NULL, client TEXT NOT NULL, "
+            "idempotency_key TEXT UNIQUE, payload TEXT NOT NULL, payload_hash TEXT NOT NULL, "
+            "status TEXT NOT NULL, result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+            "created_at REAL NOT NULL, not_before REAL NOT NULL, started_at REAL, finished_at REAL, expires_at REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, not_before, created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_client ON jobs (client, status)")
+        # 클라이언트별 마지막으로 작업을 꺼낸 시각 (라운드 로빈 순서)
+        conn.execute("CREATE TABLE IF NOT EXISTS job_clients (client TEXT PRIMARY KEY, last_claimed REAL NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # 트랜잭션은 BEGIN IMMEDIATE로 직접 관리
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        return conn
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def submit(self, kind: str, payload: Dict[str, Any], client: str, idempotency_key: Optional[str] = None,
+               max_queued: int = 0, max_queued_per_client: int = 0) -> Tuple[Dict[str, Any], bool]:
+        """Queue a job; returns (job, created). An existing job is returned for a repeated idempotency key"""
+        payload_json = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+        payload_hash = hashlib.sha256(f"{kind}\x1f{payload_json}".encode("utf-8")).hexdigest()
+        # 멱등 키는 클라이언트별로 구분
+        scoped_key = f"{client}\x1f{idempotency_key}" if idempotency_key else None
+        now = time.time()
+
+        conn = self._transaction()
+        try:
+            self._purge_expired(conn, now)
+            if scoped_key is not None:
+                row = conn.execute("SELECT * FROM jobs WHERE idempotency_key = ?", (scoped_key,)).fetchone()
+                if row is not None:
+                    if row["payload_hash"] != payload_hash:
+                        raise JobConflict("Idempotency-Key was already used with a different request")
+                    conn.execute("COMMIT")
+                    return self._to_dict(row), False
+
+            if max_queued_per_client:
+                (queued,) = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE client = ? AND status = 'queued'", (client,)
+                ).fetchone()
+                if queued >= max_queued_per_client:
+                    raise ClientQueueFull(f"{queued} jobs from this client are already queued")
+            if max_queued:
+                (queued,) = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()
+                if queued >= max_queued:
+                    raise QueueFull(f"{queued} jobs are already queued")
+
+            job_id = new_job_id(kind, payload)
+            conn.execute(
+                "INSERT INTO jobs (id, kind, client, idempotency_key, payload, payload_hash, status, created_at, not_before) "
+                "VALUES (?, ?, ?, ?, ?, ?, 'queued', ?, ?)",
+                (job_id, kind, client, scoped_key, payload_json, payload_hash, now, now),
+            )
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            conn.execute("COMMIT")
+            return self._to_dict(row), True
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """Atomically move a runnable queued job to 'running'
+
+        Clients take turns: the oldest job of the client that was served least recently goes first.
+        """
+        now = time.time()
+        conn = self._transaction()
+        try:
+            row = conn.execute(
+                "SELECT jobs.* FROM jobs LEFT JOIN job_clients ON job_clients.client = jobs.client "
+                "WHERE jobs.status = 'queued' AND jobs.not_before <= ? "
+                "ORDER BY COALESCE(job_clients.last_claimed, 0), jobs.created_at LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ? WHERE id = ?",
+                (now, row["id"]),
+            )
+            conn.execute(
+                "INSERT INTO job_clients (client, last_claimed) VALUES (?, ?) "
+                "ON CONFLICT (client) DO UPDATE SET last_claimed = excluded.last_claimed",
+                (row["client"], now),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        job = self._to_dict(row)
+        job.update(status="running", attempts=job["attempts"] + 1, started_at=now)
+        return job
+
+    def finish(self, job_id: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None,
+               ttl: Optional[float] = None):
+        now = time.time()
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, expires_at = ? WHERE id = ?",
+            (
+                "failed" if error is not None else "succeeded",
+                json.dumps(result, ensure_ascii=False) if result is not None else None,
+                error,
+                now,
+                now + ttl if ttl else None,
+                job_id,
+            ),
+        )
+
+    def retry_later(self, job_id: str, delay: float):
+        """Put a running job back in the queue without counting the attempt"""
+        self._connect().execute(
+            "UPDATE jobs SET status = 'queued', attempts = attempts - 1, started_at = NULL, not_before = ? "
+            "WHERE id = ?",
+            (time.time() + delay, job_id),
+        )
+
+    def recover(self, max_attempts: int, ttl: Optional[float] = None) -> int:
+        """After a restart: requeue jobs left 'running', failing those that already used every attempt"""
+        now = time.time()
+        conn = self._transaction()
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, expires_at = ? "
+                "WHERE status = 'running' AND attempts >= ?",
+                (f"Gave up after {max_attempts} interrupted attempts", now, now + ttl if ttl else None, max_attempts),
+            )
+            requeued = conn.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'"
+            ).rowcount
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return requeued
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or (row["expires_at"] is not None and row["expires_at"] < time.time()):
+            return None
+        return self._to_dict(row)
+
+    def queue_position(self, job: Dict[str, Any]) -> int:
+        """Estimated number of jobs that run first (up to one per turn from every other client)"""
+        conn = self._connect()
+        (own,) = conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND client = ? AND created_at < ?",
+            (job["client"], job["created_at"]),
+        ).fetchone()
+        others = conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND client != ? GROUP BY client", (job["client"],)
+        ).fetchall()
+        return own + sum(min(count, own + 1) for (count,) in others)
+
+    def counts(self) -> Dict[str, int]:
+        rows = self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def purge_expired(self) -> int:
+        """Delete expired results; returns how many jobs were removed"""
+        conn = self._transaction()
+        try:
+            removed = self._purge_expired(conn, time.time())
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return removed
+
+    @staticmethod
+    def _purge_expired(conn: sqlite3.Connection, now: float) -> int:
+        removed = conn.execute("DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at < ?", (now,)).rowcount
+        if removed:
+            conn.execute("DELETE FROM job_clients WHERE client NOT IN (SELECT client FROM jobs)")
+        return removed
+
+
+class JobQueue:
+    """Worker threads that drain the job store through the routes pipelines"""
+
+    def __init__(self, store: JobStore, workers: int = 1, result_ttl: float = 86400,
+                 max_attempts: int = 3, max_queued: int = 1000, max_queued_per_client: int = 50):
+        self.store = store
+        self.workers = max(1, workers)
+        self.result_ttl = result_ttl or None
+        self.max_attempts = max_attempts
+        self.max_queued = max_queued
+        self.max_queued_per_client = max_queued_per_client
+        self._cond = threading.Condition()
+        self._threads = []
+        self._purge_lock = threading.Lock()
+        self._last_purge = 0.0
+
+    def start(self):
+        if self._threads:
+            return
+        requeued = self.store.recover(self.max_attempts, self.result_ttl)
+        if requeued:
+            print(f"[JOBS] Requeued {requeued} jobs interrupted by a restart")
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"[JOBS] {self.workers} job workers started (queue: {self.store.path})")
+
+    def submit(self, kind: str, data: Any, client: str, idempotency_key: Optional[str] = None):
+        """Validate and queue a request; returns (job, created). Raises RequestError for invalid bodies"""
+        from routes import PIPELINES, RequestError
+
+        if not isinstance(kind, str) or kind not in PIPELINES:
+            raise RequestError(400, "Unknown job kind", f"'kind' must be one of: {', '.join(PIPELINES)}")
+        parse_request, _ = PIPELINES[kind]
+        request = parse_request(data)
+        job, created = self.store.submit(
+            kind, request.model_dump(exclude_none=True), client, idempotency_key,
+            self.max_queued, self.max_queued_per_client,
+        )
+        if created:
+            with self._cond:
+                self._cond.notify_all()
+        return job, created
+
+    def _purge(self):
+        """Delete expired results at most once per _PURGE_INTERVAL, even when no jobs are submitted"""
+        now = time.monotonic()
+        if now - self._last_purge < _PURGE_INTERVAL or not self._purge_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_purge = now
+            removed = self.store.purge_expired()
+            if removed:
+                print(f"[JOBS] Purged {removed} expired jobs")
+        except Exception as e:
+            print(f"[JOBS] Failed to purge expired jobs: {e}")
+        finally:
+            self._purge_lock.release()
+
+    def _worker_loop(self):
+        while True:
+            self._purge()
+            try:
+                job = self.store.claim()
+            except Exception as e:
+                print(f"[JOBS] Failed to claim a job: {e}")
+                job = None
+            if job is None:
+                with self._cond:
+                    self._cond.wait(_POLL_INTERVAL * 2)
+                continue
+            self._run(job)
+            with self._cond:
+                self._cond.notify_all()
+
+    def _run(self, job: Dict[str, Any]):
+        from routes import PIPELINES, ModelNotReady
+
+        print(f"[JOBS] Running {job['kind']} job {job['id']} (attempt {job['attempts']})")
+        started = time.perf_counter()
+        parse_request, run_pipeline = PIPELINES[job["kind"]]
+        try:
+            result = run_pipeline(parse_request(job["payload"]), job["client"])
+        except AdmissionRejected as e:
+            # 클라이언트 속도 제한 / 과부하 - 실패로 처리하지 않고 나중에 다시 실행
+            self.store.retry_later(job["id"], max(1.0, e.retry_after))
+        except ModelNotReady:
+            self.store.retry_later(job["id"], _MODEL_NOT_READY_RETRY)
+        except Exception as e:
+            print(f"[JOBS] Job {job['id']} failed: {e}")
+            self.store.finish(job["id"], error=str(e), ttl=self.result_ttl)
+        else:
+            self.store.finish(job["id"], result=result, ttl=self.result_ttl)
+            print(f"[JOBS] Job {job['id']} succeeded in {time.perf_counter() - started:.2f}s")
+
+    def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """Return the job once it has finished or `timeout` seconds have passed (long poll)"""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.store.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in FINISHED_STATUSES or remaining <= 0:
+                return job
+            with self._cond:
+                self._cond.wait(min(_POLL_INTERVAL, remaining))
+
+    def describe(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """Client-facing view of a job"""
+        view = {
+            "job_id": job["id"],
+            "kind": job["kind"],
+            "status": job["status"],
+            "attempts": job["attempts"],
+            "created_at": job["created_at"],
+            "started_at": job["started_at"],
+            "finished_at": job["finished_at"],
+            "expires_at": job["expires_at"],
+        }
+        if job["status"] == "queued":
+            view["queue_position"] = self.store.queue_position(job)
+        if job["status"] == "succeeded":
+            view["result"] = job["result"]
+        if job["status"] == "failed":
+            view["error"] = job["error"]
+        return view
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"workers": len(self._threads), "jobs": self.store.counts()}
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Shared job queue (workers are started by main.py)"""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            from config import (
+                JOBS_DB_PATH, JOBS_WORKERS, JOBS_RESULT_TTL, JOBS_MAX_ATTEMPTS, JOBS_MAX_QUEUED,
+                JOBS_MAX_QUEUED_PER_CLIENT,
+            )
+
+            _job_queue = JobQueue(
+                JobStore(JOBS_DB_PATH), JOBS_WORKERS, JOBS_RESULT_TTL, JOBS_MAX_ATTEMPTS, JOBS_MAX_QUEUED,
+                JOBS_MAX_QUEUED_PER_CLIENT,
+            )
+        return _job_queue
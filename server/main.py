@@ -2,20 +2,38 @@
 HTTP Server for GPT Token Visualizer
 Entry point for the visualization server using Python's built-in HTTP server.
 """
+import time
+
+# 프로세스 시작 시각 - import 단계 소요 시간 측정용
+_BOOT_STARTED = time.perf_counter()
+
+import hmac
 import json
+import math
 import sys
 from typing import Dict, Any
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import urlparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote
 from datetime import datetime
 
-from config import SERVER_HOST, SERVER_PORT, API_VERSION, SERVICE_NAME
-from model import ensure_model_loaded, llama, GGUF_PATH
+from config import (
+    SERVER_HOST, SERVER_PORT, API_VERSION, SERVICE_NAME, ADMISSION_TRUST_FORWARDED_FOR, ADMISSION_API_KEYS,
+    DEBUG_PROFILE_ENABLED, DEBUG_PROFILE_TOKEN, DEBUG_PROFILE_MAX_SECONDS, TOKENIZE_MAX_CHARS,
+    JOBS_MAX_WAIT, IDEMPOTENCY_KEY_MAX_LENGTH,
+)
+from model import (
+    start_background_load, is_model_ready, get_load_status,
+    record_startup_phase, GGUF_PATH,
+)
+from scheduler import admission_scheduler, AdmissionRejected
 
 
 class VisualizeHandler(BaseHTTPRequestHandler):
     """HTTP handler for visualization endpoints"""
     
+    # keep-alive 지원 (라우터의 연결 풀 재사용) - 모든 응답에 Content-Length 필요
+    protocol_version = "HTTP/1.1"
+    
     def _log_request(self, method: str, path: str, status_code: int = None, reason: str = None):
         """Log all incoming requests with details"""
         client_ip = self.client_address[0] if self.client_address else 'unknown'
@@ -38,11 +56,26 @@ class VisualizeHandler(BaseHTTPRequestHandler):
             if headers_info:
                 print(f"  Headers: {', '.join(headers_info)}")
     
+    def _client_key(self) -> str:
+        """Identify the client for fair queuing (a registered API key if given, otherwise IP)"""
+        api_key = (self.headers.get('X-API-Key') or '').strip() if self.headers else ''
+        # 등록되지 않은 키는 요청마다 바꿔서 새 버킷을 받을 수 있으므로 무시
+        if api_key and api_key in ADMISSION_API_KEYS:
+            return f"key:{api_key}"
+        
+        if ADMISSION_TRUST_FORWARDED_FOR and self.headers:
+            forwarded_for = self.headers.get('X-Forwarded-For')
+            if forwarded_for:
+                # 마지막 값은 신뢰할 수 있는 프록시가 추가한 실제 클라이언트 IP
+                return forwarded_for.split(',')[-1].strip()
+        
+        return self.client_address[0] if self.client_address else 'unknown'
+    
     def _set_cors_headers(self):
         """Set CORS headers"""
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, DELETE, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, X-API-Key, X-Debug-Token, Idempotency-Key')
     
     def do_OPTIONS(self):
         """Handle OPTIONS request for CORS"""
@@ -51,6 +84,7 @@ class VisualizeHandler(BaseHTTPRequestHandler):
         
         self.send_response(200)
         self._set_cors_headers()
+        self.send_header('Content-Length', '0')
         self.end_headers()
     
     def do_GET(self):
@@ -60,8 +94,19 @@ class VisualizeHandler(BaseHTTPRequestHandler):
         
         if parsed_path.path == '/health' or parsed_path.path == '/':
             self._handle_health()
+        elif parsed_path.path == '/health/live':
+            # 프로세스가 응답할 수 있으면 항상 200
+            self._send_json_response(200, {"status": "alive"})
+        elif parsed_path.path == '/health/ready':
+            self._handle_ready()
+        elif parsed_path.path == '/api/gallery':
+            self._handle_gallery()
+        elif parsed_path.path.startswith('/api/jobs/'):
+            self._handle_get_job(unquote(parsed_path.path[len('/api/jobs/'):]), parse_qs(parsed_path.query))
+        elif parsed_path.path == '/debug/profile' and DEBUG_PROFILE_ENABLED:
+            self._handle_profile(parse_qs(parsed_path.query))
         else:
-            reason = f"Path '{parsed_path.path}' is not supported. Supported paths: /, /health"
+            reason = f"Path '{parsed_path.path}' is not supported. Supported paths: /, /health, /health/live, /health/ready, /api/gallery, /api/jobs/{job_id}"
             self._send_error(404, "Not Found", reason)
     
     def do_POST(self):
@@ -70,16 +115,53 @@ class VisualizeHandler(BaseHTTPRequestHandler):
         self._log_request('POST', parsed_path.path)
         
         if parsed_path.path == '/api/visualize':
-            self._handle_visualize()
+            self._handle_pipeline('visualize')
+        elif parsed_path.path == '/api/embed':
+            self._handle_pipeline('embed')
+        elif parsed_path.path == '/api/tokenize':
+            self._handle_tokenize()
+        elif parsed_path.path == '/api/jobs':
+            self._handle_submit_job()
+        else:
+            # keep-alive 연결에 본문이 남지 않도록 읽고 버림
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            reason = f"Path '{parsed_path.path}' is not supported. Supported paths: /api/visualize, /api/embed, /api/tokenize, /api/jobs"
+            self._send_error(404, "Not Found", reason)
+    
+    def do_DELETE(self):
+        """Handle DELETE requests"""
+        parsed_path = urlparse(self.path)
+        self._log_request('DELETE', parsed_path.path)
+        
+        if parsed_path.path.startswith('/api/sessions/'):
+            self._handle_delete_session(unquote(parsed_path.path[len('/api/sessions/'):]))
         else:
-            reason = f"Path '{parsed_path.path}' is not supported. Supported paths: /api/visualize"
+            reason = f"Path '{parsed_path.path}' is not supported. Supported paths: /api/sessions/{{session_id}}"
             self._send_error(404, "Not Found", reason)
     
+    def _handle_delete_session(self, session_id: str):
+        """End a multi-turn session and free its llama state"""
+        from sessions import get_session_manager
+        
+        if get_session_manager().delete(session_id):
+            self._send_json_response(200, {"session_id": session_id, "deleted": True})
+        else:
+            self._send_error(404, "Session not found", f"No active session with id '{session_id}'")
+    
+    def _handle_ready(self):
+        """Readiness probe - 200 only once the model is loaded"""
+        ready = is_model_ready()
+        status = get_load_status()
+        response = {"status": "ready" if ready else "not_ready", "model_state": status["state"]}
+        if ready:
+            self._send_json_response(200, response)
+        else:
+            self._log_request(self.command, '/health/ready', 503, f"Model {status['state']}")
+            self._send_body(503, 'application/json', json.dumps(response).encode('utf-8'))
+    
     def _handle_health(self):
         """Handle health check endpoint"""
-        from model import llama, GGUF_PATH
-        from pathlib import Path
-        import os
+        from gallery_store import get_gallery_store
         
         # 모델 파일 정보 확인
         model_exists = GGUF_PATH.exists()
@@ -104,87 +186,251 @@ class VisualizeHandler(BaseHTTPRequestHandler):
             "status": "healthy",
             "service": SERVICE_NAME,
             "version": API_VERSION,
-            "model_loaded": llama is not None,
+            "model_loaded": is_model_ready(),
+            "ready": is_model_ready(),
+            "model_load": get_load_status(),
             "model": {
                 "exists": model_exists,
                 "built_at_build_time": model_built_at_build_time,
                 "built_at": model_built_at,
                 "file_size_mb": round(model_file_size, 2) if model_file_size else None,
                 "path": str(GGUF_PATH)
-            }
+            },
+            "admission": admission_scheduler.snapshot()
         }
+        
+        with get_gallery_store() as gallery:
+            response["gallery_entries"] = len(gallery) if gallery is not None else 0
+        
+        from sessions import get_session_manager
+        from prefix_cache import get_prefix_cache
+        response["sessions"] = get_session_manager().snapshot()
+        prefix_cache = get_prefix_cache()
+        response["prefix_cache"] = prefix_cache.snapshot() if prefix_cache is not None else None
+        
+        from speculative import get_speculative_status
+        from jobs import get_job_queue
+        response["speculative"] = get_speculative_status()
+        response["jobs"] = get_job_queue().snapshot()
         self._send_json_response(200, response)
     
-    def _handle_visualize(self):
-        """Handle visualize endpoint"""
+    def _handle_gallery(self):
+        """List input texts that have precomputed visualizations"""
+        from gallery_store import get_gallery_store
+        
+        with get_gallery_store() as gallery:
+            texts = gallery.texts() if gallery is not None else []
+        self._send_json_response(200, {"entries": texts, "count": len(texts)})
+    
+    def _handle_profile(self, query: Dict[str, list]):
+        """Sample all threads for N seconds and return collapsed stacks (debug only)"""
+        # config.py는 토큰 없이 활성화하지 않지만, 빈 토큰과 비교해 통과하는 일이 없도록 다시 확인
+        token = self.headers.get('X-Debug-Token', '') if self.headers else ''
+        if not DEBUG_PROFILE_TOKEN or not hmac.compare_digest(token.encode('utf-8'), DEBUG_PROFILE_TOKEN.encode('utf-8')):
+            self._send_error(403, "Forbidden", "A valid X-Debug-Token header is required")
+            return
+        
+        try:
+            seconds = float(query.get('seconds', ['5'])[0])
+        except ValueError:
+            self._send_error(400, "Invalid seconds parameter", "'seconds' must be a number")
+            return
+        if not 0 < seconds <= DEBUG_PROFILE_MAX_SECONDS:
+            reason = f"'seconds' must be between 0 and {DEBUG_PROFILE_MAX_SECONDS:g}"
+            self._send_error(400, "Invalid seconds parameter", reason)
+            return
+        
+        from profiler import sample_stacks, ProfilerBusy
+        
+        try:
+            result = sample_stacks(seconds)
+        except ProfilerBusy as e:
+            self._send_error(409, "Profiler busy", str(e))
+            return
+        
+        if query.get('format', ['json'])[0] == 'collapsed':
+            # flamegraph.pl 등에 바로 넘길 수 있는 텍스트 형식
+            body = "\n".join(result["collapsed"]).encode('utf-8')
+            self._log_request(self.command, '/debug/profile', 200, 'Success')
+            self._send_body(200, 'text/plain; charset=utf-8', body)
+            return
+        
+        self._send_json_response(200, result)
+    
+    def _handle_tokenize(self):
+        """Handle tokenize preview endpoint (no generation, no inference model)"""
         try:
-            # Read request body
             content_length = int(self.headers.get('Content-Length', 0))
             body = self.rfile.read(content_length)
-            
-            # Parse JSON request
             request_data = json.loads(body.decode('utf-8'))
-            input_text = request_data.get('input_text', '')
-            
-            if not input_text:
-                reason = "Request body must contain 'input_text' field with a non-empty value"
-                self._send_error(400, "input_text is required", reason)
+            if not isinstance(request_data, dict):
+                self._send_error(400, "Invalid request body", "Request body must be a JSON object")
                 return
+            text = request_data.get('text', request_data.get('input_text', ''))
             
-            # Ensure model is loaded
-            if not ensure_model_loaded():
-                reason = "The AI model is not currently loaded. The server may still be initializing."
-                self._send_error(503, "Model is not loaded. Please try again later.", reason)
+            if not isinstance(text, str):
+                self._send_error(400, "text must be a string", "Request body field 'text' must be a string")
+                return
+            if len(text) > TOKENIZE_MAX_CHARS:
+                reason = f"'text' must be at most {TOKENIZE_MAX_CHARS} characters"
+                self._send_error(413, "Text too long", reason)
                 return
             
-            # Import visualization logic (visualize_sync will use model.llama internally)
-            from routes import visualize_sync
-            from schemas import VisualizeRequest
+            from tokenizer_service import get_tokenizer_service, TokenizerUnavailable
             
-            # Create request object
-            request = VisualizeRequest(input_text=input_text)
+            try:
+                tokens = get_tokenizer_service().tokenize(text)
+            except TokenizerUnavailable as e:
+                self._send_error(503, "Tokenizer is not available. Please try again later.", str(e))
+                return
             
-            # Call synchronous visualization function
-            response = visualize_sync(request)
+            self._send_json_response(200, {"tokens": tokens, "count": len(tokens)})
             
-            # Convert response to dict
-            response_dict = {
-                "tokens": [
-                    {
-                        "token": token.token,
-                        "destination": token.destination,
-                        "is_input": token.is_input
-                    }
-                    for token in response.tokens
-                ]
-            }
+        except json.JSONDecodeError as e:
+            reason = f"Request body is not valid JSON: {str(e)}"
+            self._send_error(400, "Invalid JSON in request body", reason)
+        except Exception as e:
+            print(f"[ERROR] Tokenize endpoint error: {e}")
+            import traceback
+            traceback.print_exc()
+            reason = f"An unexpected error occurred while processing the request: {str(e)}"
+            self._send_error(500, f"Internal server error: {str(e)}", reason)
+    
+    def _read_json_body(self):
+        content_length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(content_length)
+        return json.loads(body.decode('utf-8'))
+    
+    def _handle_pipeline(self, kind: str):
+        """Handle a model endpoint (visualize / embed) through its routes pipeline"""
+        try:
+            request_data = self._read_json_body()
+            
+            from routes import PIPELINES
             
+            parse_request, run_pipeline = PIPELINES[kind]
+            request = parse_request(request_data)
+            response_dict = run_pipeline(request, self._client_key())
             self._send_json_response(200, response_dict)
             
-        except json.JSONDecodeError as e:
+        except Exception as e:
+            self._send_pipeline_error(kind, e)
+    
+    def _handle_submit_job(self):
+        """Queue a visualize / embed request and return its job ID immediately"""
+        try:
+            request_data = self._read_json_body()
+            if not isinstance(request_data, dict):
+                self._send_error(400, "Invalid request body", "Request body must be a JSON object")
+                return
+            kind = request_data.pop('kind', 'visualize')
+            
+            from routes import PIPELINES
+            
+            if not isinstance(kind, str) or kind not in PIPELINES:
+                reason = f"'kind' must be one of: {', '.join(PIPELINES)}"
+                self._send_error(400, "Unknown job kind", reason)
+                return
+            
+            idempotency_key = self.headers.get('Idempotency-Key') if self.headers else None
+            if idempotency_key is not None and not 0 < len(idempotency_key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+                reason = f"Idempotency-Key must be 1-{IDEMPOTENCY_KEY_MAX_LENGTH} characters"
+                self._send_error(400, "Invalid Idempotency-Key", reason)
+                return
+            
+            from jobs import get_job_queue, JobConflict, QueueFull, ClientQueueFull
+            
+            job_queue = get_job_queue()
+            try:
+                job, created = job_queue.submit(kind, request_data, self._client_key(), idempotency_key)
+            except JobConflict as e:
+                self._send_error(409, "Idempotency key conflict", str(e))
+                return
+            except ClientQueueFull as e:
+                self._send_error(429, "Too many queued jobs. Please try again later.", str(e), headers={'Retry-After': '30'})
+                return
+            except QueueFull as e:
+                self._send_error(503, "Job queue is full. Please try again later.", str(e), headers={'Retry-After': '30'})
+                return
+            
+            # 같은 Idempotency-Key로 다시 보내면 기존 작업을 200으로 반환
+            status_code = 202 if created else 200
+            location = f"/api/jobs/{job['id']}"
+            self._log_request(self.command, '/api/jobs', status_code, 'Queued' if created else 'Existing job')
+            body = json.dumps({**job_queue.describe(job), "status_url": location}, ensure_ascii=False)
+            self._send_body(status_code, 'application/json', body.encode('utf-8'), {'Location': location})
+            
+        except Exception as e:
+            self._send_pipeline_error('jobs', e)
+    
+    def _handle_get_job(self, job_id: str, query: Dict[str, list]):
+        """Job status and result; ?wait=N long-polls until the job finishes"""
+        try:
+            wait = float(query.get('wait', ['0'])[0])
+        except ValueError:
+            self._send_error(400, "Invalid wait parameter", "'wait' must be a number of seconds")
+            return
+        wait = min(max(wait, 0.0), JOBS_MAX_WAIT)
+        
+        from jobs import get_job_queue
+        
+        job_queue = get_job_queue()
+        job = job_queue.wait(job_id, wait) if wait > 0 else job_queue.store.get(job_id)
+        if job is None:
+            self._send_error(404, "Job not found", f"No job with id '{job_id}' (it may have expired)")
+            return
+        self._send_json_response(200, job_queue.describe(job))
+    
+    def _send_pipeline_error(self, kind: str, e: Exception):
+        """Map pipeline exceptions to error responses"""
+        from routes import RequestError, ModelNotReady
+        
+        if isinstance(e, RequestError):
+            self._send_error(e.status_code, e.message, e.reason)
+        elif isinstance(e, ModelNotReady):
+            self._send_error(
+                503,
+                "Model is not loaded. Please try again later.",
+                str(e),
+                headers={'Retry-After': str(max(1, math.ceil(e.retry_after)))}
+            )
+        elif isinstance(e, AdmissionRejected):
+            self._send_error(
+                429,
+                "Too many requests. Please try again later.",
+                e.reason,
+                headers={'Retry-After': str(max(1, math.ceil(e.retry_after)))}
+            )
+        elif isinstance(e, json.JSONDecodeError):
             reason = f"Request body is not valid JSON: {str(e)}"
             self._send_error(400, "Invalid JSON in request body", reason)
-        except Exception as e:
-            print(f"[ERROR] Visualize endpoint error: {e}")
+        else:
+            print(f"[ERROR] {kind.capitalize()} endpoint error: {e}")
             import traceback
             traceback.print_exc()
             reason = f"An unexpected error occurred while processing the request: {str(e)}"
             self._send_error(500, f"Internal server error: {str(e)}", reason)
     
+    def _send_body(self, status_code: int, content_type: str, body: bytes, headers: Dict[str, str] = None):
+        """Write status, headers and body (with Content-Length for keep-alive)"""
+        self.send_response(status_code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self._set_cors_headers()
+        self.end_headers()
+        self.wfile.write(body)
+    
     def _send_json_response(self, status_code: int, data: Dict[str, Any]):
         """Send JSON response"""
         parsed_path = urlparse(self.path)
         self._log_request(self.command, parsed_path.path, status_code, 'Success')
         
-        self.send_response(status_code)
-        self.send_header('Content-Type', 'application/json')
-        self._set_cors_headers()
-        self.end_headers()
-        
         response_json = json.dumps(data, ensure_ascii=False)
-        self.wfile.write(response_json.encode('utf-8'))
+        self._send_body(status_code, 'application/json', response_json.encode('utf-8'))
     
-    def _send_error(self, status_code: int, message: str, reason: str = None):
+    def _send_error(self, status_code: int, message: str, reason: str = None, headers: Dict[str, str] = None):
         """Send error response with detailed reason"""
         parsed_path = urlparse(self.path)
         
@@ -201,19 +447,16 @@ class VisualizeHandler(BaseHTTPRequestHandler):
         # Add supported endpoints information for 404 errors
         if status_code == 404:
             if self.command == 'GET':
-                error_response["supported_paths"] = ["/", "/health"]
+                error_response["supported_paths"] = ["/", "/health", "/health/live", "/health/ready", "/api/gallery", "/api/jobs/{job_id}"]
             elif self.command == 'POST':
-                error_response["supported_paths"] = ["/api/visualize"]
+                error_response["supported_paths"] = ["/api/visualize", "/api/embed", "/api/tokenize", "/api/jobs"]
+            elif self.command == 'DELETE':
+                error_response["supported_paths"] = ["/api/sessions/{session_id}"]
         
         self._log_request(self.command, parsed_path.path, status_code, reason or message)
         
-        self.send_response(status_code)
-        self.send_header('Content-Type', 'application/json')
-        self._set_cors_headers()
-        self.end_headers()
-        
         response_json = json.dumps(error_response, ensure_ascii=False)
-        self.wfile.write(response_json.encode('utf-8'))
+        self._send_body(status_code, 'application/json', response_json.encode('utf-8'), headers)
     
     def log_message(self, format, *args):
         """Override to customize log format"""
@@ -222,28 +465,28 @@ class VisualizeHandler(BaseHTTPRequestHandler):
 
 def main():
     """Main entry point for the server"""
+    record_startup_phase("imports", time.perf_counter() - _BOOT_STARTED)
+    
     print(f"\n{'='*60}")
     print(f"Starting {SERVICE_NAME} Server")
     print(f"Host: {SERVER_HOST}")
     print(f"Port: {SERVER_PORT}")
     print(f"{'='*60}\n")
     
-    # Load model
-    print("[SERVER] Loading model...")
-    if not ensure_model_loaded():
-        print(f"[SERVER] ERROR: Failed to load model from {GGUF_PATH}")
-        print("[SERVER] Server will not start")
-        sys.exit(1)
+    # 모델은 백그라운드에서 로드 - 서버는 바로 요청을 받고 /health/ready로 준비 상태 보고
+    print("[SERVER] Loading model in background...")
+    start_background_load()
     
-    if llama is not None:
-        model_size = GGUF_PATH.stat().st_size / (1024 * 1024)
-        print(f"[SERVER] Model loaded successfully")
-        print(f"[SERVER] Model path: {GGUF_PATH}")
-        print(f"[SERVER] Model size: {model_size:.2f} MB")
+    # 재시작 전에 접수된 작업부터 이어서 처리 (모델이 준비될 때까지는 작업이 대기)
+    from jobs import get_job_queue
+    get_job_queue().start()
     
     # Create and start server
+    phase_started = time.perf_counter()
     server_address = (SERVER_HOST, SERVER_PORT)
-    httpd = HTTPServer(server_address, VisualizeHandler)
+    # 요청마다 스레드를 사용 - 모델 접근 순서는 admission_scheduler가 결정
+    httpd = ThreadingHTTPServer(server_address, VisualizeHandler)
+    record_startup_phase("server_bind", time.perf_counter() - phase_started)
     
     host_display = SERVER_HOST if SERVER_HOST != "0.0.0.0" else "localhost"
     print(f"\n{'='*60}")
@@ -251,9 +494,10 @@ def main():
     print(f"Version: {API_VERSION}")
     print(f"Host: {SERVER_HOST}")
     print(f"Port: {SERVER_PORT}")
-    print(f"Model Status: {'Loaded' if llama is not None else 'Not Loaded'}")
+    print(f"Model Path: {GGUF_PATH}")
     print(f"API URL: http://{host_display}:{SERVER_PORT}")
     print(f"Health Check: http://{host_display}:{SERVER_PORT}/health")
+    print(f"Readiness: http://{host_display}:{SERVER_PORT}/health/ready")
     print(f"{'='*60}\n")
     
     try:
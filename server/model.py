@@ -1,9 +1,18 @@
 import os
 import sys
 import io
+import threading
+import time
 from pathlib import Path
-from huggingface_hub import hf_hub_download
-from config import LLAMA_N_THREADS
+from config import (
+    LLAMA_N_THREADS,
+    LLAMA_N_BATCH,
+    MODEL_LOAD_MAX_ATTEMPTS,
+    MODEL_LOAD_RETRY_BASE,
+    MODEL_LOAD_RETRY_MAX,
+    MODEL_READY_TIMEOUT,
+    SPECULATIVE_MODE,
+)
 
 # Windows에서 UTF-8 인코딩 설정
 if sys.platform == 'win32':
@@ -89,6 +98,8 @@ def download_model_from_hf():
         return str(GGUF_PATH)
     
     print(f"Downloading model from Hugging Face: {HF_REPO_ID}/{HF_FILENAME}")
+    # huggingface_hub는 다운로드가 필요할 때만 import (서버 시작 시간 단축)
+    from huggingface_hub import hf_hub_download
     try:
         model_path = hf_hub_download(
             repo_id=HF_REPO_ID,
@@ -140,7 +151,9 @@ def load_gguf_model():
     # #region agent log
     debug_log("model.py:60", "BEFORE _import_llama_cpp", {}, "B")
     # #endregion
+    phase_started = time.perf_counter()
     Llama = _import_llama_cpp()
+    record_startup_phase("import_llama_cpp", time.perf_counter() - phase_started)
     # #region agent log
     debug_log("model.py:62", "AFTER _import_llama_cpp", {"Llama_class": str(type(Llama))}, "B")
     # #endregion
@@ -154,7 +167,9 @@ def load_gguf_model():
         print(f"Attempting to download model from Hugging Face...")
         try:
             # 모델이 없으면 Hugging Face에서 자동 다운로드
+            phase_started = time.perf_counter()
             downloaded_path = download_model_from_hf()
+            record_startup_phase("download_model", time.perf_counter() - phase_started)
             print(f"Model downloaded successfully: {downloaded_path}")
         except Exception as e:
             print(f"Failed to download model: {e}")
@@ -186,14 +201,26 @@ def load_gguf_model():
         sys.stderr = stderr_capture
         debug_log("model.py:constructor", "BEFORE Llama() CONSTRUCTOR", {"model_path": str(GGUF_PATH), "n_threads": n_threads, "embedding": True}, "H2")
         # #endregion
+        # speculative decoding을 쓰면 초안 검증에 모든 위치의 logits가 필요
+        # (draft 모델은 요청마다 speculative.speculative_decoding()이 붙였다 뗌)
+        from speculative import create_draft_model
+        draft_model = create_draft_model(SPECULATIVE_MODE)
+        
+        phase_started = time.perf_counter()
         llama = Llama(
             model_path=str(GGUF_PATH),
             n_ctx=4096,
             n_threads=n_threads,
+            n_batch=LLAMA_N_BATCH,
             n_gpu_layers=0,     # CPU 전용이면 0
             chat_format="llama-3",
             embedding=True,    # Enable embedding extraction (필수)
+            logits_all=draft_model is not None,
         )
+        record_startup_phase("llama_init", time.perf_counter() - phase_started)
+        if draft_model is not None:
+            logits_mb = llama.n_ctx() * llama.n_vocab() * 4 / (1024 * 1024)
+            print(f"[SPECULATIVE] Main model loaded with logits_all=True (+{logits_mb:.0f} MB for full-vocabulary logits)")
         sys.stderr = old_stderr
         stderr_output = stderr_capture.getvalue()
         if stderr_output:
@@ -226,85 +253,100 @@ def load_gguf_model():
     return llama
 
 
-# Load model (lazy loading - will be loaded on first request if not already loaded)
+# Load model (background preload - main.py starts loading at boot, requests wait for readiness)
 llama = None
-_model_loading = False
-_model_load_error = None
 
-def ensure_model_loaded():
-    """Ensure model is loaded, load if not already loaded"""
-    global llama, _model_loading, _model_load_error
-    
-    # #region agent log
-    import json
-    import time
-    import threading
-    from pathlib import Path
-    # 절대 경로 사용하여 로그 파일 생성
-    project_root = Path(__file__).resolve().parent.parent
-    log_dir = project_root / ".cursor"
-    log_dir.mkdir(exist_ok=True)
-    log_path = log_dir / "debug.log"
-    def debug_log(location, message, data, hypothesis_id):
+_load_lock = threading.Lock()
+_load_cond = threading.Condition(_load_lock)
+_load_thread = None
+_load_state = {
+    "state": "idle",        # idle | loading | retrying | ready | failed
+    "attempts": 0,
+    "last_error": None,
+    "next_retry_in": None,
+}
+
+# 시작 단계별 소요 시간 (/health에서 보고)
+_startup_phases = {}
+
+
+def record_startup_phase(name: str, seconds: float):
+    """Record how long a startup phase took"""
+    _startup_phases[name] = round(seconds, 3)
+
+
+def get_llama():
+    """Currently loaded model (None until ready)"""
+    return llama
+
+
+def is_model_ready() -> bool:
+    return llama is not None
+
+
+def get_load_status():
+    """Loader state and startup phase timings for /health"""
+    with _load_lock:
+        return {**_load_state, "startup_phases": dict(_startup_phases)}
+
+
+def start_background_load():
+    """Start loading the model in a background thread (no-op if loaded or already loading)"""
+    global _load_thread
+    with _load_lock:
+        if llama is not None or (_load_thread is not None and _load_thread.is_alive()):
+            return
+        _load_state.update(state="loading", attempts=0, last_error=None, next_retry_in=None)
+        _load_thread = threading.Thread(target=_load_with_retry, name="model-loader", daemon=True)
+        _load_thread.start()
+
+
+def _load_with_retry():
+    """Load the model, retrying failures with exponential backoff"""
+    global llama
+    started = time.perf_counter()
+    for attempt in range(1, MODEL_LOAD_MAX_ATTEMPTS + 1):
+        with _load_lock:
+            _load_state.update(state="loading", attempts=attempt, next_retry_in=None)
         try:
-            log_entry = {
-                "sessionId": "debug-session",
-                "runId": "run1",
-                "hypothesisId": hypothesis_id,
-                "location": location,
-                "message": message,
-                "data": data,
-                "timestamp": int(time.time() * 1000)
-            }
-            with open(log_path, "a", encoding="utf-8") as f:
-                f.write(json.dumps(log_entry) + "\n")
-                f.flush()  # 즉시 디스크에 쓰기
+            print(f"Model not loaded, loading now... (attempt {attempt}/{MODEL_LOAD_MAX_ATTEMPTS})")
+            loaded = load_gguf_model()
         except Exception as e:
-            print(f"[DEBUG LOG ERROR] {e}")  # 로그 실패 시 출력
-    debug_log("model.py:187", "ensure_model_loaded ENTRY", {"llama_is_none": llama is None, "_model_loading": _model_loading, "_model_load_error": _model_load_error}, "E")
-    # #endregion
-    
+            print(f"Model load failed: {e}")
+            import traceback
+            traceback.print_exc()
+
+            if attempt == MODEL_LOAD_MAX_ATTEMPTS:
+                # 실패를 영구히 캐시하지 않음 - 다음 요청이 start_background_load()로 다시 시도
+                with _load_cond:
+                    _load_state.update(state="failed", last_error=str(e))
+                    _load_cond.notify_all()
+                return
+
+            delay = min(MODEL_LOAD_RETRY_BASE * (2 ** (attempt - 1)), MODEL_LOAD_RETRY_MAX)
+            with _load_lock:
+                _load_state.update(state="retrying", last_error=str(e), next_retry_in=delay)
+            time.sleep(delay)
+        else:
+            with _load_cond:
+                llama = loaded
+                _load_state.update(state="ready", last_error=None)
+                record_startup_phase("model_load_total", time.perf_counter() - started)
+                _load_cond.notify_all()
+            return
+
+
+def ensure_model_loaded(timeout: float = None):
+    """Ensure model is loaded, waiting up to `timeout` seconds for the background loader"""
     if llama is not None:
-        # #region agent log
-        debug_log("model.py:103", "MODEL ALREADY LOADED", {}, "E")
-        # #endregion
         return True
-    
-    if _model_loading:
-        # Model is currently loading, wait a bit
-        import time
-        time.sleep(1)
-        return llama is not None
-    
-    if _model_load_error:
-        # Previous load attempt failed
-        # #region agent log
-        debug_log("model.py:113", "PREVIOUS LOAD ERROR EXISTS", {"error": _model_load_error}, "E")
-        # #endregion
-        return False
-    
-    try:
-        _model_loading = True
-        print("Model not loaded, loading now...")
-        # #region agent log
-        debug_log("model.py:118", "CALLING load_gguf_model", {}, "E")
-        # #endregion
-        llama = load_gguf_model()
-        _model_loading = False
-        # #region agent log
-        debug_log("model.py:121", "load_gguf_model SUCCESS", {"llama_loaded": llama is not None}, "E")
-        # #endregion
-        return True
-    except Exception as e:
-        _model_loading = False
-        _model_load_error = str(e)
-        # #region agent log
-        debug_log("model.py:125", "load_gguf_model EXCEPTION", {"error_type": type(e).__name__, "error_message": str(e), "error_repr": repr(e)}, "E")
-        # #endregion
-        print(f"Model load failed: {e}")
-        import traceback
-        traceback.print_exc()
-        return False
 
-# 모듈 레벨에서 자동 로드 제거 - startup_event나 첫 요청 시 로드
+    start_background_load()
+    if timeout is None:
+        timeout = MODEL_READY_TIMEOUT
+    with _load_cond:
+        _load_cond.wait_for(lambda: llama is not None or _load_state["state"] == "failed", timeout)
+    return llama is not None
+
+# 모듈 레벨에서 자동 로드하지 않음 - main.py가 부팅 시 start_background_load() 호출
 # 이렇게 하면 빌드 타임에 download_model_from_hf()만 실행하고 llama_cpp는 import하지 않음
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Offline corpus precompute
+JSONL 입력을 워커 프로세스들로 병렬 처리하여 갤러리 저장소(gallery_store.py)에 기록합니다.
+
+Usage:
+    python precompute.py prompts.jsonl --workers 4
+    python precompute.py prompts.jsonl -o gallery/gallery.bin --merge
+
+Each input line is either a JSON string or an object with an "input_text" field.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from pathlib import Path
+
+from gallery_store import GalleryStore, normalize_input_text, write_gallery_store
+
+
+def read_inputs(path: Path):
+    """Read unique, non-empty input texts from a JSONL file"""
+    texts = []
+    seen = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"[PRECOMPUTE] Skipping line {line_no}: invalid JSON ({e})")
+                continue
+            text = item.get("input_text") if isinstance(item, dict) else item
+            if not isinstance(text, str):
+                print(f"[PRECOMPUTE] Skipping line {line_no}: expected a string or an object with a string \"input_text\"")
+                continue
+            text = normalize_input_text(text)
+            if text and text not in seen:
+                seen.add(text)
+                texts.append(text)
+    return texts
+
+
+def _init_worker(n_threads: int):
+    """Load one model per worker process"""
+    # config.py가 import되기 전에 스레드 수를 지정해야 함
+    os.environ["LLAMA_N_THREADS"] = str(n_threads)
+    from model import ensure_model_loaded
+
+    # 워커에서는 모델 다운로드까지 기다릴 수 있도록 넉넉한 대기 시간 사용
+    if not ensure_model_loaded(timeout=3600):
+        raise RuntimeError("Model could not be loaded in worker process")
+
+
+def _process(text: str):
+    from routes import visualize_sync
+    from schemas import VisualizeRequest
+
+    response = visualize_sync(VisualizeRequest(input_text=text))
+    return text, [(t.token, t.destination, t.is_input) for t in response.tokens]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute visualizations into a gallery store")
+    parser.add_argument("input", type=Path, help="JSONL file with input texts")
+    parser.add_argument("-o", "--output", type=Path, default=None,
+                        help="Gallery store path (default: config.GALLERY_STORE_PATH)")
+    parser.add_argument("-w", "--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2),
+                        help="Number of worker processes (one model each)")
+    parser.add_argument("--threads-per-worker", type=int, default=1,
+                        help="llama.cpp threads per worker process")
+    parser.add_argument("--merge", action="store_true",
+                        help="Keep entries already in the output store")
+    args = parser.parse_args()
+
+    if args.output is None:
+        from config import GALLERY_STORE_PATH
+        args.output = Path(GALLERY_STORE_PATH)
+
+    texts = read_inputs(args.input)
+    entries = {}
+    if args.merge and args.output.exists():
+        store = GalleryStore(args.output)
+        entries = dict(store.items())
+        store.close()
+        print(f"[PRECOMPUTE] Loaded {len(entries)} existing entries from {args.output}")
+        texts = [t for t in texts if t not in entries]
+
+    print(f"[PRECOMPUTE] {len(texts)} inputs, {args.workers} workers x {args.threads_per_worker} threads")
+    started = time.time()
+    failed = 0
+
+    # llama.cpp 스레드와 fork가 섞이지 않도록 spawn 사용
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(args.threads_per_worker,),
+    ) as executor:
+        futures = {executor.submit(_process, text): text for text in texts}
+        for done, future in enumerate(as_completed(futures), 1):
+            text = futures[future]
+            try:
+                text, rows = future.result()
+                entries[text] = rows
+            except Exception as e:
+                failed += 1
+                print(f"[PRECOMPUTE] Failed: {text[:50]!r}: {e}")
+            if done % 10 == 0 or done == len(futures):
+                elapsed = time.time() - started
+                print(f"[PRECOMPUTE] {done}/{len(futures)} done ({elapsed:.1f}s)")
+
+    count = write_gallery_store(args.output, entries.items())
+    size_kb = args.output.stat().st_size / 1024
+    print(f"[PRECOMPUTE] Wrote {count} entries ({size_kb:.1f} KB) to {args.output}")
+    if failed:
+        print(f"[PRECOMPUTE] {failed} inputs failed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
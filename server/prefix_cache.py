@@ -0,0 +1,206 @@
+"""
+Prefix cache - 최근 입력의 토큰열과 평가 상태를 기억해 수정된 뒷부분만 다시 평가
+프롬프트 끝을 고쳐 다시 보내면 가장 긴 공통 토큰 prefix의 KV 캐시와 토큰별 벡터를 재사용하므로,
+지연 시간이 전체 프롬프트 길이가 아니라 수정된 길이에 비례합니다.
+
+- 생성: 저장된 llama 상태를 복원하면 create_chat_completion의 prefix 매칭이 공통 부분을 건너뜀
+- 임베딩: 공통 prefix의 벡터는 그대로 쓰고 나머지 토큰만 eval하여 벡터를 읽음
+  (인과 모델이므로 prefix 토큰의 hidden state는 뒤 토큰과 무관). llama.embed()와 같이
+  입력을 n_batch 토큰에서 자르므로 캐시 적중 여부와 관계없이 같은 토큰의 벡터를 돌려줌
+
+저장된 상태는 KV 캐시(와 logits_all일 때 모든 위치의 logits)를 포함해 수십~수백 MB이므로
+PREFIX_CACHE_MAX_BYTES 안에서 오래된 항목부터 밀어내고, 짧은 입력은 저장하지 않습니다.
+"""
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils import compact_llama_state, generate_response
+
+
+def common_prefix_length(a, b) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+def state_nbytes(state) -> int:
+    """Approximate memory held by a saved llama state"""
+    return (
+        len(state.llama_state)
+        + getattr(state.scores, "nbytes", 0)
+        + getattr(state.input_ids, "nbytes", 0)
+    )
+
+
+class _Entry:
+    __slots__ = ("tokens", "vectors", "state", "nbytes", "last_used")
+
+    def __init__(self, tokens: List[int], vectors: Optional[np.ndarray], state):
+        self.tokens = tokens
+        self.vectors = vectors
+        self.state = state
+        self.nbytes = state_nbytes(state) + (vectors.nbytes if vectors is not None else 0)
+        self.last_used = 0
+
+
+class PrefixCache:
+    """LRU of evaluated states for recent inputs, separately for generation and embedding
+
+    Both LRUs share one byte budget; the least recently used entry of either kind is evicted first.
+    """
+
+    def __init__(self, max_entries: int = 8, min_prefix_tokens: int = 4, max_bytes: int = 512 * 1024 * 1024,
+                 min_store_tokens: int = 64):
+        self.max_entries = max(1, max_entries)
+        self.min_prefix_tokens = min_prefix_tokens
+        self.max_bytes = max_bytes
+        self.min_store_tokens = min_store_tokens
+        self._entries: Dict[str, "OrderedDict[Tuple[int, ...], _Entry]"] = {
+            "chat": OrderedDict(),
+            "embed": OrderedDict(),
+        }
+        self._nbytes = 0
+        self._clock = itertools.count(1)
+        self._lock = threading.Lock()
+        self.stats = {
+            "hits": 0, "misses": 0, "reused_tokens": 0, "evaluated_tokens": 0,
+            "stored": 0, "skipped_short": 0, "skipped_large": 0, "evicted": 0,
+        }
+
+    def _best_match(self, kind: str, tokens: List[int]) -> Tuple[Optional[_Entry], int]:
+        best, best_len = None, 0
+        for entry in self._entries[kind].values():
+            n = common_prefix_length(entry.tokens, tokens)
+            if n > best_len:
+                best, best_len = entry, n
+        if best is None or best_len < self.min_prefix_tokens:
+            self.stats["misses"] += 1
+            return None, 0
+        self._entries[kind].move_to_end(tuple(best.tokens))
+        best.last_used = next(self._clock)
+        self.stats["hits"] += 1
+        return best, best_len
+
+    def _should_store(self, tokens: List[int]) -> bool:
+        """Short inputs are cheap to re-evaluate, so their states are not worth the memory"""
+        if len(tokens) < self.min_store_tokens:
+            self.stats["skipped_short"] += 1
+            return False
+        return True
+
+    def _store(self, kind: str, entry: _Entry):
+        if self.max_bytes > 0 and entry.nbytes > self.max_bytes:
+            self.stats["skipped_large"] += 1
+            return
+        entries = self._entries[kind]
+        key = tuple(entry.tokens)
+        if key in entries:
+            self._nbytes -= entries.pop(key).nbytes
+        entry.last_used = next(self._clock)
+        entries[key] = entry
+        self._nbytes += entry.nbytes
+        self.stats["stored"] += 1
+
+        while len(entries) > self.max_entries:
+            self._evict(kind)
+        while self.max_bytes > 0 and self._nbytes > self.max_bytes:
+            # 두 LRU 중 가장 오래 사용하지 않은 항목부터
+            oldest = min(
+                (kind for kind, entries in self._entries.items() if entries),
+                key=lambda kind: next(iter(self._entries[kind].values())).last_used,
+            )
+            self._evict(oldest)
+
+    def _evict(self, kind: str):
+        _, entry = self._entries[kind].popitem(last=False)
+        self._nbytes -= entry.nbytes
+        self.stats["evicted"] += 1
+
+    def generate(self, llama, user_input: str, max_tokens: int = 512) -> str:
+        """generate_response() resuming from the cached chat state with the longest common input prefix"""
+        with self._lock:
+            tokens = llama.tokenize(user_input.encode("utf-8"), add_bos=False)
+            entry, prefix_len = self._best_match("chat", tokens)
+            if entry is not None:
+                # 상태 복원 후에는 create_chat_completion이 KV 캐시와 겹치는 앞부분을 재평가하지 않음
+                llama.load_state(entry.state)
+                self.stats["reused_tokens"] += prefix_len
+            self.stats["evaluated_tokens"] += len(tokens) - prefix_len
+
+            response = generate_response(llama, user_input, max_tokens)
+            if self._should_store(tokens):
+                self._store("chat", _Entry(tokens, None, compact_llama_state(llama.save_state())))
+            return response
+
+    def embed(self, llama, text: str) -> np.ndarray:
+        """Per-token hidden states for `text` (same tokens as llama.embed(text)), evaluating only the new suffix"""
+        import llama_cpp
+
+        with self._lock:
+            # llama.embed()와 같이 n_batch 토큰까지만 사용
+            tokens = llama.tokenize(text.encode("utf-8"))[:llama.n_batch]
+            entry, prefix_len = self._best_match("embed", tokens)
+            if entry is not None and prefix_len == len(tokens):
+                self.stats["reused_tokens"] += prefix_len
+                return entry.vectors[:prefix_len]
+
+            n_embd = llama.n_embd()
+            vectors = np.empty((len(tokens), n_embd), dtype=np.float32)
+            if entry is not None:
+                llama.load_state(entry.state)
+                # 공통 prefix 뒤의 KV는 다음 eval()이 지움
+                llama.n_tokens = prefix_len
+                vectors[:prefix_len] = entry.vectors[:prefix_len]
+                self.stats["reused_tokens"] += prefix_len
+            else:
+                llama.reset()
+
+            # 입력이 n_batch 이하이므로 남은 토큰은 한 번의 eval로 평가
+            suffix = tokens[prefix_len:]
+            llama.eval(suffix)
+            for j in range(len(suffix)):
+                ptr = llama_cpp.llama_get_embeddings_ith(llama.ctx, j)
+                vectors[prefix_len + j] = np.ctypeslib.as_array(ptr, shape=(n_embd,))
+            self.stats["evaluated_tokens"] += len(suffix)
+
+            if self._should_store(tokens):
+                self._store("embed", _Entry(tokens, vectors, compact_llama_state(llama.save_state())))
+            return vectors
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": {kind: len(entries) for kind, entries in self._entries.items()},
+                "max_entries": self.max_entries,
+                "bytes": self._nbytes,
+                "max_bytes": self.max_bytes,
+                "stats": dict(self.stats),
+            }
+
+
+_prefix_cache = None
+_prefix_cache_lock = threading.Lock()
+
+
+def get_prefix_cache() -> Optional[PrefixCache]:
+    """Shared prefix cache (None when PREFIX_CACHE_ENTRIES is 0)"""
+    global _prefix_cache
+    from config import (
+        PREFIX_CACHE_ENTRIES, PREFIX_CACHE_MIN_TOKENS, PREFIX_CACHE_MAX_BYTES, PREFIX_CACHE_STORE_MIN_TOKENS,
+    )
+
+    if PREFIX_CACHE_ENTRIES <= 0:
+        return None
+    with _prefix_cache_lock:
+        if _prefix_cache is None:
+            _prefix_cache = PrefixCache(
+                PREFIX_CACHE_ENTRIES, PREFIX_CACHE_MIN_TOKENS, PREFIX_CACHE_MAX_BYTES, PREFIX_CACHE_STORE_MIN_TOKENS
+            )
+        return _prefix_cache
@@ -0,0 +1,114 @@
+"""
+On-demand statistical profiler
+요청이 있을 때만 샘플링 스레드를 띄워 모든 스레드의 스택을 주기적으로 수집합니다.
+대기 중에는 스레드도 훅도 없으므로 비용이 없습니다.
+"""
+import linecache
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Any
+
+# llama_cpp.py의 바인딩은 ctypes 함수 자체라 파이썬 프레임이 없음 - 가장 안쪽 프레임이 바인딩을
+# 호출하는 줄(llama_cpp.llama_decode(...) 등)을 실행 중일 때만 네이티브로 분류
+_NATIVE_CALL = re.compile(r"\bllama_cpp\.(llama|ggml)_\w+\s*\(")
+
+# 소스를 읽을 수 없을 때(.pyc만 설치된 경우) 쓰는, 바인딩 호출만 감싼 알려진 진입점
+_NATIVE_ENTRY_POINTS = {
+    ("_internals.py", "decode"),
+    ("_internals.py", "tokenize"),
+    ("_internals.py", "token_to_piece"),
+    ("_internals.py", "detokenize"),
+    ("_internals.py", "sample"),
+    ("_internals.py", "get_embeddings"),
+    ("_internals.py", "kv_cache_clear"),
+}
+
+# 블로킹 대기 중인 스레드의 최상위 프레임 이름 (serve_forever, Condition.wait, 소켓 읽기 등)
+_IDLE_FUNCTIONS = {"wait", "select", "poll", "accept", "readinto", "_recv_bytes"}
+
+
+class ProfilerBusy(Exception):
+    """Raised when another profiling session is already running"""
+
+
+_profile_lock = threading.Lock()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename.replace("\\", "/").rsplit("/", 1)[-1]
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def _is_native(frame) -> bool:
+    """The innermost Python frame is calling into a llama.cpp binding, i.e. time is spent in the C library"""
+    code = frame.f_code
+    line = linecache.getline(code.co_filename, frame.f_lineno)
+    if line:
+        return _NATIVE_CALL.search(line) is not None
+    filename = code.co_filename.replace("\\", "/")
+    if "/llama_cpp/" not in filename:
+        return False
+    return (filename.rsplit("/", 1)[-1], code.co_name) in _NATIVE_ENTRY_POINTS
+
+
+def sample_stacks(seconds: float, interval: float = 0.005) -> Dict[str, Any]:
+    """Sample every thread's stack for `seconds` and return collapsed stacks plus a summary"""
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy("A profiling session is already running")
+
+    try:
+        own_thread = threading.get_ident()
+        stacks: Counter = Counter()
+        native_samples = 0
+        python_samples = 0
+        idle_samples = 0
+        sample_rounds = 0
+
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+
+                # 대기 중인 스레드는 별도 집계
+                if frame.f_code.co_name in _IDLE_FUNCTIONS:
+                    idle_samples += 1
+                    continue
+
+                if _is_native(frame):
+                    native_samples += 1
+                else:
+                    python_samples += 1
+
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(thread_id, f"thread-{thread_id}"))
+                stacks[";".join(reversed(labels))] += 1
+            sample_rounds += 1
+            time.sleep(interval)
+    finally:
+        _profile_lock.release()
+
+    busy_samples = native_samples + python_samples
+    return {
+        "seconds": seconds,
+        "interval": interval,
+        "sample_rounds": sample_rounds,
+        # flamegraph.pl / speedscope에서 바로 읽을 수 있는 collapsed stack 형식
+        "collapsed": [f"{stack} {count}" for stack, count in stacks.most_common()],
+        "summary": {
+            "busy_samples": busy_samples,
+            "idle_samples": idle_samples,
+            "native_samples": native_samples,
+            "python_samples": python_samples,
+            "native_ratio": round(native_samples / busy_samples, 4) if busy_samples else 0.0,
+            "python_ratio": round(python_samples / busy_samples, 4) if busy_samples else 0.0,
+        },
+    }
@@ -0,0 +1,246 @@
+"""
+Shared result store - 여러 레플리카가 계산 결과를 공유하기 위한 저장소
+RESULT_STORE_URL로 백엔드를 선택합니다 (비어 있으면 비활성화).
+
+    sqlite:///path/to/results.db   로컬/공유 디스크의 SQLite
+    file:///path/to/dir            키마다 파일 하나 (첫 줄 만료 시각, 둘째 줄 JSON 값)
+
+다른 백엔드(예: Redis)는 register_result_store_backend()로 등록할 수 있습니다.
+"""
+import hashlib
+import json
+from abc import ABC, abstractmethod
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import urlparse
+
+from gallery_store import normalize_input_text
+
+
+def result_key(kind: str, payload: Dict[str, Any]) -> str:
+    """Stable key for a request; input texts are normalized the same way the router hashes them"""
+    canonical = dict(payload)
+    if isinstance(canonical.get("input_text"), str):
+        canonical["input_text"] = normalize_input_text(canonical["input_text"])
+    if isinstance(canonical.get("texts"), list):
+        canonical["texts"] = [normalize_input_text(t) for t in canonical["texts"] if isinstance(t, str)]
+    encoded = json.dumps([kind, canonical], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class ResultStore(ABC):
+    """Backend interface: JSON-serializable values keyed by result_key()"""
+
+    # 만료된 항목을 정리하는 최소 간격(초) - put() 시점에 확인
+    purge_interval = 300.0
+
+    def __init__(self):
+        self._last_purge = 0.0
+        self._purge_lock = threading.Lock()
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Stored value, or None when missing or expired"""
+
+    @abstractmethod
+    def put(self, key: str, value: Dict[str, Any], ttl: Optional[float] = None):
+        """Store a value, expiring after `ttl` seconds (never when None)"""
+
+    def purge_expired(self) -> int:
+        """Delete expired entries; returns how many were removed (backends with native expiry keep the default)"""
+        return 0
+
+    def _maybe_purge(self, now: float):
+        """Run purge_expired() at most once per purge_interval (called from put)"""
+        if now - self._last_purge < self.purge_interval or not self._purge_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_purge = now
+            removed = self.purge_expired()
+            if removed:
+                print(f"[RESULT STORE] Purged {removed} expired entries")
+        except Exception as e:
+            print(f"[RESULT STORE] Purge failed: {e}")
+        finally:
+            self._purge_lock.release()
+
+
+class SqliteResultStore(ResultStore):
+    """SQLite-backed store (one connection per thread, WAL mode)"""
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, expires_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS results_expires ON results (expires_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            "SELECT value, expires_at FROM results WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            return None
+        return json.loads(value)
+
+    def put(self, key: str, value: Dict[str, Any], ttl: Optional[float] = None):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now + ttl if ttl else None),
+            )
+        self._maybe_purge(now)
+
+    def purge_expired(self) -> int:
+        with self._connect() as conn:
+            return conn.execute(
+                "DELETE FROM results WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),)
+            ).rowcount
+
+
+class FileResultStore(ResultStore):
+    """One file per key (works on any shared directory)
+
+    The first line holds the expiry time so purging does not have to parse the values.
+    """
+
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    @staticmethod
+    def _read_expiry(f) -> Optional[float]:
+        header = json.loads(f.readline())
+        return header.get("expires_at")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                expires_at = self._read_expiry(f)
+                if expires_at is not None and expires_at < time.time():
+                    return None
+                return json.load(f)
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    def put(self, key: str, value: Dict[str, Any], ttl: Optional[float] = None):
+        now = time.time()
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"expires_at": now + ttl if ttl else None}) + "\n")
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._maybe_purge(now)
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        removed = 0
+        for path in self.directory.glob("*/*.json"):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    expires_at = self._read_expiry(f)
+            except (OSError, ValueError, AttributeError):
+                # 읽을 수 없는 파일(이전 형식, 손상)도 정리
+                expires_at = 0.0
+            if expires_at is not None and expires_at < now:
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+
+_BACKENDS: Dict[str, Callable[[str], ResultStore]] = {
+    "sqlite": lambda url: SqliteResultStore(urlparse(url).path),
+    "file": lambda url: FileResultStore(urlparse(url).path),
+}
+
+
+def register_result_store_backend(scheme: str, factory: Callable[[str], ResultStore]):
+    """Register a backend factory for RESULT_STORE_URL values with the given scheme"""
+    _BACKENDS[scheme] = factory
+
+
+def create_result_store(url: str) -> Optional[ResultStore]:
+    if not url:
+        return None
+    scheme = urlparse(url).scheme
+    if scheme not in _BACKENDS:
+        raise ValueError(f"Unknown result store backend '{scheme}' (known: {', '.join(_BACKENDS)})")
+    return _BACKENDS[scheme](url)
+
+
+_result_store = None
+_result_store_created = False
+_result_store_lock = threading.Lock()
+
+
+def get_result_store() -> Optional[ResultStore]:
+    """Shared store configured by RESULT_STORE_URL (None when disabled or unavailable)"""
+    global _result_store, _result_store_created
+    if _result_store_created:
+        return _result_store
+
+    from config import RESULT_STORE_URL
+
+    with _result_store_lock:
+        if not _result_store_created:
+            try:
+                _result_store = create_result_store(RESULT_STORE_URL)
+                if _result_store is not None:
+                    print(f"[RESULT STORE] Using {RESULT_STORE_URL}")
+            except Exception as e:
+                print(f"[RESULT STORE] Failed to open result store: {e}")
+                _result_store = None
+            _result_store_created = True
+    return _result_store
+
+
+def lookup_shared_result(kind: str, payload: Dict[str, Any]):
+    """Return (key, cached value) from the shared store (key is None when the store is disabled)"""
+    store = get_result_store()
+    if store is None:
+        return None, None
+    key = result_key(kind, payload)
+    try:
+        return key, store.get(key)
+    except Exception as e:
+        # 저장소 장애로 요청이 실패하지 않도록 무시하고 직접 계산
+        print(f"[RESULT STORE] Lookup failed: {e}")
+        return key, None
+
+
+def save_shared_result(key: Optional[str], value: Dict[str, Any]):
+    if key is None:
+        return
+    from config import RESULT_STORE_TTL
+
+    try:
+        get_result_store().put(key, value, ttl=RESULT_STORE_TTL or None)
+    except Exception as e:
+        print(f"[RESULT STORE] Save failed: {e}")
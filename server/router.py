@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Routing front process for multiple server replicas
+정규화한 input_text를 consistent-hash 링에 올려 항상 같은 레플리카로 보내므로,
+레플리카 N개가 같은 캐시를 N번 복제하는 대신 N배의 캐시 용량으로 동작합니다.
+
+Usage:
+    ROUTER_NODES=http://10.0.0.2:8080,http://10.0.0.3:8080 python router.py
+"""
+import bisect
+import http.client
+import json
+import queue
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from config import (
+    SERVER_HOST, ROUTER_NODES, ROUTER_PORT, ROUTER_VIRTUAL_NODES,
+    ROUTER_HEALTH_INTERVAL, ROUTER_REQUEST_TIMEOUT, ROUTER_POOL_SIZE,
+)
+from routing import key_hash, routing_hash
+
+# 레플리카로 전달할 요청 헤더 / 클라이언트에게 돌려줄 응답 헤더
+_FORWARD_REQUEST_HEADERS = ("Content-Type", "X-API-Key", "X-Debug-Token", "Idempotency-Key", "User-Agent")
+_FORWARD_RESPONSE_HEADERS = ("Content-Type", "Retry-After", "Location")
+
+# 다음 노드로 넘겨서 재시도할 상태 코드 - 레플리카 앞 게이트웨이가 연결하지 못한 경우만
+# 503(작업 대기열 가득 참, 모델/토크나이저 미준비 등)은 애플리케이션 응답이므로 그대로 전달하고,
+# 504는 레플리카가 아직 처리 중일 수 있으므로 다시 보내지 않음
+_FAILOVER_STATUSES = (502,)
+
+
+class HashRing:
+    """Consistent-hash ring with virtual nodes"""
+
+    def __init__(self, nodes: List[str], virtual_nodes: int = 64):
+        self._ring: List[Tuple[int, str]] = sorted(
+            (key_hash(f"{node}#{i}"), node) for node in nodes for i in range(virtual_nodes)
+        )
+        self._hashes = [h for h, _ in self._ring]
+        self.nodes = list(nodes)
+
+    def preference_list(self, key_hash: int) -> List[str]:
+        """Distinct nodes in ring order starting at the key's position (owner first)"""
+        if not self._ring:
+            return []
+        start = bisect.bisect(self._hashes, key_hash) % len(self._ring)
+        ordered = []
+        for i in range(len(self._ring)):
+            node = self._ring[(start + i) % len(self._ring)][1]
+            if node not in ordered:
+                ordered.append(node)
+                if len(ordered) == len(self.nodes):
+                    break
+        return ordered
+
+
+class ForwardError(Exception):
+    """A request to a replica failed at `stage`
+
+    connect   the connection could not be opened (the replica never saw the request)
+    send      the connection dropped before any response arrived
+    timeout   no response within the timeout (the replica may still be working on it)
+    response  the response was malformed or cut off
+    """
+
+    def __init__(self, message: str, stage: str):
+        super().__init__(message)
+        self.stage = stage
+
+    @property
+    def can_failover(self) -> bool:
+        """Whether resending to another replica cannot duplicate work in progress"""
+        return self.stage in ("connect", "send")
+
+
+class Node:
+    """One replica with a pool of keep-alive connections and a health flag"""
+
+    def __init__(self, url: str, pool_size: int, timeout: float):
+        parsed = urlparse(url)
+        self.url = url
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        self.https = parsed.scheme == "https"
+        self.timeout = timeout
+        self.healthy = True
+        self.last_health: Optional[Dict] = None
+        self.last_checked: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._pool: "queue.LifoQueue[http.client.HTTPConnection]" = queue.LifoQueue(maxsize=pool_size)
+
+    def _new_connection(self, timeout: float) -> http.client.HTTPConnection:
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=timeout)
+
+    def request(self, method: str, path: str, body: Optional[bytes], headers: Dict[str, str],
+                timeout: Optional[float] = None):
+        """Send a request; returns (status, headers, body). Raises ForwardError on failure"""
+        timeout = timeout or self.timeout
+        try:
+            conn, reused = self._pool.get_nowait(), True
+        except queue.Empty:
+            conn, reused = self._new_connection(timeout), False
+
+        for attempt in range(2):
+            conn.timeout = timeout
+            try:
+                if conn.sock is None:
+                    conn.connect()
+                else:
+                    conn.sock.settimeout(timeout)
+            except OSError as e:
+                conn.close()
+                raise ForwardError(f"connect failed: {e}", stage="connect") from e
+
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+            except TimeoutError as e:
+                # 레플리카가 요청을 처리 중일 수 있으므로 같은 요청을 다시 보내지 않음
+                conn.close()
+                raise ForwardError(f"no response within {timeout:g}s", stage="timeout") from e
+            except ConnectionError as e:
+                conn.close()
+                # 풀에서 꺼낸 연결이 서버 쪽에서 이미 닫혔을 수 있으므로 새 연결로 한 번 재시도
+                if reused and attempt == 0:
+                    conn, reused = self._new_connection(timeout), False
+                    continue
+                raise ForwardError(f"connection lost before a response: {e}", stage="send") from e
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                raise ForwardError(f"invalid response: {e}", stage="response") from e
+
+            try:
+                data = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                raise ForwardError(f"response interrupted: {e}", stage="response") from e
+            response_headers = {k: response.getheader(k) for k in _FORWARD_RESPONSE_HEADERS if response.getheader(k)}
+            if response.will_close:
+                conn.close()
+            else:
+                try:
+                    self._pool.put_nowait(conn)
+                except queue.Full:
+                    conn.close()
+            return response.status, response_headers, data
+
+    def check_health(self):
+        """Probe /health and update the healthy flag from its JSON"""
+        try:
+            status, _, data = self.request("GET", "/health", None, {}, timeout=min(self.timeout, 5.0))
+            health = json.loads(data.decode("utf-8"))
+            # 모델이 아직 로드되지 않은 레플리카로는 보내지 않음
+            ready = health.get("ready", health.get("model_loaded", True))
+            self.healthy = status == 200 and health.get("status") == "healthy" and bool(ready)
+            self.last_health = health
+            self.last_error = None if self.healthy else f"not ready (status={status})"
+        except Exception as e:
+            self.healthy = False
+            self.last_error = str(e)
+        self.last_checked = time.time()
+
+    def status(self) -> Dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "last_checked": self.last_checked,
+            "last_error": self.last_error,
+        }
+
+
+class Router:
+    def __init__(self, nodes: List[str], virtual_nodes: int, pool_size: int, timeout: float):
+        self.nodes = {url: Node(url, pool_size, timeout) for url in nodes}
+        self.ring = HashRing(nodes, virtual_nodes)
+
+    def candidates(self, key_hash: int) -> List[Node]:
+        """Healthy nodes in ring order, followed by unhealthy ones as a last resort"""
+        ordered = [self.nodes[url] for url in self.ring.preference_list(key_hash)]
+        return [n for n in ordered if n.healthy] + [n for n in ordered if not n.healthy]
+
+    def check_all(self):
+        for node in self.nodes.values():
+            node.check_health()
+
+    def start_health_checks(self, interval: float):
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.check_all()
+
+        threading.Thread(target=loop, name="router-health", daemon=True).start()
+
+
+class RouterHandler(BaseHTTPRequestHandler):
+    """Forwards requests to the replica that owns the input text"""
+
+    protocol_version = "HTTP/1.1"
+    router: Router = None
+
+    def _send(self, status_code: int, body: bytes, headers: Dict[str, str]):
+        self.send_response(status_code)
+        headers = {"Content-Type": "application/json", **headers}
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_OPTIONS(self):
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, DELETE, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, X-API-Key, X-Debug-Token, Idempotency-Key')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/router/health':
+            body = json.dumps({
+                "status": "healthy" if any(n.healthy for n in self.router.nodes.values()) else "degraded",
+                "nodes": [n.status() for n in self.router.nodes.values()],
+            }).encode('utf-8')
+            self._send(200, body, {})
+            return
+        self._forward(None)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._forward(body)
+
+    def do_DELETE(self):
+        self._forward(None)
+
+    def _forward(self, body: Optional[bytes]):
+        path = urlparse(self.path).path
+        key_hash = routing_hash(path, body)
+        headers = {k: self.headers[k] for k in _FORWARD_REQUEST_HEADERS if self.headers.get(k)}
+        client_ip = self.client_address[0] if self.client_address else 'unknown'
+        forwarded_for = self.headers.get('X-Forwarded-For')
+        headers['X-Forwarded-For'] = f"{forwarded_for}, {client_ip}" if forwarded_for else client_ip
+
+        # 제출 시 장애 조치로 다른 레플리카에 들어간 작업도 찾을 수 있도록 작업 조회는 404에서도 다음 노드 시도
+        failover_statuses = _FAILOVER_STATUSES
+        if path.startswith('/api/jobs/'):
+            failover_statuses += (404,)
+
+        last_error = "No replicas configured"
+        last_response = None
+        for node in self.router.candidates(key_hash):
+            try:
+                status, response_headers, data = node.request(self.command, self.path, body, headers)
+            except ForwardError as e:
+                last_error = f"{node.url}: {e}"
+                if not e.can_failover:
+                    # 느린 레플리카는 정상일 수 있으므로 제외하지 않고, 요청도 다른 노드로 다시 보내지 않음
+                    print(f"[ROUTER] {node.url} failed ({e.stage}), not retrying: {e}")
+                    status_code = 504 if e.stage == "timeout" else 502
+                    error = {"error": "Replica did not respond", "status_code": status_code, "reason": last_error}
+                    self._send(status_code, json.dumps(error).encode('utf-8'), {'X-Routed-To': node.url})
+                    return
+                if e.stage == "connect":
+                    node.healthy = False
+                    node.last_error = str(e)
+                print(f"[ROUTER] {node.url} failed ({e.stage}), trying next node: {e}")
+                continue
+            response_headers['X-Routed-To'] = node.url
+            if status in _FAILOVER_STATUSES:
+                node.healthy = False
+                node.last_error = f"HTTP {status}"
+            if status in failover_statuses:
+                last_error = f"{node.url}: HTTP {status}"
+                last_response = (status, data, response_headers)
+                continue
+            self._send(status, data, response_headers)
+            return
+
+        if last_response is not None and last_response[0] == 404:
+            self._send(*last_response)
+            return
+
+        error = {"error": "No healthy replica available", "status_code": 502, "reason": last_error}
+        self._send(502, json.dumps(error).encode('utf-8'), {})
+
+    def log_message(self, format, *args):
+        print(f"[ROUTER] {format % args}")
+
+
+def main():
+    if not ROUTER_NODES:
+        print("[ROUTER] ROUTER_NODES is empty. Example: ROUTER_NODES=http://localhost:8080,http://localhost:8081")
+        sys.exit(1)
+
+    router = Router(ROUTER_NODES, ROUTER_VIRTUAL_NODES, ROUTER_POOL_SIZE, ROUTER_REQUEST_TIMEOUT)
+    router.check_all()
+    router.start_health_checks(ROUTER_HEALTH_INTERVAL)
+    RouterHandler.router = router
+
+    httpd = ThreadingHTTPServer((SERVER_HOST, ROUTER_PORT), RouterHandler)
+    print(f"[ROUTER] Routing to {len(ROUTER_NODES)} replicas on http://{SERVER_HOST}:{ROUTER_PORT}")
+    for node in router.nodes.values():
+        print(f"[ROUTER]   {node.url} ({'healthy' if node.healthy else 'unhealthy'})")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[ROUTER] Shutting down router...")
+        httpd.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,113 @@
 """
 Visualization routes - HTTP server용 동기 함수
 """
+import time
 
-from schemas import VisualizeRequest, VisualizeResponse, TokenVector
-from utils import generate_response, format_vector, apply_pca_and_normalize
+from schemas import VisualizeRequest, EmbedRequest, VisualizeResponse, TokenVector, TokenNeighbor
+from utils import generate_response, format_vector, apply_pca_and_normalize, extract_embeddings
+
+
+def lookup_neighbors(request: VisualizeRequest, embeddings):
+    """Top-k nearest vocabulary tokens for each hidden state (None if no index is built)"""
+    from config import VOCAB_NEIGHBORS_MODE, VOCAB_NEIGHBORS_MAX_K
+    from vocab_index import get_vocab_index
+
+    index = get_vocab_index()
+    if index is None:
+        print("[VISUALIZE] Vocabulary index not built, skipping neighbors")
+        return None
+
+    k = max(1, min(request.neighbors_k, VOCAB_NEIGHBORS_MAX_K))
+    mode = request.neighbors_mode or VOCAB_NEIGHBORS_MODE
+    neighbors = index.neighbors(extract_embeddings(embeddings), k=k, mode=mode)
+    return [
+        [TokenNeighbor(token=token, score=score) for token, score in token_neighbors]
+        for token_neighbors in neighbors
+    ]
+
+
+def embed_texts(llama, texts):
+    """Per-token embeddings for several texts in one batched pass, whitespace tokens removed
+
+    Returns (token strings, embeddings, index of the source text for each token).
+    """
+    # Note: the "embeddings required but some input tokens were not marked as outputs" warning
+    # is expected here as well (see visualize_sync)
+    import sys
+    import io
+
+    from chunked_embedding import window_size, embed_long
+
+    all_tokens = [llama.tokenize(text.encode("utf-8")) for text in texts]
+    for tokens in all_tokens:
+        check_token_count(len(tokens))
+    # 윈도우보다 긴 텍스트는 따로 윈도우 분할 임베딩, 나머지는 한 번의 배치로 처리
+    window = window_size(llama)
+    short_indices = [i for i, tokens in enumerate(all_tokens) if len(tokens) <= window]
+
+    old_stderr = sys.stderr
+    sys.stderr = io.StringIO()
+    try:
+        # 여러 텍스트를 한 번의 배치 디코드로 처리 (텍스트마다 토큰별 벡터 리스트 반환)
+        batch_embeddings = [None] * len(texts)
+        if short_indices:
+            short_embeddings = llama.embed([texts[i] for i in short_indices])
+            for i, text_embeddings in zip(short_indices, short_embeddings):
+                batch_embeddings[i] = text_embeddings
+        for i, tokens in enumerate(all_tokens):
+            if batch_embeddings[i] is None:
+                batch_embeddings[i] = embed_long(llama, tokens)
+    finally:
+        sys.stderr = old_stderr
+
+    token_strs = []
+    embeddings = []
+    text_indices = []
+    for text_index, (tokens, text_embeddings) in enumerate(zip(all_tokens, batch_embeddings)):
+        for token_id, emb in zip(tokens, text_embeddings):
+            token = llama.detokenize([token_id]).decode("utf-8", errors="replace")
+            # Remove empty string tokens and whitespace-only tokens
+            if token.strip() != "":
+                token_strs.append(token)
+                embeddings.append(emb)
+                text_indices.append(text_index)
+    return token_strs, embeddings, text_indices
+
+
+def embed_sync(request: EmbedRequest) -> VisualizeResponse:
+    """Embed-only mode - one batched embedding pass over the input text(s), no chat generation"""
+    texts = request.all_texts()
+    print(f"[EMBED] Request received: {len(texts)} text(s)")
+
+    from model import ensure_model_loaded, llama
+
+    if not ensure_model_loaded(timeout=0) or llama is None:
+        print("[EMBED] Model load failed")
+        raise RuntimeError("Model could not be loaded. Please try again later.")
+
+    token_strs, embeddings, text_indices = embed_texts(llama, texts)
+    print(f"[EMBED] Filtered tokens: {len(token_strs)}")
+
+    if not token_strs:
+        return VisualizeResponse(tokens=[])
+
+    normalized_vectors, original_dim = apply_pca_and_normalize(embeddings, [])
+    print(f"[EMBED] PCA completed: {original_dim}D -> 3D, vectors: {len(normalized_vectors)}")
+
+    neighbors = lookup_neighbors(request, embeddings) if request.include_neighbors else None
+    multiple_texts = len(texts) > 1
+    return VisualizeResponse(
+        tokens=[
+            TokenVector(
+                token=token,
+                destination=normalized_vectors[i].tolist(),
+                is_input=True,
+                neighbors=neighbors[i] if neighbors is not None else None,
+                text_index=text_indices[i] if multiple_texts else None,
+            )
+            for i, token in enumerate(token_strs)
+        ]
+    )
 
 
 def visualize_sync(request: VisualizeRequest) -> VisualizeResponse:
@@ -13,15 +117,34 @@ def visualize_sync(request: VisualizeRequest) -> VisualizeResponse:
     # Ensure model is loaded
     from model import ensure_model_loaded, llama
 
-    if not ensure_model_loaded():
+    if not ensure_model_loaded(timeout=0):
         print("[VISUALIZE] Model load failed")
         raise RuntimeError("Model could not be loaded. Please try again later.")
 
     # 모델이 로드되어 있으면 응답 생성
     if llama is not None:
         try:
+            from chunked_embedding import window_size, embed_long, generation_input
+
+            # 윈도우보다 긴 입력은 겹치는 윈도우로 나누어 임베딩하고, 생성에는 컨텍스트에 맞는 뒷부분만 사용
+            input_token_ids = llama.tokenize(request.input_text.encode("utf-8"))
+            check_token_count(len(input_token_ids))
+            long_input = len(input_token_ids) > window_size(llama)
+            prompt_text = generation_input(llama, request.input_text, input_token_ids)
+
+            from prefix_cache import get_prefix_cache
+
+            # 최근 입력과 공통 토큰 prefix가 있으면 그 평가 상태를 이어서 사용 (수정된 뒷부분만 평가)
+            prefix_cache = get_prefix_cache()
+
+            from speculative import speculative_decoding
+
             print("[VISUALIZE] Generating response...")
-            generated_response = generate_response(llama, request.input_text)
+            with speculative_decoding(llama, request.speculative):
+                if prefix_cache is not None:
+                    generated_response = prefix_cache.generate(llama, prompt_text)
+                else:
+                    generated_response = generate_response(llama, prompt_text)
             print(f"[VISUALIZE] Response generated: {generated_response[:50]}...")
 
             print("[VISUALIZE] Extracting input embeddings...")
@@ -72,7 +195,12 @@ def visualize_sync(request: VisualizeRequest) -> VisualizeResponse:
             stderr_capture = io.StringIO()
             sys.stderr = stderr_capture
             try:
-                input_embeddings = llama.embed(request.input_text)
+                if long_input:
+                    input_embeddings = embed_long(llama, input_token_ids)
+                elif prefix_cache is not None:
+                    input_embeddings = prefix_cache.embed(llama, request.input_text)
+                else:
+                    input_embeddings = llama.embed(request.input_text)
             finally:
                 sys.stderr = old_stderr
                 stderr_output = stderr_capture.getvalue()
@@ -95,14 +223,13 @@ def visualize_sync(request: VisualizeRequest) -> VisualizeResponse:
             debug_log(
                 "routes.py:embed_input",
                 "AFTER llama.embed(input)",
-                {"embeddings_count": len(input_embeddings) if input_embeddings else 0},
+                {"embeddings_count": len(input_embeddings) if input_embeddings is not None else 0},
                 "H1",
             )
             # #endregion
-            input_tokens = llama.tokenize(request.input_text.encode("utf-8"))
             input_token_strs = [
                 llama.detokenize([t]).decode("utf-8", errors="replace")
-                for t in input_tokens
+                for t in input_token_ids
             ]
             print(f"[VISUALIZE] Input tokens: {len(input_token_strs)}")
 
@@ -192,6 +319,11 @@ def visualize_sync(request: VisualizeRequest) -> VisualizeResponse:
             all_tokens = input_token_strs + output_token_strs
             print(f"[VISUALIZE] Total tokens: {len(all_tokens)}")
 
+            neighbors = None
+            if request.include_neighbors:
+                print("[VISUALIZE] Looking up nearest vocabulary tokens...")
+                neighbors = lookup_neighbors(request, input_embeddings + output_embeddings)
+
             print("[VISUALIZE] Creating TokenVector list...")
             # Create TokenVector list (using normalized vectors)
             tokens_data = []
@@ -202,12 +334,15 @@ def visualize_sync(request: VisualizeRequest) -> VisualizeResponse:
                     token=token,
                     destination=destination,
                     is_input=i < len(input_token_strs),
+                    neighbors=neighbors[i] if neighbors is not None else None,
                 )
                 tokens_data.append(token_vector)
 
             print(f"[VISUALIZE] Response completed, tokens: {len(tokens_data)}")
             return VisualizeResponse(tokens=tokens_data)
 
+        except RequestError:
+            raise
         except Exception as e:
             print(f"[ERROR] Response generation failed: {e}")
             import traceback
@@ -217,3 +352,256 @@ def visualize_sync(request: VisualizeRequest) -> VisualizeResponse:
     else:
         print("[ERROR] Model not loaded, cannot generate response")
         raise RuntimeError("Model is not loaded")
+
+
+def _estimate_prompt_tokens(llama, messages) -> int:
+    """Rough prompt length for a chat history (content tokens plus per-message template overhead)"""
+    return sum(
+        len(llama.tokenize(message["content"].encode("utf-8"), add_bos=False)) + 8
+        for message in messages
+    )
+
+
+def session_turn_sync(request: VisualizeRequest, max_tokens: int = 512) -> VisualizeResponse:
+    """Session mode - continue a conversation, evaluating only the new turn's tokens"""
+    print(f"[SESSION] Turn for session {request.session_id!r}: {request.input_text[:50]}...")
+
+    from model import ensure_model_loaded, llama
+    from sessions import get_session_manager
+    from speculative import speculative_decoding
+    from utils import generate_chat_response, compact_llama_state
+
+    if not ensure_model_loaded(timeout=0) or llama is None:
+        print("[SESSION] Model load failed")
+        raise RuntimeError("Model could not be loaded. Please try again later.")
+
+    with get_session_manager().checkout(request.session_id) as session:
+        messages = session.messages + [{"role": "user", "content": request.input_text}]
+
+        # 컨텍스트가 넘치면 가장 오래된 턴부터 대화 기록에서 제외 (시각화 궤적은 유지)
+        # 기록을 잘라내면 KV 캐시를 처음부터 다시 채워야 하므로, 매 턴 재평가하지 않도록 절반까지 비움
+        n_ctx = llama.n_ctx()
+        if _estimate_prompt_tokens(llama, messages) + max_tokens > n_ctx:
+            while _estimate_prompt_tokens(llama, messages) + max_tokens > n_ctx // 2 and session.drop_oldest_turn():
+                messages = session.messages + [{"role": "user", "content": request.input_text}]
+            print(f"[SESSION] Context full, trimmed history to {len(session.messages) // 2} turns")
+
+        started = time.perf_counter()
+        if session.state is not None:
+            # 이전 턴의 KV 캐시를 복원하면 create_chat_completion이 공통 prefix를 건너뛰고 새 토큰만 평가
+            llama.load_state(session.state)
+        reused_tokens = llama.n_tokens
+        with speculative_decoding(llama, request.speculative):
+            generated_response = generate_chat_response(llama, messages, max_tokens)
+        # embed()가 KV 캐시를 비우므로 임베딩 전에 상태 저장
+        state = compact_llama_state(llama.save_state())
+        print(
+            f"[SESSION] Response generated in {time.perf_counter() - started:.2f}s "
+            f"(reused {reused_tokens} cached tokens, context now {state.n_tokens}): "
+            f"{generated_response[:50]}..."
+        )
+
+        # 새 턴의 입력/출력만 임베딩 (이전 턴의 벡터는 세션에 누적되어 있음)
+        token_strs, embeddings, text_indices = embed_texts(llama, [request.input_text, generated_response])
+
+        # 임베딩이 끝난 뒤에 턴을 세션에 반영 - 실패하면 세션은 이전 턴 상태 그대로 남음
+        session.messages = messages + [{"role": "assistant", "content": generated_response}]
+        session.state = state
+        session.turn_count += 1
+        session.add_rows(
+            [t for t, i in zip(token_strs, text_indices) if i == 0],
+            [e for e, i in zip(embeddings, text_indices) if i == 0],
+            is_input=True,
+        )
+        session.add_rows(
+            [t for t, i in zip(token_strs, text_indices) if i == 1],
+            [e for e, i in zip(embeddings, text_indices) if i == 1],
+            is_input=False,
+        )
+
+        if not session.tokens:
+            return VisualizeResponse(tokens=[], session_id=session.session_id, turn=session.turn_count)
+
+        normalized_vectors, original_dim = apply_pca_and_normalize(session.embeddings, [])
+        print(f"[SESSION] PCA completed: {original_dim}D -> 3D, vectors: {len(normalized_vectors)}")
+
+        if request.include_neighbors:
+            # 이전 턴에서 같은 설정으로 계산한 이웃은 재사용
+            neighbors_key = (request.neighbors_k, request.neighbors_mode)
+            if session.neighbors_key != neighbors_key:
+                session.neighbors = [None] * len(session.tokens)
+                session.neighbors_key = neighbors_key
+            missing = [i for i, n in enumerate(session.neighbors) if n is None]
+            if missing:
+                found = lookup_neighbors(request, session.embeddings[missing])
+                if found is not None:
+                    for i, token_neighbors in zip(missing, found):
+                        session.neighbors[i] = token_neighbors
+
+        return VisualizeResponse(
+            tokens=[
+                TokenVector(
+                    token=token,
+                    destination=normalized_vectors[i].tolist(),
+                    is_input=session.is_input[i],
+                    neighbors=session.neighbors[i] if request.include_neighbors else None,
+                    turn=session.turns[i],
+                )
+                for i, token in enumerate(session.tokens)
+            ],
+            session_id=session.session_id,
+            turn=session.turn_count,
+        )
+
+
+class RequestError(ValueError):
+    """Invalid request body (answered with a 4xx status)"""
+
+    def __init__(self, status_code: int, message: str, reason: str = None):
+        super().__init__(reason or message)
+        self.status_code = status_code
+        self.message = message
+        self.reason = reason
+
+
+class ModelNotReady(RuntimeError):
+    """The model is not loaded yet (answered with 503 and Retry-After)"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_visualize_request(data) -> VisualizeRequest:
+    """Validate a /api/visualize body"""
+    from pydantic import ValidationError
+    from config import SESSION_ID_MAX_LENGTH
+
+    if not isinstance(data, dict) or not data.get("input_text"):
+        reason = "Request body must contain 'input_text' field with a non-empty value"
+        raise RequestError(400, "input_text is required", reason)
+    try:
+        request = VisualizeRequest.model_validate(data)
+    except ValidationError as e:
+        raise RequestError(400, "Invalid request body", str(e))
+    if request.session_id is not None and not 0 < len(request.session_id) <= SESSION_ID_MAX_LENGTH:
+        raise RequestError(400, "Invalid session_id", f"'session_id' must be 1-{SESSION_ID_MAX_LENGTH} characters")
+    check_document_length(request.input_text)
+    return request
+
+
+def parse_embed_request(data) -> EmbedRequest:
+    """Validate a /api/embed body"""
+    from pydantic import ValidationError
+    from config import EMBED_MAX_TEXTS
+
+    try:
+        request = EmbedRequest.model_validate(data)
+    except ValidationError as e:
+        raise RequestError(400, "Invalid request body", str(e))
+    texts = request.all_texts()
+    if not texts or any(not text for text in texts):
+        reason = "Request body must contain 'input_text' or a non-empty 'texts' list of non-empty strings"
+        raise RequestError(400, "input_text or texts is required", reason)
+    if len(texts) > EMBED_MAX_TEXTS:
+        raise RequestError(400, "Too many texts", f"At most {EMBED_MAX_TEXTS} texts per request")
+    for text in texts:
+        check_document_length(text)
+    return request
+
+
+def check_document_length(text: str):
+    """Reject inputs longer than MAX_DOCUMENT_TOKENS (413) while parsing, before admission and generation"""
+    from config import MAX_DOCUMENT_TOKENS
+    from tokenizer_service import get_tokenizer_service, TokenizerUnavailable
+
+    # 토큰 하나는 최소 1바이트이므로 바이트 수(+BOS 등 여유분)가 한도 이하면 토큰화하지 않음
+    if len(text.encode("utf-8")) + 2 <= MAX_DOCUMENT_TOKENS:
+        return
+    try:
+        n_tokens = get_tokenizer_service().count(text)
+    except TokenizerUnavailable as e:
+        # 모델 경로에서 토큰화한 뒤 check_token_count()로 다시 확인
+        print(f"[VISUALIZE] Tokenizer unavailable, deferring the length check to the model: {e}")
+        return
+    check_token_count(n_tokens)
+
+
+def check_token_count(n_tokens: int):
+    """Reject a tokenized input longer than MAX_DOCUMENT_TOKENS (413)"""
+    from config import MAX_DOCUMENT_TOKENS
+
+    if n_tokens > MAX_DOCUMENT_TOKENS:
+        reason = f"Input has {n_tokens} tokens; at most {MAX_DOCUMENT_TOKENS} tokens are supported"
+        raise RequestError(413, "Input too long", reason)
+
+
+def _require_model():
+    """Raise ModelNotReady right away while the model is loading, instead of holding the request thread"""
+    from config import MODEL_READY_TIMEOUT, MODEL_NOT_READY_RETRY_AFTER
+    from model import ensure_model_loaded, get_load_status
+
+    if not ensure_model_loaded(timeout=MODEL_READY_TIMEOUT):
+        retry_after = get_load_status().get("next_retry_in") or MODEL_NOT_READY_RETRY_AFTER
+        raise ModelNotReady("The AI model is not currently loaded. The server may still be initializing.", retry_after)
+
+
+def visualize_pipeline(request: VisualizeRequest, client_key: str) -> dict:
+    """Full /api/visualize flow: gallery, shared result store, then the model through admission control"""
+    from gallery_store import get_gallery_store
+    from result_store import lookup_shared_result, save_shared_result
+    from scheduler import admission_scheduler
+
+    if request.session_id is not None:
+        # 세션 턴은 상태가 있으므로 갤러리와 공유 저장소를 거치지 않음
+        _require_model()
+        with admission_scheduler.admit(client_key):
+            return session_turn_sync(request).model_dump(exclude_none=True)
+
+    # 사전 계산된 갤러리 항목이면 모델 호출 없이 바로 응답 (갤러리에는 이웃 정보 없음)
+    if not request.include_neighbors:
+        with get_gallery_store() as gallery:
+            precomputed = gallery.lookup(request.input_text) if gallery is not None else None
+        if precomputed is not None:
+            return precomputed
+
+    # 다른 레플리카가 이미 계산한 결과가 있으면 재사용
+    # speculative decoding은 출력 분포를 바꾸지 않으므로 캐시 키에서 제외
+    store_key, shared = lookup_shared_result("visualize", request.model_dump(exclude={"speculative"}))
+    if shared is not None:
+        return shared
+
+    _require_model()
+    # 클라이언트별 공정 큐를 거쳐 모델 사용 (과부하 시 AdmissionRejected)
+    with admission_scheduler.admit(client_key):
+        response = visualize_sync(request)
+
+    # Convert response to dict (optional fields only when present)
+    response_dict = response.model_dump(exclude_none=True)
+    save_shared_result(store_key, response_dict)
+    return response_dict
+
+
+def embed_pipeline(request: EmbedRequest, client_key: str) -> dict:
+    """Full /api/embed flow: shared result store, then the model through admission control"""
+    from result_store import lookup_shared_result, save_shared_result
+    from scheduler import admission_scheduler
+
+    store_key, shared = lookup_shared_result("embed", request.model_dump())
+    if shared is not None:
+        return shared
+
+    _require_model()
+    with admission_scheduler.admit(client_key):
+        response = embed_sync(request)
+
+    response_dict = response.model_dump(exclude_none=True)
+    save_shared_result(store_key, response_dict)
+    return response_dict
+
+
+# 작업 종류별 (요청 검증, 실행) 함수 - /api/jobs에서 사용
+PIPELINES = {
+    "visualize": (parse_visualize_request, visualize_pipeline),
+    "embed": (parse_embed_request, embed_pipeline),
+}
@@ -0,0 +1,49 @@
+"""
+Routing keys - router.py와 레플리카가 함께 쓰는 요청 해시
+작업 ID에 제출 요청의 해시를 넣어 두면 라우터가 조회 요청을 같은 레플리카로 보낼 수 있습니다.
+"""
+import hashlib
+import json
+from typing import Optional
+from urllib.parse import unquote
+
+from gallery_store import normalize_input_text
+
+
+def key_hash(value: str) -> int:
+    """64-bit position of a key on the hash ring"""
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+def routing_key(path: str, body: Optional[bytes]) -> str:
+    """Hash key for a request: the session, the normalized input text(s), or the path for everything else"""
+    # 세션의 KV 캐시는 한 레플리카에만 있으므로 세션 ID로 고정
+    if path.startswith("/api/sessions/"):
+        return "session:" + unquote(path[len("/api/sessions/"):])
+    try:
+        data = json.loads(body.decode("utf-8")) if body else {}
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return path
+    if isinstance(data, dict):
+        if isinstance(data.get("session_id"), str) and data["session_id"]:
+            return "session:" + data["session_id"]
+        if isinstance(data.get("input_text"), str) and data["input_text"]:
+            return normalize_input_text(data["input_text"])
+        if isinstance(data.get("texts"), list):
+            return "\x1f".join(normalize_input_text(t) for t in data["texts"] if isinstance(t, str))
+    return path
+
+
+def routing_hash(path: str, body: Optional[bytes]) -> int:
+    """Ring position for a request
+
+    Job IDs start with the routing hash of the submitted request (see jobs.new_job_id),
+    so polling a job reaches the replica whose local queue holds it.
+    """
+    if path.startswith("/api/jobs/"):
+        prefix = path[len("/api/jobs/"):].split("-", 1)[0]
+        try:
+            return int(prefix, 16)
+        except ValueError:
+            pass
+    return key_hash(routing_key(path, body))
@@ -0,0 +1,266 @@
+"""
+Admission scheduler - 클라이언트별 공정 큐잉과 부하 차단
+모델은 한 번에 하나의 요청만 처리할 수 있으므로, 추론 경로 앞에서
+클라이언트(IP 또는 API 키)별 큐를 두고 가중 공정 분배로 순서를 정합니다.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from config import (
+    ADMISSION_MAX_CONCURRENCY,
+    ADMISSION_MAX_QUEUE_PER_CLIENT,
+    ADMISSION_MAX_QUEUE_WAIT,
+    ADMISSION_RATE_PER_MINUTE,
+    ADMISSION_BURST,
+    ADMISSION_CLIENT_WEIGHTS,
+    ADMISSION_DEFAULT_SERVICE_TIME,
+)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed before reaching the model (HTTP 429)"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Per-client rate limiter (rate in tokens/second, up to `burst` tokens)"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def try_take(self, now: float) -> float:
+        """Take one token; return 0 on success, otherwise seconds until one is available"""
+        # 버킷이 `now`를 잰 뒤에 만들어졌을 수 있으므로 경과 시간은 음수가 되지 않게
+        self.tokens = min(self.burst, self.tokens + max(0.0, now - self.updated) * self.rate)
+        self.updated = max(self.updated, now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self, now: float) -> bool:
+        return self.tokens + max(0.0, now - self.updated) * self.rate >= self.burst
+
+
+class _Ticket:
+    __slots__ = ("client", "start_tag", "finish_tag", "enqueued_at", "granted")
+
+    def __init__(self, client: str, start_tag: float, finish_tag: float):
+        self.client = client
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+
+
+class AdmissionScheduler:
+    """Weighted fair queuing in front of the model with token-bucket rate limits.
+
+    Start-time fair queuing: 각 요청은 (가상 시간, 클라이언트의 마지막 종료 태그) 중
+    큰 값에서 시작해 1/weight 만큼 진행한 종료 태그를 받고, 가장 작은 종료 태그를 가진
+    클라이언트 큐의 헤드가 먼저 실행됩니다. 가중치가 모두 같으면 라운드 로빈과 같습니다.
+    """
+
+    # 유휴 클라이언트의 버킷을 정리하는 기준 개수
+    _BUCKET_PRUNE_THRESHOLD = 10000
+
+    def __init__(
+        self,
+        max_concurrency: int = 1,
+        max_queue_per_client: int = 4,
+        max_queue_wait: float = 20.0,
+        rate_per_minute: float = 30.0,
+        burst: int = 5,
+        weights: Optional[Dict[str, float]] = None,
+        default_service_time: float = 5.0,
+        history: int = 20,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue_per_client = max_queue_per_client
+        self.max_queue_wait = max_queue_wait
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.weights = weights or {}
+        for client, weight in self.weights.items():
+            if not weight > 0:
+                raise ValueError(f"Weight for client {client!r} must be positive, got {weight}")
+        self.default_service_time = default_service_time
+
+        self._cond = threading.Condition()
+        self._queues: Dict[str, deque] = {}
+        self._last_finish: Dict[str, float] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._virtual_time = 0.0
+        self._in_flight = 0
+        self._service_times = deque(maxlen=history)
+        self._stats = {
+            "admitted": 0,
+            "rejected_rate_limit": 0,
+            "rejected_queue_full": 0,
+            "rejected_overload": 0,
+            "rejected_timeout": 0,
+        }
+
+    @contextmanager
+    def admit(self, client: str):
+        """Block until `client` may use the model; raises AdmissionRejected when shed"""
+        ticket = self._enqueue(client)
+        self._wait(ticket)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    def snapshot(self) -> Dict[str, object]:
+        """Current queue state for /health"""
+        with self._cond:
+            return {
+                "in_flight": self._in_flight,
+                "queued": self._queued_count(),
+                "queued_clients": len(self._queues),
+                "avg_service_time": round(self._average_service_time(), 3),
+                "estimated_wait": round(self._estimate_wait(), 3),
+                **self._stats,
+            }
+
+    def _enqueue(self, client: str) -> _Ticket:
+        with self._cond:
+            now = time.monotonic()
+
+            # 1. 토큰 버킷 속도 제한
+            if self.rate > 0:
+                bucket = self._buckets.get(client)
+                if bucket is None:
+                    if len(self._buckets) >= self._BUCKET_PRUNE_THRESHOLD:
+                        self._prune_buckets(now)
+                    bucket = self._buckets[client] = TokenBucket(self.rate, self.burst)
+                wait = bucket.try_take(now)
+                if wait > 0:
+                    self._stats["rejected_rate_limit"] += 1
+                    raise AdmissionRejected("Rate limit exceeded for this client", wait)
+
+            # 2. 클라이언트별 큐 길이 제한
+            queue = self._queues.get(client)
+            if queue is not None and len(queue) >= self.max_queue_per_client:
+                self._stats["rejected_queue_full"] += 1
+                raise AdmissionRejected(
+                    "Too many pending requests for this client",
+                    self._average_service_time() * len(queue),
+                )
+
+            # 3. 최근 처리 시간 기반 대기 시간 예측 - 타임아웃까지 기다리지 않고 바로 거절
+            estimated_wait = self._estimate_wait()
+            if estimated_wait > self.max_queue_wait:
+                self._stats["rejected_overload"] += 1
+                raise AdmissionRejected(
+                    f"Server overloaded (estimated queue time {estimated_wait:.1f}s)",
+                    estimated_wait,
+                )
+
+            weight = self.weights.get(client, 1.0)
+            start_tag = max(self._virtual_time, self._last_finish.get(client, 0.0))
+            ticket = _Ticket(client, start_tag, start_tag + 1.0 / weight)
+            self._last_finish[client] = ticket.finish_tag
+            if queue is None:
+                queue = self._queues[client] = deque()
+            queue.append(ticket)
+
+            self._dispatch()
+            return ticket
+
+    def _wait(self, ticket: _Ticket):
+        deadline = ticket.enqueued_at + self.max_queue_wait
+        with self._cond:
+            while not ticket.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._remove(ticket)
+                    self._stats["rejected_timeout"] += 1
+                    raise AdmissionRejected(
+                        "Timed out waiting in queue", self._average_service_time()
+                    )
+                self._cond.wait(remaining)
+            self._stats["admitted"] += 1
+
+    def _release(self, service_time: float):
+        with self._cond:
+            self._in_flight -= 1
+            self._service_times.append(service_time)
+            self._dispatch()
+
+    def _dispatch(self):
+        """Grant free slots to the queue heads with the smallest finish tags (lock held)"""
+        granted = False
+        while self._in_flight < self.max_concurrency and self._queues:
+            client = min(self._queues, key=lambda c: self._queues[c][0].finish_tag)
+            queue = self._queues[client]
+            ticket = queue.popleft()
+            if not queue:
+                del self._queues[client]
+            self._virtual_time = max(self._virtual_time, ticket.start_tag)
+            ticket.granted = True
+            self._in_flight += 1
+            granted = True
+
+        if granted:
+            # 가상 시간보다 뒤처진 종료 태그는 의미가 없으므로 정리
+            stale = [
+                c for c, tag in self._last_finish.items()
+                if tag <= self._virtual_time and c not in self._queues
+            ]
+            for c in stale:
+                del self._last_finish[c]
+            self._cond.notify_all()
+
+    def _remove(self, ticket: _Ticket):
+        queue = self._queues.get(ticket.client)
+        if queue is None:
+            return
+        try:
+            queue.remove(ticket)
+        except ValueError:
+            return
+        if not queue:
+            del self._queues[ticket.client]
+
+    def _prune_buckets(self, now: float):
+        for client in [c for c, b in self._buckets.items() if b.is_full(now)]:
+            del self._buckets[client]
+
+    def _queued_count(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def _average_service_time(self) -> float:
+        if not self._service_times:
+            return self.default_service_time
+        return sum(self._service_times) / len(self._service_times)
+
+    def _estimate_wait(self) -> float:
+        """Expected time a new request would wait before being granted a slot"""
+        if self._in_flight < self.max_concurrency and not self._queues:
+            return 0.0
+        ahead = self._queued_count() + self._in_flight - self.max_concurrency + 1
+        return max(ahead, 0) * self._average_service_time() / self.max_concurrency
+
+
+# 서버 전역 스케줄러 (config.py 설정 사용)
+admission_scheduler = AdmissionScheduler(
+    max_concurrency=ADMISSION_MAX_CONCURRENCY,
+    max_queue_per_client=ADMISSION_MAX_QUEUE_PER_CLIENT,
+    max_queue_wait=ADMISSION_MAX_QUEUE_WAIT,
+    rate_per_minute=ADMISSION_RATE_PER_MINUTE,
+    burst=ADMISSION_BURST,
+    weights=ADMISSION_CLIENT_WEIGHTS,
+    default_service_time=ADMISSION_DEFAULT_SERVICE_TIME,
+)
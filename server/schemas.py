@@ -1,16 +1,46 @@
+from typing import Literal, Optional
+
 from pydantic import BaseModel
 
 
-class VisualizeRequest(BaseModel):
+class NeighborOptions(BaseModel):
+    include_neighbors: bool = False      # 토큰별 최근접 어휘 이웃 포함 여부
+    neighbors_k: int = 5
+    neighbors_mode: Optional[Literal["exact", "approx"]] = None  # 기본값: config.VOCAB_NEIGHBORS_MODE
+
+
+class VisualizeRequest(NeighborOptions):
     input_text: str
+    session_id: Optional[str] = None    # 지정하면 같은 세션의 이전 턴에 이어서 대화 (KV 캐시 재사용)
+    speculative: Optional[bool] = None  # false면 speculative decoding 제외 (SPECULATIVE_MODE가 off가 아닐 때 기본 사용)
+
+
+class EmbedRequest(NeighborOptions):
+    input_text: Optional[str] = None
+    texts: list[str] = []               # 여러 텍스트를 한 번의 배치 임베딩으로 처리
+
+    def all_texts(self) -> list[str]:
+        texts = list(self.texts)
+        if self.input_text:
+            texts.insert(0, self.input_text)
+        return texts
+
+
+class TokenNeighbor(BaseModel):
+    token: str
+    score: float        # 코사인 유사도
 
 
 class TokenVector(BaseModel):
     token: str
     destination: list[float]  # [x, y, z] 목적지 좌표
     is_input: bool      # 입력 토큰인지 출력 토큰인지
+    neighbors: Optional[list[TokenNeighbor]] = None  # include_neighbors 요청 시에만 채워짐
+    text_index: Optional[int] = None  # /api/embed에서 여러 텍스트를 보낸 경우 원본 텍스트 번호
+    turn: Optional[int] = None  # 세션 모드에서 토큰이 속한 턴 번호 (1부터)
 
 
 class VisualizeResponse(BaseModel):
     tokens: list[TokenVector]  # 토큰과 벡터 정보가 함께 묶인 배열
-
+    session_id: Optional[str] = None
+    turn: Optional[int] = None  # 세션 모드에서 방금 처리한 턴 번호
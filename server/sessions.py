@@ -0,0 +1,316 @@
+"""
+Multi-turn sessions - 대화마다 llama 상태(KV 캐시)를 보관하여 새 턴의 토큰만 평가
+최근에 사용한 SESSION_MAX_RESIDENT개 세션만 메모리에 두고, 나머지는 LRU로 밀어내어
+SESSION_SPILL_DIR이 설정된 경우 디스크에 저장합니다.
+시각화 궤적은 최근 SESSION_MAX_TOKENS개 토큰만 유지하고, 디스크에는 pickle 대신 배열(.npz)과
+JSON 메타데이터로 저장하므로 저장 파일을 읽어도 코드가 실행되지 않습니다.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from utils import SYSTEM_PROMPT
+
+# 디스크에 저장된 세션의 만료 검사 주기(초)
+_SPILL_PURGE_INTERVAL = 60.0
+
+
+class Session:
+    """One conversation: chat history, saved llama state and the accumulated token trajectory"""
+
+    def __init__(self, session_id: str, max_tokens: int = 2048):
+        self.session_id = session_id
+        self.max_tokens = max_tokens
+        self.messages: List[Dict[str, str]] = [{"role": "system", "content": SYSTEM_PROMPT}]
+        self.state = None          # llama.save_state() 결과 (마지막 턴 생성 직후)
+        self.turn_count = 0
+        # 턴마다 누적되는 토큰 행 (시각화는 전체 궤적에 대해 PCA)
+        self.tokens: List[str] = []
+        self.embeddings: Optional[np.ndarray] = None  # (토큰 수, n_embd) float32
+        self.is_input: List[bool] = []
+        self.turns: List[int] = []
+        self.neighbors: List[Optional[list]] = []
+        self.neighbors_key = None  # 이웃을 계산한 (k, mode) - 바뀌면 다시 계산
+        self.last_used = time.time()
+        self.lock = threading.Lock()
+        self.users = 0             # checkout 중인 요청 수 (0이 아니면 LRU에서 밀어내지 않음)
+
+    def add_rows(self, tokens, embeddings, is_input: bool):
+        if not tokens:
+            return
+        rows = np.asarray(embeddings, dtype=np.float32).reshape(len(tokens), -1)
+        self.embeddings = rows if self.embeddings is None else np.concatenate([self.embeddings, rows])
+        self.tokens.extend(tokens)
+        self.is_input.extend([is_input] * len(tokens))
+        self.turns.extend([self.turn_count] * len(tokens))
+        self.neighbors.extend([None] * len(tokens))
+        self._trim()
+
+    def _trim(self):
+        """Keep at most max_tokens rows, dropping whole turns from the start where possible"""
+        excess = len(self.tokens) - self.max_tokens
+        if self.max_tokens <= 0 or excess <= 0:
+            return
+        # 잘리는 지점이 턴 중간이면 그 턴의 나머지도 제외 (마지막 턴은 남김)
+        cut = excess
+        while cut < len(self.turns) and self.turns[cut] == self.turns[cut - 1] and self.turns[cut] != self.turns[-1]:
+            cut += 1
+        del self.tokens[:cut], self.is_input[:cut], self.turns[:cut], self.neighbors[:cut]
+        # 슬라이스는 원래 배열을 참조하므로 복사해서 메모리를 돌려줌
+        self.embeddings = self.embeddings[cut:].copy()
+
+    def drop_oldest_turn(self) -> bool:
+        """Remove the oldest user/assistant pair from the history (the trajectory is kept)"""
+        if len(self.messages) < 3:
+            return False
+        del self.messages[1:3]
+        # 기록 앞부분이 바뀌었으므로 저장된 KV 캐시는 더 이상 prefix가 아님
+        self.state = None
+        return True
+
+    def save(self, f):
+        """Write the session as arrays plus JSON metadata (neighbors are recomputed after a restore)"""
+        meta = {
+            "session_id": self.session_id,
+            "messages": self.messages,
+            "turn_count": self.turn_count,
+            "tokens": self.tokens,
+            "is_input": self.is_input,
+            "turns": self.turns,
+            "last_used": self.last_used,
+        }
+        arrays = {}
+        if self.embeddings is not None:
+            arrays["embeddings"] = self.embeddings
+        if self.state is not None:
+            meta["state"] = {
+                "n_tokens": int(self.state.n_tokens),
+                "llama_state_size": int(self.state.llama_state_size),
+                "seed": int(self.state.seed),
+            }
+            arrays["state_input_ids"] = np.asarray(self.state.input_ids)
+            arrays["state_scores"] = np.asarray(self.state.scores)
+            arrays["state_data"] = np.frombuffer(self.state.llama_state, dtype=np.uint8)
+        np.savez(f, meta=np.array(json.dumps(meta, ensure_ascii=False)), **arrays)
+
+    @classmethod
+    def load(cls, f, max_tokens: int = 2048) -> "Session":
+        """Read a session written by save() (no pickled objects are accepted)"""
+        with np.load(f, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            session = cls(meta["session_id"], max_tokens)
+            session.messages = meta["messages"]
+            session.turn_count = meta["turn_count"]
+            session.tokens = meta["tokens"]
+            session.is_input = meta["is_input"]
+            session.turns = meta["turns"]
+            session.neighbors = [None] * len(session.tokens)
+            session.last_used = meta["last_used"]
+            if "embeddings" in data:
+                session.embeddings = data["embeddings"]
+            if "state" in meta:
+                from llama_cpp.llama import LlamaState
+
+                session.state = LlamaState(
+                    input_ids=data["state_input_ids"],
+                    scores=data["state_scores"],
+                    n_tokens=meta["state"]["n_tokens"],
+                    llama_state=data["state_data"].tobytes(),
+                    llama_state_size=meta["state"]["llama_state_size"],
+                    seed=meta["state"]["seed"],
+                )
+        rows = 0 if session.embeddings is None else len(session.embeddings)
+        if rows != len(session.tokens) or not len(session.is_input) == len(session.turns) == rows:
+            raise ValueError("Token and embedding rows do not match")
+        session._trim()
+        return session
+
+
+class SessionManager:
+    """LRU of resident sessions with optional spill to disk"""
+
+    def __init__(self, max_resident: int = 8, spill_dir: str = "", ttl: float = 3600.0, max_tokens: int = 2048):
+        self.max_resident = max(1, max_resident)
+        self.max_tokens = max_tokens
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        # LRU에서 밀려나 디스크에 기록 중인 세션 (기록은 매니저 잠금 밖에서 수행)
+        self._spilling: Dict[str, Session] = {}
+        self._lock = threading.Lock()
+        self._last_spill_purge = 0.0
+        self.stats = {"created": 0, "resumed": 0, "restored": 0, "spilled": 0, "evicted": 0, "expired": 0}
+        if self.spill_dir is not None:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+
+    def _spill_path(self, session_id: str) -> Path:
+        digest = hashlib.sha256(session_id.encode("utf-8")).hexdigest()
+        return self.spill_dir / f"{digest}.session"
+
+    def _spill(self, session: Session):
+        """Write an evicted session to disk (called without the manager lock)"""
+        if self.spill_dir is None:
+            return
+        path = self._spill_path(session.session_id)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        # 쓰는 동안 다시 요청된 세션은 checkout이 session.lock에서 기록이 끝나기를 기다림
+        with session.lock:
+            try:
+                with open(tmp_path, "wb") as f:
+                    session.save(f)
+                os.replace(tmp_path, path)
+                spilled = True
+            except Exception as e:
+                print(f"[SESSION] Failed to spill session {session.session_id!r}: {e}")
+                tmp_path.unlink(missing_ok=True)
+                spilled = False
+
+            with self._lock:
+                if self._spilling.get(session.session_id) is session:
+                    del self._spilling[session.session_id]
+                    self.stats["spilled" if spilled else "evicted"] += 1
+                elif spilled:
+                    # 기록 중에 다시 사용되었거나 삭제됨 - 메모리의 세션이 최신이므로 파일은 버림
+                    path.unlink(missing_ok=True)
+
+    def _restore(self, session_id: str) -> Optional[Session]:
+        if self.spill_dir is None:
+            return None
+        path = self._spill_path(session_id)
+        try:
+            expired = self.ttl > 0 and path.stat().st_mtime + self.ttl < time.time()
+        except FileNotFoundError:
+            return None
+        try:
+            if expired:
+                self.stats["expired"] += 1
+                return None
+            with open(path, "rb") as f:
+                session = Session.load(f, self.max_tokens)
+            self.stats["restored"] += 1
+            return session
+        except Exception as e:
+            print(f"[SESSION] Failed to restore session {session_id!r}, starting fresh: {e}")
+            return None
+        finally:
+            path.unlink(missing_ok=True)
+
+    def _purge_expired(self, now: float):
+        """Drop idle resident sessions, and (at most once a minute) expired spill files (lock held)"""
+        if self.ttl <= 0:
+            return
+        for session_id, session in list(self._sessions.items()):
+            if session.last_used + self.ttl < now and not session.users:
+                del self._sessions[session_id]
+                self.stats["expired"] += 1
+
+        if self.spill_dir is not None and now - self._last_spill_purge > _SPILL_PURGE_INTERVAL:
+            self._last_spill_purge = now
+            for path in self.spill_dir.glob("*.session"):
+                try:
+                    if path.stat().st_mtime + self.ttl < now:
+                        path.unlink()
+                        self.stats["expired"] += 1
+                except FileNotFoundError:
+                    pass
+
+    def _evict(self) -> List[Session]:
+        """Remove least recently used sessions beyond max_resident, skipping ones in use (lock held)
+
+        Returns the sessions to pass to _spill() once the lock is released.
+        """
+        evicted = []
+        for session_id in list(self._sessions):
+            if len(self._sessions) <= self.max_resident:
+                break
+            session = self._sessions[session_id]
+            if session.users:
+                continue
+            del self._sessions[session_id]
+            if self.spill_dir is None:
+                self.stats["evicted"] += 1
+                continue
+            self._spilling[session_id] = session
+            evicted.append(session)
+        return evicted
+
+    def _get_or_create(self, session_id: str) -> Session:
+        with self._lock:
+            self._purge_expired(time.time())
+            session = self._sessions.get(session_id)
+            if session is None:
+                # 디스크에 기록 중인 세션은 메모리의 객체를 그대로 다시 사용
+                session = self._spilling.pop(session_id, None)
+                if session is not None:
+                    self._sessions[session_id] = session
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                self.stats["resumed"] += 1
+            else:
+                session = self._restore(session_id)
+                if session is None:
+                    session = Session(session_id, self.max_tokens)
+                    self.stats["created"] += 1
+                self._sessions[session_id] = session
+            session.users += 1
+            return session
+
+    @contextmanager
+    def checkout(self, session_id: str):
+        """Exclusive access to a session for one turn (created or restored as needed)"""
+        session = self._get_or_create(session_id)
+        try:
+            with session.lock:
+                try:
+                    yield session
+                finally:
+                    session.last_used = time.time()
+        finally:
+            with self._lock:
+                session.users -= 1
+                evicted = self._evict()
+            for evicted_session in evicted:
+                self._spill(evicted_session)
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            removed = self._sessions.pop(session_id, None) is not None
+            removed = self._spilling.pop(session_id, None) is not None or removed
+            if self.spill_dir is not None:
+                path = self._spill_path(session_id)
+                if path.exists():
+                    path.unlink(missing_ok=True)
+                    removed = True
+            return removed
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            spilled = len(list(self.spill_dir.glob("*.session"))) if self.spill_dir is not None else 0
+            return {
+                "resident": len(self._sessions),
+                "max_resident": self.max_resident,
+                "spilled": spilled,
+                "stats": dict(self.stats),
+            }
+
+
+_session_manager = None
+_session_manager_lock = threading.Lock()
+
+
+def get_session_manager() -> SessionManager:
+    global _session_manager
+    with _session_manager_lock:
+        if _session_manager is None:
+            from config import SESSION_MAX_RESIDENT, SESSION_SPILL_DIR, SESSION_TTL, SESSION_MAX_TOKENS
+
+            _session_manager = SessionManager(SESSION_MAX_RESIDENT, SESSION_SPILL_DIR, SESSION_TTL, SESSION_MAX_TOKENS)
+        return _session_manager
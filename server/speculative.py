@@ -0,0 +1,242 @@
+"""
+Speculative decoding - 생성 단계(디코드)의 초안 토큰 제안기
+SPECULATIVE_MODE로 선택합니다 (기본값 off). off가 아니면 메인 모델을 logits_all=True로 로드하므로
+요청별 사용 여부와 관계없이 n_ctx x n_vocab 크기의 logits 메모리가 추가됩니다.
+속도 향상은 모델, 프롬프트와 채택률에 따라 다르므로 bench_speculative.py로 측정하세요.
+
+    prompt_lookup   프롬프트에서 n-gram이 일치하는 다음 토큰들을 그대로 제안 (추가 모델 없음)
+    draft           작은 draft GGUF(같은 어휘)가 greedy로 다음 토큰들을 제안
+    both            prompt lookup을 먼저 시도하고, 일치가 없으면 draft 모델 사용
+
+제안된 토큰은 메인 모델이 한 번의 배치로 검증하고, 각 위치에서 메인 모델이 샘플링한 토큰과
+같을 때만 채택합니다(llama-cpp-python generate()). 출력 토큰은 항상 메인 모델의 분포에서
+샘플링되므로 출력 분포는 바뀌지 않고, 캐시된 결과도 그대로 유효합니다.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+SPECULATIVE_MODES = ("off", "prompt_lookup", "draft", "both")
+
+
+class GGUFDraftModel:
+    """Greedy draft proposals from a small GGUF model sharing the main model's vocabulary"""
+
+    def __init__(self, model_path: str, num_pred_tokens: int = 4, n_threads: int = 1, n_ctx: int = 4096):
+        from llama_cpp import Llama
+
+        self.num_pred_tokens = num_pred_tokens
+        self.llama = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, n_gpu_layers=0, verbose=False)
+
+    def __call__(self, input_ids: np.ndarray, **kwargs) -> np.ndarray:
+        import llama_cpp
+
+        draft = self.llama
+        ids = input_ids.tolist()
+        if not ids or len(ids) + self.num_pred_tokens > draft.n_ctx():
+            return np.array([], dtype=np.intc)
+
+        # draft 모델의 KV 캐시와 겹치는 부분은 재평가하지 않음 (마지막 토큰은 logits를 얻기 위해 다시 평가)
+        prefix = 0
+        for a, b in zip(draft.input_ids[:draft.n_tokens].tolist(), ids[:-1]):
+            if a != b:
+                break
+            prefix += 1
+        draft.n_tokens = prefix
+        draft.eval(ids[prefix:])
+
+        n_vocab = draft.n_vocab()
+        eos = draft.token_eos()
+        proposed = []
+        for _ in range(self.num_pred_tokens):
+            logits = np.ctypeslib.as_array(llama_cpp.llama_get_logits_ith(draft.ctx, -1), shape=(n_vocab,))
+            token = int(np.argmax(logits))
+            if token == eos:
+                break
+            proposed.append(token)
+            if len(proposed) < self.num_pred_tokens:
+                draft.eval([token])
+        return np.array(proposed, dtype=np.intc)
+
+
+class CombinedDraftModel:
+    """Prompt lookup first, falling back to the draft model when no n-gram matches"""
+
+    def __init__(self, lookup, model):
+        self.lookup = lookup
+        self.model = model
+
+    def __call__(self, input_ids: np.ndarray, **kwargs) -> np.ndarray:
+        proposed = self.lookup(input_ids)
+        if len(proposed) > 0:
+            return proposed
+        return self.model(input_ids)
+
+
+class SpeculativeStats:
+    """Draft acceptance and generation throughput, with and without speculation"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.drafted = 0
+        self.accepted = 0
+        self.draft_calls = 0
+        self.draft_seconds = 0.0
+        self.generation = {
+            "speculative": {"requests": 0, "tokens": 0, "seconds": 0.0},
+            "plain": {"requests": 0, "tokens": 0, "seconds": 0.0},
+        }
+
+    def record_draft(self, drafted: int, seconds: float):
+        with self._lock:
+            self.draft_calls += 1
+            self.drafted += drafted
+            self.draft_seconds += seconds
+
+    def record_accepted(self, accepted: int):
+        with self._lock:
+            self.accepted += accepted
+
+    def record_generation(self, speculative: bool, tokens: int, seconds: float):
+        with self._lock:
+            bucket = self.generation["speculative" if speculative else "plain"]
+            bucket["requests"] += 1
+            bucket["tokens"] += tokens
+            bucket["seconds"] += seconds
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            generation = {
+                name: {
+                    **bucket,
+                    "seconds": round(bucket["seconds"], 3),
+                    "tokens_per_sec": round(bucket["tokens"] / bucket["seconds"], 2) if bucket["seconds"] else None,
+                }
+                for name, bucket in self.generation.items()
+            }
+            return {
+                "drafted_tokens": self.drafted,
+                "accepted_tokens": self.accepted,
+                "acceptance_rate": round(self.accepted / self.drafted, 4) if self.drafted else None,
+                "draft_calls": self.draft_calls,
+                "draft_seconds": round(self.draft_seconds, 3),
+                "generation": generation,
+            }
+
+
+class TrackedDraftModel:
+    """Wraps a draft model and infers how many proposals the main model accepted
+
+    generate() calls the draft model with every token accepted so far, so the next call shows
+    how many of the previous proposals survived verification.
+    """
+
+    def __init__(self, inner, stats: SpeculativeStats):
+        self.inner = inner
+        self.stats = stats
+        self._last_input: Optional[np.ndarray] = None
+        self._last_proposed: Optional[np.ndarray] = None
+
+    def reset(self):
+        """Forget pending proposals (call at the start of each generation)"""
+        self._last_input = None
+        self._last_proposed = None
+
+    def settle(self, input_ids: np.ndarray):
+        """Count accepted tokens of the pending proposals against the tokens that followed them"""
+        last_input, last_proposed = self._last_input, self._last_proposed
+        self._last_input = self._last_proposed = None
+        if (
+            last_input is not None
+            and len(last_proposed) > 0
+            and len(input_ids) > len(last_input)
+            and np.array_equal(input_ids[:len(last_input)], last_input)
+        ):
+            continued = input_ids[len(last_input):len(last_input) + len(last_proposed)]
+            mismatch = np.nonzero(continued != last_proposed[:len(continued)])[0]
+            self.stats.record_accepted(int(mismatch[0]) if len(mismatch) else len(continued))
+
+    def __call__(self, input_ids: np.ndarray, **kwargs) -> np.ndarray:
+        self.settle(input_ids)
+        started = time.perf_counter()
+        proposed = np.asarray(self.inner(input_ids, **kwargs), dtype=np.intc)
+        self.stats.record_draft(len(proposed), time.perf_counter() - started)
+        self._last_input = np.array(input_ids, copy=True)
+        self._last_proposed = proposed
+        return proposed
+
+
+speculative_stats = SpeculativeStats()
+_draft_model: Optional[TrackedDraftModel] = None
+_active_mode = "off"
+
+
+def create_draft_model(mode: str) -> Optional[TrackedDraftModel]:
+    """Build the draft model for SPECULATIVE_MODE (None when off or unavailable)"""
+    global _draft_model, _active_mode
+    from config import (
+        SPECULATIVE_NUM_PRED_TOKENS, SPECULATIVE_MAX_NGRAM, SPECULATIVE_DRAFT_MODEL_PATH,
+        SPECULATIVE_DRAFT_N_THREADS,
+    )
+
+    if mode not in SPECULATIVE_MODES:
+        print(f"[SPECULATIVE] Unknown SPECULATIVE_MODE '{mode}' (known: {', '.join(SPECULATIVE_MODES)}), disabled")
+        mode = "off"
+
+    if mode in ("draft", "both") and not SPECULATIVE_DRAFT_MODEL_PATH:
+        fallback = "prompt_lookup" if mode == "both" else "off"
+        print(f"[SPECULATIVE] SPECULATIVE_DRAFT_MODEL_PATH is not set, using '{fallback}' instead of '{mode}'")
+        mode = fallback
+
+    inner = None
+    if mode in ("prompt_lookup", "both"):
+        from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+
+        inner = LlamaPromptLookupDecoding(
+            max_ngram_size=SPECULATIVE_MAX_NGRAM, num_pred_tokens=SPECULATIVE_NUM_PRED_TOKENS
+        )
+    if mode in ("draft", "both"):
+        print(f"[SPECULATIVE] Loading draft model from {SPECULATIVE_DRAFT_MODEL_PATH}")
+        model = GGUFDraftModel(
+            SPECULATIVE_DRAFT_MODEL_PATH,
+            num_pred_tokens=SPECULATIVE_NUM_PRED_TOKENS,
+            n_threads=SPECULATIVE_DRAFT_N_THREADS,
+        )
+        inner = CombinedDraftModel(inner, model) if inner is not None else model
+
+    _active_mode = mode
+    _draft_model = TrackedDraftModel(inner, speculative_stats) if inner is not None else None
+    if _draft_model is not None:
+        print(f"[SPECULATIVE] Speculative decoding enabled (mode={mode})")
+    return _draft_model
+
+
+def is_speculative_available() -> bool:
+    return _draft_model is not None
+
+
+@contextmanager
+def speculative_decoding(llama, enabled: Optional[bool] = None):
+    """Generate with the draft model unless `enabled` is False (no-op when SPECULATIVE_MODE is off)
+
+    Yields whether speculation is actually used for this generation.
+    """
+    use = _draft_model is not None and enabled is not False
+    previous = getattr(llama, "draft_model", None)
+    llama.draft_model = _draft_model if use else None
+    if use:
+        _draft_model.reset()
+    try:
+        yield use
+    finally:
+        llama.draft_model = previous
+        if use:
+            # 마지막 제안은 다음 호출이 없으므로 생성이 끝난 토큰열로 채택 수를 계산
+            _draft_model.settle(np.asarray(llama.input_ids[:llama.n_tokens]))
+
+
+def get_speculative_status() -> Dict[str, Any]:
+    return {"mode": _active_mode, **speculative_stats.snapshot()}
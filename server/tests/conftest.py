@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 서버 모듈은 server/ 디렉터리에서 평탄하게 import됨
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
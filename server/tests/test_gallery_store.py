@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+import config
+import gallery_store
+from gallery_store import GalleryStore, get_gallery_store, write_gallery_store
+
+ENTRIES = [
+    ("Hello world", [("Hello", [0.5, -1.25, 2.0], True), (" world", [1.0, 0.0, -0.5], True)]),
+    ("  안녕하세요 ", [("안녕", [0.25, 0.125, -3.0], True), ("하세요", [0.75, 1.5, -0.0625], False)]),
+    ("empty", []),
+]
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "gallery.bin"
+    assert write_gallery_store(path, ENTRIES) == 3
+
+    store = GalleryStore(path)
+    try:
+        assert len(store) == 3
+        assert sorted(store.texts()) == sorted(["Hello world", "안녕하세요", "empty"])
+        assert "안녕하세요" in store
+        assert "missing" not in store
+        assert store.lookup("Hello world") == {
+            "tokens": [
+                {"token": "Hello", "destination": [0.5, -1.25, 2.0], "is_input": True},
+                {"token": " world", "destination": [1.0, 0.0, -0.5], "is_input": True},
+            ]
+        }
+        assert store.lookup("empty") == {"tokens": []}
+        assert dict(store.items())["안녕하세요"][1] == ("하세요", [0.75, 1.5, -0.0625], False)
+    finally:
+        store.close()
+
+
+def test_duplicate_inputs_keep_last(tmp_path):
+    path = tmp_path / "gallery.bin"
+    rows = [("a", [0.0, 0.0, 0.0], True)]
+    assert write_gallery_store(path, [("text", []), (" text", rows)]) == 1
+    store = GalleryStore(path)
+    try:
+        assert len(store.lookup("text")["tokens"]) == 1
+    finally:
+        store.close()
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "gallery.bin"
+    path.write_bytes(b"\x00" * 256)
+    with pytest.raises(ValueError):
+        GalleryStore(path)
+
+
+@pytest.fixture
+def shared_path(tmp_path, monkeypatch):
+    path = tmp_path / "gallery.bin"
+    monkeypatch.setattr(config, "GALLERY_STORE_PATH", path)
+    monkeypatch.setattr(gallery_store, "_gallery_store", None)
+    monkeypatch.setattr(gallery_store, "_gallery_store_mtime", None)
+    return path
+
+
+def test_shared_store_reloads_and_closes_the_old_map(shared_path):
+    write_gallery_store(shared_path, ENTRIES[:1])
+    with get_gallery_store() as first:
+        assert len(first) == 1
+
+        write_gallery_store(shared_path, ENTRIES)
+        os.utime(shared_path, ns=(0, os.stat(shared_path).st_mtime_ns + 1))
+        with get_gallery_store() as second:
+            assert len(second) == 3
+        # 읽는 중인 이전 저장소는 블록이 끝날 때까지 열려 있음
+        assert first.lookup("Hello world") is not None
+        assert not first._mm.closed
+
+    assert first._mm.closed
+    assert not second._mm.closed
+    second.close()
+
+
+def test_shared_store_missing_file(shared_path):
+    with get_gallery_store() as store:
+        assert store is None
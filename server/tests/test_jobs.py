@@ -0,0 +1,108 @@
+import pytest
+
+from jobs import ClientQueueFull, JobConflict, JobStore, QueueFull
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+def _submit(store, client, text, **kwargs):
+    job, _ = store.submit("visualize", {"input_text": text}, client, **kwargs)
+    return job
+
+
+def _drain(store):
+    claimed = []
+    while True:
+        job = store.claim()
+        if job is None:
+            return claimed
+        claimed.append(job["payload"]["input_text"])
+        store.finish(job["id"], result={})
+
+
+def test_idempotency_key_returns_existing_job(store):
+    job, created = store.submit("visualize", {"input_text": "a"}, "c1", idempotency_key="k")
+    again, created_again = store.submit("visualize", {"input_text": "a"}, "c1", idempotency_key="k")
+    assert created and not created_again
+    assert again["id"] == job["id"]
+    # 다른 클라이언트의 같은 키는 별개
+    assert store.submit("visualize", {"input_text": "a"}, "c2", idempotency_key="k")[1]
+    with pytest.raises(JobConflict):
+        store.submit("visualize", {"input_text": "b"}, "c1", idempotency_key="k")
+
+
+def test_claim_takes_turns_between_clients(store):
+    for i in range(3):
+        _submit(store, "a", f"a{i}")
+    for i in range(2):
+        _submit(store, "b", f"b{i}")
+    _submit(store, "c", "c0")
+    assert _drain(store) == ["a0", "b0", "c0", "a1", "b1", "a2"]
+
+
+def test_claim_marks_job_running(store):
+    job = _submit(store, "a", "x")
+    claimed = store.claim()
+    assert claimed["id"] == job["id"]
+    assert claimed["status"] == "running" and claimed["attempts"] == 1
+    assert store.get(job["id"])["status"] == "running"
+    assert store.claim() is None
+
+
+def test_queue_limits(store):
+    _submit(store, "a", "a0", max_queued_per_client=2)
+    _submit(store, "a", "a1", max_queued_per_client=2)
+    with pytest.raises(ClientQueueFull):
+        _submit(store, "a", "a2", max_queued_per_client=2)
+    _submit(store, "b", "b0", max_queued=3)
+    with pytest.raises(QueueFull):
+        _submit(store, "c", "c0", max_queued=3)
+
+
+def test_retry_later_does_not_count_attempt(store):
+    job = _submit(store, "a", "x")
+    store.claim()
+    store.retry_later(job["id"], delay=0)
+    assert store.get(job["id"])["attempts"] == 0
+    assert store.claim()["attempts"] == 1
+
+    store.retry_later(job["id"], delay=60)
+    assert store.get(job["id"])["status"] == "queued"
+    assert store.claim() is None
+
+
+def test_recover_requeues_or_fails_interrupted_jobs(store):
+    fresh = _submit(store, "a", "fresh")
+    worn = _submit(store, "a", "worn")
+    store.claim()
+    store.claim()
+    # "worn"은 이미 마지막 시도를 사용한 것으로 만듦
+    store._connect().execute("UPDATE jobs SET attempts = 3 WHERE id = ?", (worn["id"],))
+
+    assert store.recover(max_attempts=3) == 1
+    assert store.get(fresh["id"])["status"] == "queued"
+    failed = store.get(worn["id"])
+    assert failed["status"] == "failed" and "3" in failed["error"]
+
+
+def test_expired_results_are_purged(store):
+    job = _submit(store, "a", "x")
+    store.claim()
+    store.finish(job["id"], result={"ok": True}, ttl=60)
+    assert store.get(job["id"])["result"] == {"ok": True}
+
+    store._connect().execute("UPDATE jobs SET expires_at = 1 WHERE id = ?", (job["id"],))
+    assert store.get(job["id"]) is None
+    assert store.purge_expired() == 1
+    assert store.counts() == {}
+    assert store._connect().execute("SELECT COUNT(*) FROM job_clients").fetchone()[0] == 0
+
+
+def test_queue_position_estimate(store):
+    a = [_submit(store, "a", f"a{i}") for i in range(3)]
+    _submit(store, "b", "b0")
+    assert store.queue_position(a[0]) == 1
+    assert store.queue_position(a[2]) == 3
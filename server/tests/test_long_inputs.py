@@ -0,0 +1,160 @@
+import ctypes
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import config
+import routes
+import tokenizer_service
+from chunked_embedding import embed_long, plan_windows, window_size
+from routes import RequestError, check_document_length, parse_embed_request, parse_visualize_request
+
+
+def _covered(windows):
+    """Token positions kept from each window, in order"""
+    return [i for _, keep_start, end in windows for i in range(keep_start, end)]
+
+
+@pytest.mark.parametrize("n_tokens", [1, 511, 512, 513, 1000, 4097])
+def test_windows_keep_every_token_once(n_tokens):
+    windows = plan_windows(n_tokens, window=512, overlap=128)
+    assert _covered(windows) == list(range(n_tokens))
+
+
+def test_window_layout():
+    windows = plan_windows(1200, window=512, overlap=128)
+    assert windows[0] == (0, 0, 512)
+    assert windows[1] == (384, 512, 895)
+    for context_start, keep_start, end in windows[1:]:
+        assert keep_start - context_start == 128
+        # 뒤 윈도우는 BOS 한 토큰을 더 가짐
+        assert 1 + end - context_start <= 512
+
+
+def test_overlap_is_clamped_to_leave_new_tokens():
+    windows = plan_windows(100, window=10, overlap=50)
+    assert _covered(windows) == list(range(100))
+    assert all(end > keep_start for _, keep_start, end in windows)
+
+
+def test_window_size_is_bounded_by_batch(monkeypatch):
+    monkeypatch.setattr(config, "EMBED_WINDOW_TOKENS", 512)
+    assert window_size(SimpleNamespace(n_batch=256)) == 256
+    assert window_size(SimpleNamespace(n_batch=2048)) == 512
+
+
+class _FakeBatch:
+    def __init__(self):
+        self.sequences = []
+
+    def reset(self):
+        self.sequences = []
+
+    def add_sequence(self, tokens, seq_id, logits_all):
+        self.sequences.append((seq_id, list(tokens)))
+
+
+class _FakeContext:
+    """Records decodes; the "hidden state" of a token is (token, position in its sequence)"""
+
+    def __init__(self, batch):
+        self.batch = batch
+        self.decodes = []
+        self.outputs = None
+
+    def kv_cache_clear(self):
+        pass
+
+    def decode(self, batch):
+        self.decodes.append([seq_id for seq_id, _ in batch.sequences])
+        rows = [(token, position) for _, tokens in batch.sequences for position, token in enumerate(tokens)]
+        self.outputs = np.array(rows, dtype=np.float32).reshape(-1)
+
+
+class _FakeLlama:
+    BOS = -1
+
+    def __init__(self, n_batch: int):
+        self.n_batch = n_batch
+        self._batch = _FakeBatch()
+        self._ctx = _FakeContext(self._batch)
+        self.ctx = self._ctx
+
+    def n_embd(self):
+        return 2
+
+    def token_bos(self):
+        return self.BOS
+
+    def reset(self):
+        pass
+
+
+@pytest.fixture
+def fake_llama_cpp(monkeypatch):
+    def llama_get_embeddings(ctx):
+        return ctx.outputs.ctypes.data_as(ctypes.POINTER(ctypes.c_float))
+
+    monkeypatch.setitem(sys.modules, "llama_cpp", SimpleNamespace(llama_get_embeddings=llama_get_embeddings))
+
+
+def test_default_settings_pack_several_windows_per_decode(fake_llama_cpp):
+    llama = _FakeLlama(n_batch=config.LLAMA_N_BATCH)
+    tokens = [llama.BOS] + list(range(1, 1000))
+    vectors = embed_long(llama, tokens)
+
+    decodes = llama._ctx.decodes
+    windows = plan_windows(len(tokens), window_size(llama), config.EMBED_WINDOW_OVERLAP)
+    assert len(windows) > len(decodes) > 1
+    assert all(seq_ids == list(range(len(seq_ids))) for seq_ids in decodes)
+    assert max(len(seq_ids) for seq_ids in decodes) == config.LLAMA_N_BATCH // window_size(llama)
+    # 각 토큰의 벡터는 자신의 토큰에서 나오고, 첫 윈도우 뒤의 토큰은 왼쪽 문맥을 가짐
+    np.testing.assert_array_equal(vectors[:, 0], tokens)
+    first_end = windows[0][2]
+    assert np.all(vectors[first_end:, 1] > config.EMBED_WINDOW_OVERLAP)
+
+
+class _FakeTokenizer:
+    def __init__(self, tokens_per_char: int = 1, available: bool = True):
+        self.tokens_per_char = tokens_per_char
+        self.available = available
+        self.calls = 0
+
+    def count(self, text: str) -> int:
+        self.calls += 1
+        if not self.available:
+            raise tokenizer_service.TokenizerUnavailable("no model")
+        return len(text) * self.tokens_per_char
+
+
+@pytest.fixture
+def tokenizer(monkeypatch):
+    fake = _FakeTokenizer()
+    monkeypatch.setattr(config, "MAX_DOCUMENT_TOKENS", 100)
+    monkeypatch.setattr(tokenizer_service, "get_tokenizer_service", lambda: fake)
+    return fake
+
+
+def test_short_input_skips_tokenization(tokenizer):
+    check_document_length("x" * 98)
+    assert tokenizer.calls == 0
+
+
+def test_long_input_is_rejected_while_parsing(tokenizer):
+    check_document_length("x" * 100)
+    assert tokenizer.calls == 1
+    with pytest.raises(RequestError) as excinfo:
+        parse_visualize_request({"input_text": "x" * 101})
+    assert excinfo.value.status_code == 413
+    with pytest.raises(RequestError):
+        parse_embed_request({"texts": ["short", "x" * 101]})
+
+
+def test_length_check_is_deferred_without_tokenizer(tokenizer):
+    tokenizer.available = False
+    assert parse_visualize_request({"input_text": "x" * 500}).input_text == "x" * 500
+    with pytest.raises(RequestError) as excinfo:
+        routes.check_token_count(101)
+    assert excinfo.value.status_code == 413
@@ -0,0 +1,75 @@
+import http.client
+import json
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import main
+
+
+@pytest.fixture(scope="module")
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), main.VisualizeHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _request(port, method, path, body=None, headers=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        data = body if isinstance(body, bytes) or body is None else json.dumps(body).encode("utf-8")
+        conn.request(method, path, body=data, headers={"Content-Type": "application/json", **(headers or {})})
+        response = conn.getresponse()
+        return response.status, json.loads(response.read().decode("utf-8") or "null")
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("body", [b"[]", b'"x"', b"3", b"null"])
+def test_tokenize_rejects_non_object_body(server, body):
+    status, response = _request(server, "POST", "/api/tokenize", body)
+    assert status == 400
+    assert response["error"] == "Invalid request body"
+
+
+@pytest.mark.parametrize("body", [b"[]", b'{"kind": []}', b'{"kind": {"a": 1}}', b'{"kind": 3}', b'{"kind": "train"}'])
+def test_job_submission_requires_known_kind(server, body):
+    status, response = _request(server, "POST", "/api/jobs", body)
+    assert status == 400
+
+
+@pytest.mark.parametrize("configured, sent", [("", ""), ("", "anything"), ("secret", ""), ("secret", "wrong")])
+def test_profile_requires_matching_token(server, monkeypatch, configured, sent):
+    monkeypatch.setattr(main, "DEBUG_PROFILE_ENABLED", True)
+    monkeypatch.setattr(main, "DEBUG_PROFILE_TOKEN", configured)
+    headers = {"X-Debug-Token": sent} if sent else None
+    status, response = _request(server, "GET", "/debug/profile?seconds=0.01", headers=headers)
+    assert status == 403
+
+
+def test_profile_with_token(server, monkeypatch):
+    monkeypatch.setattr(main, "DEBUG_PROFILE_ENABLED", True)
+    monkeypatch.setattr(main, "DEBUG_PROFILE_TOKEN", "secret")
+    status, response = _request(server, "GET", "/debug/profile?seconds=0.01", headers={"X-Debug-Token": "secret"})
+    assert status == 200
+    assert response["sample_rounds"] > 0
+
+
+def test_profile_flag_ignored_without_token(monkeypatch):
+    import importlib
+
+    import config
+
+    monkeypatch.setenv("DEBUG_PROFILE_ENABLED", "true")
+    monkeypatch.delenv("DEBUG_PROFILE_TOKEN", raising=False)
+    try:
+        assert importlib.reload(config).DEBUG_PROFILE_ENABLED is False
+        monkeypatch.setenv("DEBUG_PROFILE_TOKEN", "secret")
+        assert importlib.reload(config).DEBUG_PROFILE_ENABLED is True
+    finally:
+        monkeypatch.undo()
+        importlib.reload(config)
@@ -0,0 +1,25 @@
+from precompute import read_inputs
+
+
+def test_read_inputs_skips_unusable_lines(tmp_path, capsys):
+    path = tmp_path / "prompts.jsonl"
+    path.write_text(
+        "\n".join([
+            '"Hello"',
+            '{"input_text": " Hello "}',
+            '{"input_text": "World", "extra": 1}',
+            "not json",
+            "42",
+            "[1, 2]",
+            "null",
+            '{"input_text": 5}',
+            '{"other": "x"}',
+            '"   "',
+            "",
+            '"안녕"',
+        ]),
+        encoding="utf-8",
+    )
+    assert read_inputs(path) == ["Hello", "World", "안녕"]
+    skipped = [line for line in capsys.readouterr().out.splitlines() if "Skipping" in line]
+    assert len(skipped) == 6
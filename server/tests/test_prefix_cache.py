@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from prefix_cache import PrefixCache, _Entry, common_prefix_length, state_nbytes
+from utils import compact_llama_state
+
+
+def _state(nbytes: int):
+    return SimpleNamespace(
+        llama_state=b"\x00" * nbytes,
+        scores=np.zeros((1, 4), dtype=np.float32),
+        input_ids=np.zeros(4, dtype=np.intc),
+    )
+
+
+def _entry(tokens, nbytes: int = 100, vectors=None):
+    return _Entry(list(tokens), vectors, _state(nbytes))
+
+
+def _keys(cache, kind):
+    return [list(key) for key in cache._entries[kind]]
+
+
+def test_common_prefix_length():
+    assert common_prefix_length([1, 2, 3], [1, 2, 4]) == 2
+    assert common_prefix_length([1, 2], [1, 2, 3]) == 2
+    assert common_prefix_length([], [1]) == 0
+
+
+def test_state_nbytes_counts_every_array():
+    state = _state(1000)
+    assert state_nbytes(state) == 1000 + 16 + state.input_ids.nbytes
+    vectors = np.zeros((3, 8), dtype=np.float32)
+    assert _Entry([1, 2, 3], vectors, state).nbytes == state_nbytes(state) + vectors.nbytes
+
+
+def test_compact_state_keeps_last_logits_row():
+    state = SimpleNamespace(scores=np.arange(12, dtype=np.float32).reshape(4, 3))
+    compact_llama_state(state)
+    np.testing.assert_array_equal(state.scores, [[9, 10, 11]])
+
+
+def test_longest_prefix_wins_and_refreshes_lru():
+    cache = PrefixCache(max_entries=2, min_prefix_tokens=2, max_bytes=0)
+    cache._store("chat", _entry([1, 2, 3, 4]))
+    cache._store("chat", _entry([1, 2, 9]))
+
+    entry, n = cache._best_match("chat", [1, 2, 3, 5])
+    assert entry.tokens == [1, 2, 3, 4] and n == 3
+    # 방금 사용한 항목은 유지되고 다른 항목이 밀려남
+    cache._store("chat", _entry([7, 8, 9]))
+    assert _keys(cache, "chat") == [[1, 2, 3, 4], [7, 8, 9]]
+    assert cache.stats["evicted"] == 1
+
+
+def test_short_common_prefix_is_a_miss():
+    cache = PrefixCache(min_prefix_tokens=3, max_bytes=0)
+    cache._store("chat", _entry([1, 2, 3, 4]))
+    assert cache._best_match("chat", [1, 2, 9]) == (None, 0)
+    assert cache._best_match("embed", [1, 2, 3, 4]) == (None, 0)
+    assert cache.stats["misses"] == 2
+
+
+def test_short_inputs_are_not_stored():
+    cache = PrefixCache(min_store_tokens=4)
+    assert not cache._should_store([1, 2, 3])
+    assert cache._should_store([1, 2, 3, 4])
+    assert cache.stats["skipped_short"] == 1
+
+
+def test_byte_budget_evicts_oldest_across_kinds():
+    size = _entry([0]).nbytes
+    cache = PrefixCache(max_entries=8, min_prefix_tokens=1, max_bytes=3 * size)
+    cache._store("embed", _entry([1]))
+    cache._store("chat", _entry([2]))
+    cache._store("embed", _entry([3]))
+    cache._store("chat", _entry([4]))
+    assert _keys(cache, "embed") == [[3]]
+
+    # 적중한 임베딩 항목은 최근 사용으로 갱신되어 채팅 항목이 먼저 밀려남
+    cache._best_match("embed", [3])
+    cache._store("embed", _entry([5]))
+    assert _keys(cache, "embed") == [[3], [5]]
+    assert _keys(cache, "chat") == [[4]]
+    assert cache.snapshot()["bytes"] == 3 * size
+
+
+def test_oversized_entry_is_skipped():
+    cache = PrefixCache(max_bytes=50)
+    cache._store("chat", _entry([1, 2, 3], nbytes=100))
+    assert _keys(cache, "chat") == []
+    assert cache.stats["skipped_large"] == 1
+    assert cache.snapshot()["bytes"] == 0
+
+
+def test_storing_same_tokens_replaces_entry():
+    cache = PrefixCache(max_bytes=0)
+    cache._store("chat", _entry([1, 2, 3], nbytes=100))
+    cache._store("chat", _entry([1, 2, 3], nbytes=200))
+    assert len(cache._entries["chat"]) == 1
+    assert cache.snapshot()["bytes"] == _entry([0], nbytes=200).nbytes
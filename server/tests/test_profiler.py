@@ -0,0 +1,44 @@
+import threading
+
+import pytest
+
+import profiler
+
+
+def _spin(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sample_stacks_collects_busy_thread():
+    stop = threading.Event()
+    worker = threading.Thread(target=_spin, args=(stop,), name="spin-worker", daemon=True)
+    worker.start()
+    try:
+        result = profiler.sample_stacks(0.2, interval=0.005)
+    finally:
+        stop.set()
+        worker.join()
+
+    assert result["sample_rounds"] > 0
+    summary = result["summary"]
+    assert summary["python_samples"] > 0
+    assert summary["busy_samples"] == summary["native_samples"] + summary["python_samples"]
+
+    spin_stacks = [line for line in result["collapsed"] if line.startswith("spin-worker;")]
+    assert spin_stacks
+    stack, count = spin_stacks[0].rsplit(" ", 1)
+    assert int(count) > 0
+    assert "_spin (test_profiler.py:" in stack
+
+
+def test_sample_stacks_rejects_concurrent_session():
+    assert profiler._profile_lock.acquire(blocking=False)
+    try:
+        with pytest.raises(profiler.ProfilerBusy):
+            profiler.sample_stacks(0.01)
+    finally:
+        profiler._profile_lock.release()
+
+    # 잠금이 풀리면 다시 실행 가능
+    assert profiler.sample_stacks(0.01)["sample_rounds"] > 0
@@ -0,0 +1,212 @@
+import http.client
+import json
+import socket
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from jobs import new_job_id
+from router import ForwardError, HashRing, Node, Router, RouterHandler
+from routing import key_hash, routing_hash
+
+NODES = ["http://a:8080", "http://b:8080", "http://c:8080"]
+
+
+def test_preference_list_covers_every_node_once():
+    ring = HashRing(NODES, virtual_nodes=16)
+    for i in range(50):
+        ordered = ring.preference_list(key_hash(f"text {i}"))
+        assert sorted(ordered) == sorted(NODES)
+
+
+def test_keys_spread_across_nodes():
+    ring = HashRing(NODES, virtual_nodes=64)
+    owners = Counter(ring.preference_list(key_hash(f"text {i}"))[0] for i in range(3000))
+    assert set(owners) == set(NODES)
+    assert min(owners.values()) > 500
+
+
+def test_removing_a_node_only_moves_its_keys():
+    before = HashRing(NODES, virtual_nodes=64)
+    after = HashRing(NODES[:2], virtual_nodes=64)
+    for i in range(500):
+        h = key_hash(f"text {i}")
+        owner = before.preference_list(h)[0]
+        if owner != NODES[2]:
+            assert after.preference_list(h)[0] == owner
+        else:
+            # 사라진 노드의 키는 링에서 다음 노드로 이동
+            assert after.preference_list(h)[0] == before.preference_list(h)[1]
+
+
+def test_empty_ring():
+    assert HashRing([]).preference_list(123) == []
+
+
+def test_same_text_routes_the_same_way():
+    a = routing_hash("/api/visualize", '{"input_text": "  Hello "}'.encode("utf-8"))
+    b = routing_hash("/api/embed", '{"input_text": "Hello"}'.encode("utf-8"))
+    assert a == b
+
+
+def test_job_polling_follows_the_submitted_request():
+    body = b'{"input_text": "Hello"}'
+    job_id = new_job_id("visualize", {"input_text": "Hello"})
+    assert routing_hash(f"/api/jobs/{job_id}", None) == routing_hash("/api/visualize", body)
+
+
+class _SlowHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        time.sleep(1.0)
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def slow_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _SlowHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_timeout_is_not_failed_over(slow_server):
+    node = Node(slow_server, pool_size=1, timeout=0.2)
+    with pytest.raises(ForwardError) as excinfo:
+        node.request("GET", "/slow", None, {})
+    assert excinfo.value.stage == "timeout"
+    assert not excinfo.value.can_failover
+
+
+def test_refused_connection_can_fail_over():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    node = Node(f"http://127.0.0.1:{port}", pool_size=1, timeout=1.0)
+    with pytest.raises(ForwardError) as excinfo:
+        node.request("GET", "/", None, {})
+    assert excinfo.value.stage == "connect"
+    assert excinfo.value.can_failover
+
+
+def _replica(status: int):
+    """Replica stub answering every request with `status`; returns (server, url, hits)"""
+    hits = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            hits.append(self.path)
+            body = json.dumps({"status_code": status}).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Retry-After", "30")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", hits
+
+
+def _closed_url():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def _body_owned_by(url, nodes):
+    """A request body that `url` owns on the ring"""
+    ring = HashRing(nodes, virtual_nodes=16)
+    for i in range(1000):
+        body = json.dumps({"input_text": f"text {i}"}).encode("utf-8")
+        if ring.preference_list(routing_hash("/api/visualize", body))[0] == url:
+            return body
+    raise AssertionError("no key owned by " + url)
+
+
+@pytest.fixture
+def route():
+    """Start a router over `nodes` and POST a request owned by `owner` through it"""
+    servers = []
+
+    def post(nodes, owner):
+        router = Router(nodes, virtual_nodes=16, pool_size=2, timeout=5.0)
+        handler = type("Handler", (RouterHandler,), {"router": router})
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        conn = http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout=10)
+        try:
+            conn.request("POST", "/api/visualize", body=_body_owned_by(owner, nodes),
+                         headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            return router, response.status, dict(response.getheaders()), response.read()
+        finally:
+            conn.close()
+
+    yield post
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def replicas():
+    """Start replica stubs by status code; shut them down after the test"""
+    servers = []
+
+    def start(status):
+        server, url, hits = _replica(status)
+        servers.append(server)
+        return url, hits
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_application_503_is_passed_through(route, replicas):
+    busy_url, busy_hits = replicas(503)
+    ok_url, ok_hits = replicas(200)
+    router, status, headers, _ = route([busy_url, ok_url], owner=busy_url)
+    assert status == 503
+    assert headers["Retry-After"] == "30"
+    assert len(busy_hits) == 1 and ok_hits == []
+    assert router.nodes[busy_url].healthy
+
+
+def test_gateway_502_fails_over(route, replicas):
+    bad_url, bad_hits = replicas(502)
+    ok_url, ok_hits = replicas(200)
+    router, status, headers, _ = route([bad_url, ok_url], owner=bad_url)
+    assert status == 200 and headers["X-Routed-To"] == ok_url
+    assert len(bad_hits) == 1 and len(ok_hits) == 1
+    assert not router.nodes[bad_url].healthy
+
+
+def test_refused_connection_fails_over(route, replicas):
+    bad_url = _closed_url()
+    ok_url, ok_hits = replicas(200)
+    router, status, headers, _ = route([bad_url, ok_url], owner=bad_url)
+    assert status == 200 and headers["X-Routed-To"] == ok_url
+    assert len(ok_hits) == 1
+    assert not router.nodes[bad_url].healthy
@@ -0,0 +1,43 @@
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+import config
+import routes
+
+
+def _fake_model(monkeypatch, loaded: bool, next_retry_in=None):
+    calls = []
+
+    def ensure_model_loaded(timeout=None):
+        calls.append(timeout)
+        return loaded
+
+    monkeypatch.setitem(sys.modules, "model", SimpleNamespace(
+        ensure_model_loaded=ensure_model_loaded,
+        get_load_status=lambda: {"state": "retrying", "next_retry_in": next_retry_in},
+    ))
+    return calls
+
+
+def test_require_model_does_not_wait_by_default(monkeypatch):
+    calls = _fake_model(monkeypatch, loaded=False)
+    monkeypatch.setattr(config, "MODEL_READY_TIMEOUT", 0.0)
+    monkeypatch.setattr(config, "MODEL_NOT_READY_RETRY_AFTER", 5.0)
+    with pytest.raises(routes.ModelNotReady) as excinfo:
+        routes._require_model()
+    assert calls == [0.0]
+    assert excinfo.value.retry_after == 5.0
+
+
+def test_retry_after_follows_loader_backoff(monkeypatch):
+    _fake_model(monkeypatch, loaded=False, next_retry_in=16.0)
+    with pytest.raises(routes.ModelNotReady) as excinfo:
+        routes._require_model()
+    assert excinfo.value.retry_after == 16.0
+
+
+def test_require_model_passes_when_loaded(monkeypatch):
+    _fake_model(monkeypatch, loaded=True)
+    routes._require_model()
@@ -0,0 +1,89 @@
+import threading
+import time
+
+import pytest
+
+from scheduler import AdmissionRejected, AdmissionScheduler, TokenBucket
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=2.0, burst=2)
+    now = bucket.updated
+    assert bucket.try_take(now) == 0.0
+    assert bucket.try_take(now) == 0.0
+    assert bucket.try_take(now) == pytest.approx(0.5)
+    assert bucket.try_take(now + 0.5) == 0.0
+    assert not bucket.is_full(now + 0.5)
+    assert bucket.is_full(now + 1.5)
+
+
+def test_rate_limit_rejects_with_retry_after():
+    scheduler = AdmissionScheduler(rate_per_minute=60, burst=1)
+    with scheduler.admit("a"):
+        pass
+    with pytest.raises(AdmissionRejected) as excinfo:
+        with scheduler.admit("a"):
+            pass
+    assert 0 < excinfo.value.retry_after <= 1.0
+    # 다른 클라이언트는 영향 없음
+    with scheduler.admit("b"):
+        pass
+
+
+def test_rejects_non_positive_weight():
+    with pytest.raises(ValueError):
+        AdmissionScheduler(weights={"a": 0})
+
+
+def _run_queued(scheduler, submissions):
+    """Hold the only slot, queue `submissions` in order, then release and record grant order"""
+    order = []
+    holding = scheduler._enqueue("holder")
+    scheduler._wait(holding)
+
+    threads = []
+    for client in submissions:
+        def run(client=client):
+            with scheduler.admit(client):
+                order.append(client)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        threads.append(thread)
+        # 큐에 들어간 순서를 고정
+        deadline = time.monotonic() + 5
+        while scheduler._queued_count() < len(threads):
+            assert time.monotonic() < deadline, "request was not queued"
+            time.sleep(0.001)
+
+    scheduler._release(0.0)
+    for thread in threads:
+        thread.join(timeout=5)
+    return order
+
+
+def test_equal_weights_round_robin():
+    scheduler = AdmissionScheduler(
+        rate_per_minute=0, max_queue_per_client=10, max_queue_wait=30, default_service_time=0.1,
+    )
+    order = _run_queued(scheduler, ["a", "a", "a", "b", "b", "c"])
+    assert order == ["a", "b", "c", "a", "b", "a"]
+
+
+def test_weighted_client_gets_larger_share():
+    scheduler = AdmissionScheduler(
+        rate_per_minute=0, max_queue_per_client=10, max_queue_wait=30, default_service_time=0.1,
+        weights={"heavy": 2.0},
+    )
+    order = _run_queued(scheduler, ["light"] * 3 + ["heavy"] * 4)
+    assert order[:3].count("heavy") == 2
+
+
+def test_per_client_queue_limit():
+    scheduler = AdmissionScheduler(rate_per_minute=0, max_queue_per_client=1, max_queue_wait=30)
+    holding = scheduler._enqueue("holder")
+    scheduler._wait(holding)
+    scheduler._enqueue("a")
+    with pytest.raises(AdmissionRejected):
+        scheduler._enqueue("a")
+    assert scheduler.snapshot()["rejected_queue_full"] == 1
@@ -0,0 +1,167 @@
+import io
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import routes
+import sessions
+from schemas import VisualizeRequest
+from sessions import Session, SessionManager
+
+
+class _FakeLlamaState(SimpleNamespace):
+    pass
+
+
+@pytest.fixture
+def fake_llama_state(monkeypatch):
+    # Session.load()은 llama_cpp.llama.LlamaState로 상태를 되살림
+    module = SimpleNamespace(LlamaState=_FakeLlamaState)
+    monkeypatch.setitem(sys.modules, "llama_cpp", SimpleNamespace(llama=module))
+    monkeypatch.setitem(sys.modules, "llama_cpp.llama", module)
+
+
+def _state():
+    return _FakeLlamaState(
+        input_ids=np.arange(6, dtype=np.intc),
+        scores=np.ones((1, 4), dtype=np.float32),
+        n_tokens=6,
+        llama_state=b"kv-cache-bytes",
+        llama_state_size=14,
+        seed=7,
+    )
+
+
+def _add_turn(session, n_input, n_output, dim=3):
+    session.turn_count += 1
+    session.add_rows([f"in{i}" for i in range(n_input)], np.full((n_input, dim), session.turn_count), True)
+    session.add_rows([f"out{i}" for i in range(n_output)], np.full((n_output, dim), -session.turn_count), False)
+
+
+def test_trim_drops_whole_turns_from_the_start():
+    session = Session("s", max_tokens=10)
+    _add_turn(session, 3, 3)
+    _add_turn(session, 2, 2)
+    _add_turn(session, 2, 1)
+    # 11개 행 중 1개만 넘쳐도 첫 턴 전체를 버림
+    assert session.turns == [2, 2, 2, 2, 3, 3, 3]
+    assert session.embeddings.shape == (7, 3)
+    assert len(session.tokens) == len(session.is_input) == len(session.neighbors) == 7
+
+
+def test_trim_keeps_the_tail_of_an_oversized_last_turn():
+    session = Session("s", max_tokens=4)
+    _add_turn(session, 3, 3)
+    assert len(session.tokens) == 4
+    assert session.tokens == ["in2", "out0", "out1", "out2"]
+
+
+def test_save_and_load_round_trip(fake_llama_state):
+    session = Session("s", max_tokens=100)
+    session.messages.append({"role": "user", "content": "안녕"})
+    _add_turn(session, 2, 3)
+    session.state = _state()
+
+    buffer = io.BytesIO()
+    session.save(buffer)
+    buffer.seek(0)
+    restored = Session.load(buffer, max_tokens=100)
+
+    assert restored.messages == session.messages
+    assert restored.turn_count == 1 and restored.turns == session.turns
+    assert restored.tokens == session.tokens and restored.is_input == session.is_input
+    np.testing.assert_array_equal(restored.embeddings, session.embeddings)
+    assert restored.state.llama_state == b"kv-cache-bytes" and restored.state.seed == 7
+    np.testing.assert_array_equal(restored.state.input_ids, session.state.input_ids)
+
+
+def test_load_rejects_pickled_objects():
+    buffer = io.BytesIO()
+    np.savez(buffer, meta=np.array([{"session_id": "s"}], dtype=object))
+    buffer.seek(0)
+    with pytest.raises(ValueError):
+        Session.load(buffer)
+
+
+def test_lru_eviction_skips_sessions_in_use():
+    manager = SessionManager(max_resident=1)
+    with manager.checkout("a") as a:
+        with manager.checkout("b"):
+            pass
+        # "a"는 사용 중이므로 남고 "b"가 밀려남
+        assert list(manager._sessions) == ["a"]
+    with manager.checkout("a") as again:
+        assert again is a
+    assert manager.stats["evicted"] == 1 and manager.stats["resumed"] == 1
+
+
+def test_spill_and_restore(tmp_path):
+    manager = SessionManager(max_resident=1, spill_dir=str(tmp_path))
+    with manager.checkout("a") as a:
+        a.messages.append({"role": "user", "content": "hello"})
+        _add_turn(a, 2, 2)
+    with manager.checkout("b"):
+        pass
+    assert manager.stats["spilled"] == 1
+    assert len(list(tmp_path.glob("*.session"))) == 1
+
+    with manager.checkout("a") as restored:
+        assert restored is not a
+        assert restored.messages == a.messages
+        np.testing.assert_array_equal(restored.embeddings, a.embeddings)
+    assert manager.stats["restored"] == 1
+
+
+def test_session_taken_back_while_spilling(tmp_path):
+    manager = SessionManager(max_resident=1, spill_dir=str(tmp_path))
+    with manager.checkout("a") as a:
+        pass
+    manager._sessions["b"] = Session("b")
+    with manager._lock:
+        evicted = manager._evict()
+    assert evicted == [a]
+
+    # 기록이 끝나기 전에 다시 요청되면 같은 객체를 돌려주고, 기록된 파일은 버림
+    assert manager._get_or_create("a") is a
+    manager._spill(a)
+    assert list(tmp_path.glob("*.session")) == []
+    assert manager._spilling == {}
+
+
+def test_idle_sessions_expire(tmp_path):
+    manager = SessionManager(ttl=60, spill_dir=str(tmp_path))
+    with manager.checkout("a") as a:
+        pass
+    a.last_used = time.time() - 120
+    with manager.checkout("a") as fresh:
+        assert fresh is not a
+    assert manager.stats["expired"] == 1 and manager.stats["created"] == 2
+
+
+def test_failed_turn_leaves_session_unchanged(monkeypatch):
+    llama = SimpleNamespace(
+        n_ctx=lambda: 4096,
+        n_tokens=0,
+        tokenize=lambda data, add_bos=True: list(data),
+        save_state=_state,
+        load_state=lambda state: None,
+    )
+    monkeypatch.setitem(sys.modules, "model", SimpleNamespace(ensure_model_loaded=lambda **kwargs: True, llama=llama))
+    monkeypatch.setattr("utils.generate_chat_response", lambda llama, messages, max_tokens: "reply")
+
+    def failing_embed(llama, texts):
+        raise RuntimeError("embedding failed")
+
+    monkeypatch.setattr(routes, "embed_texts", failing_embed)
+    manager = SessionManager()
+    monkeypatch.setattr(sessions, "_session_manager", manager)
+
+    with pytest.raises(RuntimeError):
+        routes.session_turn_sync(VisualizeRequest(input_text="hello", session_id="s"))
+    with manager.checkout("s") as session:
+        assert session.turn_count == 0
+        assert [m["role"] for m in session.messages] == ["system"]
+        assert session.state is None and session.tokens == []
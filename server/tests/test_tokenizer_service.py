@@ -0,0 +1,139 @@
+import threading
+import time
+
+import pytest
+
+from tokenizer_service import TokenizerService, TokenizerUnavailable
+
+# 자식 프로세스가 import하는 가짜 llama_cpp: 바이트 하나가 토큰 하나, BOS는 0
+_STUB_LLAMA_CPP = """
+import time
+
+
+class Llama:
+    def __init__(self, model_path, vocab_only=False, verbose=True):
+        if model_path.endswith("missing.gguf"):
+            raise FileNotFoundError(model_path)
+
+    def tokenize(self, data, add_bos=True, special=False):
+        if data == b"fail":
+            raise ValueError("cannot tokenize")
+        if data.startswith(b"slow"):
+            time.sleep(0.5)
+        return ([0] if add_bos else []) + list(data)
+
+    def detokenize(self, ids):
+        return b"".join(b"<s>" if i == 0 else bytes([i]) for i in ids)
+"""
+
+
+@pytest.fixture(scope="module")
+def stub_path(tmp_path_factory):
+    root = tmp_path_factory.mktemp("stub")
+    (root / "llama_cpp").mkdir()
+    (root / "llama_cpp" / "__init__.py").write_text(_STUB_LLAMA_CPP)
+    return root
+
+
+@pytest.fixture
+def service(stub_path, monkeypatch):
+    # spawn으로 시작한 자식은 부모의 sys.path를 물려받음
+    monkeypatch.syspath_prepend(str(stub_path))
+    service = TokenizerService("model.gguf", cache_size=2, timeout=5.0, workers=2)
+    yield service
+    while not service._pool.empty():
+        service._pool.get().stop()
+
+
+def test_tokenize_and_count_from_child(service):
+    tokens = service.tokenize("a b")
+    assert [t["id"] for t in tokens] == [0, ord("a"), ord(" "), ord("b")]
+    assert [t["token"] for t in tokens] == ["<s>", "a", " ", "b"]
+    assert [t["is_whitespace"] for t in tokens] == [False, False, True, False]
+    assert service.count("hello") == 6
+
+
+def test_child_errors_become_unavailable(service):
+    with pytest.raises(TokenizerUnavailable):
+        service.count("fail")
+    # 같은 프로세스가 다음 요청에 계속 응답
+    assert service.count("ok") == 3
+
+
+def test_vocabulary_load_failure(stub_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(stub_path))
+    service = TokenizerService("missing.gguf", workers=1)
+    with pytest.raises(TokenizerUnavailable, match="Failed to load vocabulary"):
+        service.count("x")
+
+
+def test_dead_child_is_restarted(service):
+    assert service.count("x") == 2
+    workers = [service._pool.get() for _ in range(service.workers)]
+    for worker in workers:
+        if worker._process is not None:
+            worker._process.kill()
+            worker._process.join(5)
+        service._pool.put(worker)
+    for _ in range(service.workers):
+        assert service.count("xy") == 3
+
+
+def test_concurrent_requests_use_separate_children(service):
+    service.count("warm")
+    service.count("warm")
+    started = time.perf_counter()
+    threads = [threading.Thread(target=service.count, args=(f"slow {i}",)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.perf_counter() - started < 0.9
+
+
+class _BlockingWorker:
+    def __init__(self, release):
+        self.release = release
+
+    def tokenize(self, text, with_pieces=True):
+        self.release.wait(5)
+        return "ok", [1, 2]
+
+
+def test_busy_pool_times_out():
+    service = TokenizerService("model.gguf", timeout=0.2, workers=1)
+    release = threading.Event()
+    service._pool.get()
+    service._pool.put(_BlockingWorker(release))
+
+    thread = threading.Thread(target=service.count, args=("a",))
+    thread.start()
+    time.sleep(0.05)
+    # 유일한 프로세스를 빌려 간 동안에는 다른 요청이 기다리다 포기
+    with pytest.raises(TokenizerUnavailable, match="busy"):
+        service.count("b")
+    release.set()
+    thread.join()
+    assert service.count("c") == 2
+
+
+def test_lru_cache(monkeypatch):
+    service = TokenizerService("model.gguf", cache_size=2, workers=1)
+    calls = []
+
+    def run(text, with_pieces):
+        calls.append(text)
+        return [(1, text)]
+
+    monkeypatch.setattr(service, "_run", run)
+    service.tokenize("a")
+    service.tokenize("b")
+    service.tokenize("a")
+    service.tokenize("c")  # "b"가 가장 오래 사용되지 않아 밀려남
+    assert list(service._cache) == ["a", "c"]
+    service.tokenize("a")
+    service.tokenize("b")
+    assert calls == ["a", "b", "c", "b"]
+    # count()는 캐시를 거치지 않음
+    service.count("a")
+    assert calls[-1] == "a"
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from vocab_index import _synthetic_index, _train_ivfpq
+
+
+@pytest.fixture(scope="module")
+def index(tmp_path_factory):
+    return _synthetic_index(tmp_path_factory.mktemp("vocab"), n_tokens=3000, dim=64, approximate=True)
+
+
+@pytest.fixture(scope="module")
+def queries():
+    return np.random.default_rng(1).standard_normal((20, 64)).astype(np.float32)
+
+
+def test_exact_matches_brute_force(index, queries):
+    rows, scores = index.search_exact(queries, k=5)
+    embeddings = np.asarray(index.embeddings, dtype=np.float32)
+    normalized = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    expected = np.argsort(-(normalized @ embeddings.T), axis=1)[:, :5]
+    assert rows.shape == (20, 5)
+    np.testing.assert_array_equal(rows, expected)
+    assert np.all(np.diff(scores, axis=1) <= 0)
+
+
+def test_exact_with_k_equal_to_vocabulary_size(index, queries):
+    rows, _ = index.search_exact(queries[:2], k=3000)
+    assert sorted(rows[0].tolist()) == list(range(3000))
+
+
+def test_approximate_recall(index, queries):
+    exact_rows, _ = index.search_exact(queries, k=5)
+    approx_rows, approx_scores = index.search_approximate(queries, k=5)
+    recall = np.mean([len(set(a) & set(e)) / 5 for a, e in zip(approx_rows.tolist(), exact_rows.tolist())])
+    assert recall >= 0.8
+    assert np.all(np.diff(approx_scores, axis=1) <= 0)
+
+
+def test_approximate_falls_back_to_exact(tmp_path, queries):
+    index = _synthetic_index(tmp_path, n_tokens=500, dim=32, approximate=False)
+    exact = index.search_exact(queries[:, :32], k=4)
+    approx = index.search_approximate(queries[:, :32], k=4)
+    np.testing.assert_array_equal(exact[0], approx[0])
+
+
+def test_neighbors(index, queries):
+    result = index.neighbors(queries[0], k=3)
+    assert len(result) == 1 and len(result[0]) == 3
+    token, score = result[0][0]
+    assert token.startswith("tok") and -1.0 <= score <= 1.0
+    with pytest.raises(ValueError):
+        index.neighbors(queries[0], k=3, mode="fast")
+
+
+def test_approximate_with_small_vocabulary(tmp_path, queries):
+    # 학습 표본(100행)이 PQ 중심 수(256)보다 적음
+    index = _synthetic_index(tmp_path, n_tokens=100, dim=32, approximate=True)
+    assert index.has_approximate
+    assert index.codebooks.shape == (1, 100, 32)
+    rows, _ = index.search_approximate(queries[:, :32], k=4, n_probe=len(index.centroids))
+    exact_rows, _ = index.search_exact(queries[:, :32], k=4)
+    np.testing.assert_array_equal(rows, exact_rows)
+
+
+def test_ivfpq_clamps_to_train_size(tmp_path):
+    rng = np.random.default_rng(2)
+    rows = rng.standard_normal((1000, 32)).astype(np.float32)
+    rows /= np.linalg.norm(rows, axis=1, keepdims=True)
+    result = _train_ivfpq(rows, tmp_path, n_lists=1024, n_subspaces=2, train_size=50, iterations=2)
+    assert result == {"n_lists": 50, "n_subspaces": 2}
+    assert np.load(tmp_path / "pq_codebooks.npy").shape == (2, 50, 16)
+    assert np.load(tmp_path / "ivf_list_offsets.npy")[-1] == 1000
+    with pytest.raises(ValueError):
+        _train_ivfpq(rows, tmp_path, n_lists=16, n_subspaces=2, train_size=0, iterations=2)
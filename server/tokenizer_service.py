@@ -0,0 +1,186 @@
+"""
+Tokenizer service - 생성 없이 토큰 경계만 미리 보여주기 위한 토크나이저 프로세스
+GGUF를 vocab_only로 로드(가중치/KV 캐시 없음)한 별도 프로세스에서 토큰화하므로
+입력 중 실시간 미리보기가 추론 모델과 경쟁하지 않습니다.
+TOKENIZE_WORKERS개 프로세스 풀을 두어 요청이 하나의 왕복을 기다리며 줄 서지 않게 하고,
+추론 경로의 llama.tokenize()와 같은 설정(BOS 포함)으로 토큰화하여 ID와 개수가 일치합니다.
+"""
+import queue
+import threading
+from collections import OrderedDict
+from multiprocessing import get_context
+from typing import Dict, Any, List
+
+from config import TOKENIZE_CACHE_SIZE, TOKENIZE_TIMEOUT, TOKENIZE_WORKERS
+
+
+class TokenizerUnavailable(Exception):
+    """Raised when the tokenizer process cannot answer"""
+
+
+def _tokenizer_worker(conn, model_path: str):
+    """Child process: load the vocabulary only and answer tokenize requests over a pipe"""
+    try:
+        from llama_cpp import Llama
+
+        vocab = Llama(model_path=model_path, vocab_only=True, verbose=False)
+    except Exception as e:
+        conn.send(("error", f"Failed to load vocabulary: {e}"))
+        return
+    conn.send(("ready", None))
+
+    while True:
+        try:
+            text, with_pieces = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            # routes.py의 llama.tokenize(text)와 같은 플래그 (BOS 추가, 특수 토큰 해석 안 함)
+            ids = vocab.tokenize(text.encode("utf-8"), add_bos=True, special=False)
+            if not with_pieces:
+                conn.send(("ok", ids))
+                continue
+            pieces = [
+                vocab.detokenize([token_id]).decode("utf-8", errors="replace")
+                for token_id in ids
+            ]
+            conn.send(("ok", list(zip(ids, pieces))))
+        except Exception as e:
+            conn.send(("error", str(e)))
+
+
+class _TokenizerProcess:
+    """One vocabulary-only child process and its pipe (used by one caller at a time)"""
+
+    def __init__(self, model_path: str, timeout: float, name: str):
+        self.model_path = model_path
+        self.timeout = timeout
+        self.name = name
+        self._process = None
+        self._conn = None
+
+    def _start(self):
+        """Spawn the tokenizer process and wait until the vocabulary is loaded"""
+        self.stop()
+        ctx = get_context("spawn")
+        parent_conn, child_conn = ctx.Pipe()
+        process = ctx.Process(
+            target=_tokenizer_worker,
+            args=(child_conn, self.model_path),
+            name=self.name,
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+
+        # vocab_only 로드는 가볍지만 프로세스 기동 시간을 고려해 넉넉히 대기
+        if not parent_conn.poll(max(self.timeout, 30.0)):
+            process.kill()
+            raise TokenizerUnavailable("Tokenizer process did not start in time")
+        try:
+            status, message = parent_conn.recv()
+        except EOFError:
+            status, message = "error", f"Tokenizer process exited (code {process.exitcode})"
+        if status != "ready":
+            process.join(1)
+            raise TokenizerUnavailable(message)
+
+        print(f"[TOKENIZER] Vocabulary-only tokenizer started ({self.name}, pid={process.pid})")
+        self._process = process
+        self._conn = parent_conn
+
+    def stop(self):
+        if self._conn is not None:
+            self._conn.close()
+        if self._process is not None and self._process.is_alive():
+            self._process.kill()
+        self._process = None
+        self._conn = None
+
+    def _request(self, text: str, with_pieces: bool):
+        if self._process is None or not self._process.is_alive():
+            self._start()
+        self._conn.send((text, with_pieces))
+        if not self._conn.poll(self.timeout):
+            # 응답이 없으면 프로세스를 재시작해 다음 요청에 대비
+            self.stop()
+            raise TokenizerUnavailable("Tokenizer process timed out")
+        return self._conn.recv()
+
+    def tokenize(self, text: str, with_pieces: bool = True):
+        """(status, [(id, piece), ...] / [id, ...] or error message) from the child"""
+        try:
+            return self._request(text, with_pieces)
+        except (EOFError, OSError):
+            # 프로세스가 죽었으면 한 번 재시작 후 재시도
+            self.stop()
+            return self._request(text, with_pieces)
+
+
+class TokenizerService:
+    """Parent-side handle for a small pool of tokenizer processes (thread-safe, with an LRU cache)"""
+
+    def __init__(self, model_path: str, cache_size: int = 1024, timeout: float = 5.0, workers: int = 2):
+        self.model_path = model_path
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self.workers = max(1, workers)
+        self._cache_lock = threading.Lock()
+        self._cache: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        # 프로세스는 첫 사용 시 시작 - 동시에 들어온 요청은 서로 다른 프로세스에서 처리
+        self._pool: "queue.Queue[_TokenizerProcess]" = queue.Queue()
+        for i in range(self.workers):
+            self._pool.put(_TokenizerProcess(model_path, timeout, f"tokenizer-{i}"))
+
+    def tokenize(self, text: str) -> List[Dict[str, Any]]:
+        """Token pieces, IDs and whitespace flags for `text` (the same IDs as llama.tokenize(text))"""
+        with self._cache_lock:
+            cached = self._cache.get(text)
+            if cached is not None:
+                self._cache.move_to_end(text)
+                return cached
+
+        result = self._run(text, with_pieces=True)
+        tokens = [
+            {"token": piece, "id": token_id, "is_whitespace": piece.strip() == ""}
+            for token_id, piece in result
+        ]
+        with self._cache_lock:
+            self._cache[text] = tokens
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def count(self, text: str) -> int:
+        """Number of tokens llama.tokenize(text) produces (not cached, for long documents)"""
+        return len(self._run(text, with_pieces=False))
+
+    def _run(self, text: str, with_pieces: bool):
+        try:
+            worker = self._pool.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TokenizerUnavailable("All tokenizer processes are busy")
+        try:
+            status, result = worker.tokenize(text, with_pieces)
+        finally:
+            self._pool.put(worker)
+        if status != "ok":
+            raise TokenizerUnavailable(result)
+        return result
+
+
+_tokenizer_service = None
+_tokenizer_service_lock = threading.Lock()
+
+
+def get_tokenizer_service() -> TokenizerService:
+    """Shared tokenizer service (the process starts on the first request)"""
+    global _tokenizer_service
+    with _tokenizer_service_lock:
+        if _tokenizer_service is None:
+            from model import GGUF_PATH
+
+            _tokenizer_service = TokenizerService(
+                str(GGUF_PATH), cache_size=TOKENIZE_CACHE_SIZE, timeout=TOKENIZE_TIMEOUT, workers=TOKENIZE_WORKERS
+            )
+        return _tokenizer_service
@@ -1,21 +1,51 @@
+import time
+
 import numpy as np
-from sklearn.decomposition import PCA
+
+SYSTEM_PROMPT = "Respond in one sentence, about 10 words."
 
 
 def generate_response(llama, user_input: str, max_tokens: int = 512):
     """GGUF 모델로 응답 생성"""
     messages = [
-        {"role": "system", "content": "Respond in one sentence, about 10 words."},
+        {"role": "system", "content": SYSTEM_PROMPT},
         {"role": "user", "content": user_input},
     ]
+    return generate_chat_response(llama, messages, max_tokens)
+
+
+def generate_chat_response(llama, messages, max_tokens: int = 512):
+    """대화 기록 전체로 응답 생성 (KV 캐시에 남은 공통 prefix는 llama-cpp가 재평가하지 않음)"""
+    from speculative import speculative_stats
+
+    started = time.perf_counter()
     response = llama.create_chat_completion(
         messages=messages,
         max_tokens=max_tokens,
         temperature=0.7,
     )
+    # speculative 사용 여부별 tokens/sec 집계 (/health)
+    speculative_stats.record_generation(
+        getattr(llama, "draft_model", None) is not None,
+        response.get("usage", {}).get("completion_tokens", 0),
+        time.perf_counter() - started,
+    )
     return response["choices"][0]["message"]["content"].strip()
 
 
+def compact_llama_state(state):
+    """save_state() 결과에서 logits 행을 마지막 한 줄만 남김
+
+    logits_all=False여도 scores는 (n_batch, n_vocab) 크기라 상태마다 수백 MB가 됩니다.
+    복원 후에는 새 토큰을 다시 평가하므로 이전 logits는 필요 없고,
+    load_state()는 한 줄짜리 배열도 broadcast로 받아들입니다.
+    """
+    scores = getattr(state, "scores", None)
+    if scores is not None and getattr(scores, "ndim", 0) == 2 and len(scores) > 1:
+        state.scores = scores[-1:].copy()
+    return state
+
+
 def format_vector(vec, show_first=5):
     """벡터를 포맷: 앞 5개만 보여주고 나머지 생략, 전체 차원 표시"""
     if isinstance(vec, list):
@@ -47,12 +77,17 @@ def apply_pca_and_normalize(input_embeddings, output_embeddings):
     input_emb_array = extract_embeddings(input_embeddings)
     output_emb_array = extract_embeddings(output_embeddings)
     
-    # 입력과 출력 임베딩 결합
-    all_embeddings = np.vstack([input_emb_array, output_emb_array])
+    # 입력과 출력 임베딩 결합 (임베딩 전용 모드에서는 출력이 비어 있음)
+    all_embeddings = np.vstack([a for a in (input_emb_array, output_emb_array) if a.size > 0])
     
-    # PCA로 3차원으로 축소
-    pca = PCA(n_components=3)
+    # PCA로 3차원으로 축소 (sklearn은 첫 요청 시점에 import - 서버 시작 시간 단축)
+    from sklearn.decomposition import PCA
+    n_components = min(3, *all_embeddings.shape)
+    pca = PCA(n_components=n_components)
     low_dim_vectors = pca.fit_transform(all_embeddings)
+    if n_components < 3:
+        # 토큰이 3개 미만이면 남는 축은 0으로 채움
+        low_dim_vectors = np.hstack([low_dim_vectors, np.zeros((len(low_dim_vectors), 3 - n_components))])
     
     # -1과 1 사이로 정규화 (Min-Max 정규화)
     min_vals = low_dim_vectors.min(axis=0)
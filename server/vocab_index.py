@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+"""
+Nearest-vocabulary-neighbor index
+모델의 토큰 임베딩 행렬(token_embd.weight)을 정규화해 디스크에 저장하고,
+은닉 상태 벡터마다 가장 가까운 어휘 토큰 top-k를 찾습니다.
+
+- exact:  float16 정규화 행렬 전체와의 내적 (mmap, 청크 단위 계산)
+- approx: IVF(coarse k-means) + PQ(product quantization) 후보 검색 뒤 exact 행으로 재정렬
+
+Usage:
+    python vocab_index.py build [--no-approx]
+    python vocab_index.py bench [--synthetic]
+"""
+import argparse
+import json
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# 인덱스 파일 형식 버전 (형식이 바뀌면 다시 빌드)
+INDEX_VERSION = 1
+
+# exact 검색 시 한 번에 float32로 변환할 행 수
+_EXACT_CHUNK_ROWS = 8192
+
+# tokenizer.ggml.token_type: 1 = normal, 6 = byte (나머지는 특수/제어 토큰)
+_INDEXED_TOKEN_TYPES = (1, 6)
+
+
+def _import_gguf():
+    """gguf 모듈을 lazy import (인덱스 빌드에만 필요)"""
+    try:
+        import gguf
+    except ImportError:
+        raise ImportError(
+            "gguf module not found. "
+            "Please install it (pip install gguf) to build the vocabulary index."
+        )
+    return gguf
+
+
+def _byte_decoder():
+    """Inverse of the GPT-2 byte-to-unicode table used by byte-level BPE vocabularies"""
+    bs = (
+        list(range(ord("!"), ord("~") + 1))
+        + list(range(ord("¡"), ord("¬") + 1))
+        + list(range(ord("®"), ord("ÿ") + 1))
+    )
+    cs = bs[:]
+    n = 0
+    for b in range(256):
+        if b not in bs:
+            bs.append(b)
+            cs.append(256 + n)
+            n += 1
+    return {chr(c): b for b, c in zip(bs, cs)}
+
+
+def _decode_pieces(pieces: List[str], tokenizer_model: str) -> List[str]:
+    """Turn raw vocabulary pieces into display strings"""
+    if tokenizer_model == "gpt2":
+        decoder = _byte_decoder()
+        return [
+            bytes(decoder[ch] for ch in piece if ch in decoder).decode("utf-8", errors="replace")
+            for piece in pieces
+        ]
+    # sentencepiece 계열: ▁ = 공백, <0xNN> = 바이트 토큰
+    decoded = []
+    for piece in pieces:
+        if piece.startswith("<0x") and piece.endswith(">") and len(piece) == 6:
+            decoded.append(bytes([int(piece[3:5], 16)]).decode("utf-8", errors="replace"))
+        else:
+            decoded.append(piece.replace("▁", " "))
+    return decoded
+
+
+def _read_field(reader, name: str):
+    field = reader.fields[name]
+    return [field.parts[i] for i in field.data]
+
+
+def _kmeans(data: np.ndarray, n_clusters: int, iterations: int, seed: int = 0,
+            spherical: bool = False) -> np.ndarray:
+    """Plain Lloyd k-means on float32 rows (spherical = cosine on unit vectors)"""
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)].copy()
+    data_sq = (data * data).sum(axis=1)
+    for _ in range(iterations):
+        if spherical:
+            assignments = np.argmax(data @ centroids.T, axis=1)
+        else:
+            distances = data_sq[:, None] - 2 * data @ centroids.T + (centroids * centroids).sum(axis=1)
+            assignments = np.argmin(distances, axis=1)
+        for c in range(n_clusters):
+            members = data[assignments == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+            else:
+                centroids[c] = data[rng.integers(len(data))]
+        if spherical:
+            centroids /= np.linalg.norm(centroids, axis=1, keepdims=True) + 1e-12
+    return centroids
+
+
+def _assign(rows: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    return np.argmax(rows.astype(np.float32) @ centroids.T, axis=1)
+
+
+def _train_ivfpq(embeddings: np.ndarray, out_dir: Path, n_lists: int, n_subspaces: int,
+                 train_size: int, iterations: int):
+    """Train coarse centroids + PQ codebooks on residuals and encode all rows"""
+    n_rows, dim = embeddings.shape
+    if dim % n_subspaces:
+        raise ValueError(f"Embedding dimension {dim} is not divisible by {n_subspaces} subspaces")
+    sub_dim = dim // n_subspaces
+
+    rng = np.random.default_rng(0)
+    sample_ids = np.sort(rng.choice(n_rows, min(train_size, n_rows), replace=False))
+    sample = embeddings[sample_ids].astype(np.float32)
+    if not len(sample):
+        raise ValueError("IVF-PQ training needs at least one row (check train_size)")
+    # k-means는 학습 표본 수보다 많은 중심을 만들 수 없음 (작은 어휘나 작은 train_size)
+    n_lists = min(n_lists, len(sample))
+    n_codes = min(256, len(sample))
+
+    print(f"[VOCAB INDEX] Training {n_lists} coarse centroids on {len(sample)} rows...")
+    centroids = _kmeans(sample, n_lists, iterations, spherical=True)
+
+    residuals = sample - centroids[_assign(sample, centroids)]
+    print(f"[VOCAB INDEX] Training PQ codebooks ({n_subspaces} x {n_codes}, sub_dim={sub_dim})...")
+    codebooks = np.stack([
+        _kmeans(residuals[:, j * sub_dim:(j + 1) * sub_dim], n_codes, iterations, seed=j)
+        for j in range(n_subspaces)
+    ])
+
+    print("[VOCAB INDEX] Encoding vocabulary...")
+    assignments = np.empty(n_rows, dtype=np.int32)
+    codes = np.empty((n_rows, n_subspaces), dtype=np.uint8)
+    for start in range(0, n_rows, _EXACT_CHUNK_ROWS):
+        rows = embeddings[start:start + _EXACT_CHUNK_ROWS].astype(np.float32)
+        lists = _assign(rows, centroids)
+        assignments[start:start + len(rows)] = lists
+        chunk_residuals = rows - centroids[lists]
+        for j in range(n_subspaces):
+            sub = chunk_residuals[:, j * sub_dim:(j + 1) * sub_dim]
+            book = codebooks[j]
+            distances = (book * book).sum(axis=1) - 2 * sub @ book.T
+            codes[start:start + len(rows), j] = np.argmin(distances, axis=1)
+
+    # 역색인: 리스트 순서로 행 번호와 코드 정렬
+    order = np.argsort(assignments, kind="stable").astype(np.int32)
+    list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assignments, minlength=n_lists), out=list_offsets[1:])
+
+    np.save(out_dir / "ivf_centroids.npy", centroids.astype(np.float32))
+    np.save(out_dir / "ivf_list_offsets.npy", list_offsets)
+    np.save(out_dir / "ivf_list_rows.npy", order)
+    np.save(out_dir / "pq_codebooks.npy", codebooks.astype(np.float32))
+    np.save(out_dir / "pq_codes.npy", codes[order])
+    return {"n_lists": int(n_lists), "n_subspaces": int(n_subspaces)}
+
+
+def build_vocab_index(gguf_path: Path, out_dir: Path, approximate: bool = True,
+                      n_lists: int = 1024, n_subspaces: int = 64,
+                      train_size: int = 32768, iterations: int = 8):
+    """Build the index for a GGUF model into `out_dir`"""
+    gguf = _import_gguf()
+    from gguf.quants import dequantize
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    reader = gguf.GGUFReader(str(gguf_path))
+
+    tokenizer_model = bytes(_read_field(reader, "tokenizer.ggml.model")[0]).decode("utf-8")
+    pieces = [bytes(p).decode("utf-8", errors="replace") for p in _read_field(reader, "tokenizer.ggml.tokens")]
+    if "tokenizer.ggml.token_type" in reader.fields:
+        token_types = [int(p[0]) for p in _read_field(reader, "tokenizer.ggml.token_type")]
+    else:
+        token_types = [1] * len(pieces)
+
+    tensor = next((t for t in reader.tensors if t.name == "token_embd.weight"), None)
+    if tensor is None:
+        raise ValueError(f"token_embd.weight not found in {gguf_path}")
+
+    token_ids = np.array([i for i, t in enumerate(token_types) if t in _INDEXED_TOKEN_TYPES], dtype=np.int32)
+    first = dequantize(tensor.data[:1], tensor.tensor_type)
+    dim = first.shape[-1]
+    print(f"[VOCAB INDEX] {len(token_ids)}/{len(pieces)} tokens, dim={dim}, type={tensor.tensor_type.name}")
+
+    # 정규화된 float16 행렬을 청크 단위로 기록 (전체 float32 행렬을 메모리에 올리지 않음)
+    embeddings = np.lib.format.open_memmap(
+        out_dir / "embeddings.npy", mode="w+", dtype=np.float16, shape=(len(token_ids), dim)
+    )
+    for start in range(0, len(token_ids), _EXACT_CHUNK_ROWS):
+        ids = token_ids[start:start + _EXACT_CHUNK_ROWS]
+        rows = dequantize(tensor.data[ids], tensor.tensor_type).reshape(len(ids), dim)
+        rows /= np.linalg.norm(rows, axis=1, keepdims=True) + 1e-12
+        embeddings[start:start + len(ids)] = rows
+    embeddings.flush()
+    np.save(out_dir / "token_ids.npy", token_ids)
+
+    decoded = _decode_pieces(pieces, tokenizer_model)
+    with open(out_dir / "tokens.json", "w", encoding="utf-8") as f:
+        json.dump([decoded[i] for i in token_ids], f, ensure_ascii=False)
+
+    meta = {
+        "version": INDEX_VERSION,
+        "model": gguf_path.name,
+        "model_size": gguf_path.stat().st_size,
+        "n_tokens": int(len(token_ids)),
+        "dim": int(dim),
+        "approximate": None,
+    }
+    if approximate:
+        meta["approximate"] = _train_ivfpq(
+            np.load(out_dir / "embeddings.npy", mmap_mode="r"), out_dir,
+            n_lists, n_subspaces, train_size, iterations,
+        )
+
+    with open(out_dir / "meta.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    print(f"[VOCAB INDEX] Index written to {out_dir}")
+    return meta
+
+
+class VocabIndex:
+    """Memory-mapped nearest-neighbor index over normalized token embeddings"""
+
+    def __init__(self, index_dir: Path):
+        self.index_dir = Path(index_dir)
+        with open(self.index_dir / "meta.json", "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"Unsupported vocabulary index version in {self.index_dir}")
+
+        self.embeddings = np.load(self.index_dir / "embeddings.npy", mmap_mode="r")
+        with open(self.index_dir / "tokens.json", "r", encoding="utf-8") as f:
+            self.tokens = json.load(f)
+
+        self.has_approximate = self.meta.get("approximate") is not None
+        if self.has_approximate:
+            self.centroids = np.load(self.index_dir / "ivf_centroids.npy")
+            self.list_offsets = np.load(self.index_dir / "ivf_list_offsets.npy")
+            self.list_rows = np.load(self.index_dir / "ivf_list_rows.npy", mmap_mode="r")
+            self.codebooks = np.load(self.index_dir / "pq_codebooks.npy")
+            self.codes = np.load(self.index_dir / "pq_codes.npy", mmap_mode="r")
+
+    @staticmethod
+    def _normalize(queries) -> np.ndarray:
+        queries = np.asarray(queries, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[None, :]
+        return queries / (np.linalg.norm(queries, axis=1, keepdims=True) + 1e-12)
+
+    def search_exact(self, queries, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact top-k by cosine similarity; returns (rows [Q, k], scores [Q, k])"""
+        queries = self._normalize(queries)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(self.embeddings), _EXACT_CHUNK_ROWS):
+            chunk = np.asarray(self.embeddings[start:start + _EXACT_CHUNK_ROWS], dtype=np.float32)
+            scores = queries @ chunk.T
+            rows = np.broadcast_to(np.arange(start, start + len(chunk)), scores.shape)
+            scores = np.concatenate([best_scores, scores], axis=1)
+            rows = np.concatenate([best_rows, rows], axis=1)
+            keep = min(k, scores.shape[1])
+            top = np.argpartition(-scores, keep - 1, axis=1)[:, :keep]
+            best_scores = np.take_along_axis(scores, top, axis=1)
+            best_rows = np.take_along_axis(rows, top, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+    def search_approximate(self, queries, k: int, n_probe: int = 32,
+                           rerank: int = 20) -> Tuple[np.ndarray, np.ndarray]:
+        """IVF-PQ candidate search, then exact re-ranking of the best `k * rerank` candidates"""
+        if not self.has_approximate:
+            return self.search_exact(queries, k)
+
+        queries = self._normalize(queries)
+        n_subspaces, _, sub_dim = self.codebooks.shape
+        n_probe = min(n_probe, len(self.centroids))
+        coarse_scores = queries @ self.centroids.T
+        probes = np.argpartition(-coarse_scores, n_probe - 1, axis=1)[:, :n_probe]
+
+        result_rows = np.zeros((len(queries), k), dtype=np.int64)
+        result_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        subspace_index = np.arange(n_subspaces)
+        for q, query in enumerate(queries):
+            # 쿼리-코드북 내적 테이블: q·r ≈ Σ_j lut[j, code_j]
+            lut = np.einsum("jd,jcd->jc", query.reshape(n_subspaces, sub_dim), self.codebooks)
+            candidate_rows = []
+            candidate_scores = []
+            for lst in probes[q]:
+                start, end = self.list_offsets[lst], self.list_offsets[lst + 1]
+                if start == end:
+                    continue
+                codes = self.codes[start:end]
+                candidate_scores.append(coarse_scores[q, lst] + lut[subspace_index, codes].sum(axis=1))
+                candidate_rows.append(self.list_rows[start:end])
+            if not candidate_rows:
+                continue
+            candidate_rows = np.concatenate(candidate_rows)
+            candidate_scores = np.concatenate(candidate_scores)
+
+            keep = min(k * rerank, len(candidate_rows))
+            shortlist = candidate_rows[np.argpartition(-candidate_scores, keep - 1)[:keep]]
+            shortlist.sort()  # mmap 순차 접근
+            exact = np.asarray(self.embeddings[shortlist], dtype=np.float32) @ query
+            top = np.argsort(-exact)[:k]
+            result_rows[q, :len(top)] = shortlist[top]
+            result_scores[q, :len(top)] = exact[top]
+        return result_rows, result_scores
+
+    def neighbors(self, queries, k: int = 5, mode: str = "exact") -> List[List[Tuple[str, float]]]:
+        """Top-k (token string, cosine score) for each query vector"""
+        if mode == "approx":
+            rows, scores = self.search_approximate(queries, k)
+        elif mode == "exact":
+            rows, scores = self.search_exact(queries, k)
+        else:
+            raise ValueError(f"Unknown neighbors mode '{mode}' (expected 'exact' or 'approx')")
+        return [
+            [(self.tokens[r], round(float(s), 4)) for r, s in zip(row, score) if np.isfinite(s)]
+            for row, score in zip(rows.tolist(), scores.tolist())
+        ]
+
+
+_vocab_index = None
+_vocab_index_lock = threading.Lock()
+
+
+def get_vocab_index() -> Optional[VocabIndex]:
+    """Shared index for the configured model, or None if it has not been built"""
+    global _vocab_index
+    if _vocab_index is not None:
+        return _vocab_index
+
+    from config import VOCAB_INDEX_DIR
+
+    with _vocab_index_lock:
+        if _vocab_index is None:
+            if not (Path(VOCAB_INDEX_DIR) / "meta.json").exists():
+                return None
+            try:
+                _vocab_index = VocabIndex(Path(VOCAB_INDEX_DIR))
+                print(f"[VOCAB INDEX] Loaded {_vocab_index.meta['n_tokens']} tokens from {VOCAB_INDEX_DIR}")
+            except Exception as e:
+                print(f"[VOCAB INDEX] Failed to load index: {e}")
+                return None
+    return _vocab_index
+
+
+def _synthetic_index(out_dir: Path, n_tokens: int, dim: int, approximate: bool) -> VocabIndex:
+    """Random clustered vocabulary for benchmarking without a model file"""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((256, dim)).astype(np.float32)
+    rows = centers[rng.integers(256, size=n_tokens)] + 0.5 * rng.standard_normal((n_tokens, dim)).astype(np.float32)
+    rows /= np.linalg.norm(rows, axis=1, keepdims=True)
+    np.save(out_dir / "embeddings.npy", rows.astype(np.float16))
+    np.save(out_dir / "token_ids.npy", np.arange(n_tokens, dtype=np.int32))
+    with open(out_dir / "tokens.json", "w", encoding="utf-8") as f:
+        json.dump([f"tok{i}" for i in range(n_tokens)], f)
+    meta = {"version": INDEX_VERSION, "model": "synthetic", "model_size": 0,
+            "n_tokens": n_tokens, "dim": dim, "approximate": None}
+    if approximate:
+        n_lists = max(16, int(np.sqrt(n_tokens) * 2))
+        meta["approximate"] = _train_ivfpq(
+            np.load(out_dir / "embeddings.npy", mmap_mode="r"), out_dir, n_lists,
+            n_subspaces=max(1, dim // 32), train_size=32768, iterations=8,
+        )
+    with open(out_dir / "meta.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return VocabIndex(out_dir)
+
+
+def _bench(index: VocabIndex, n_queries: int, k: int, repeats: int):
+    rng = np.random.default_rng(1)
+    # 실제 토큰 벡터에 잡음을 더한 쿼리 (은닉 상태 대용)
+    base = np.asarray(index.embeddings[rng.integers(len(index.embeddings), size=n_queries)], dtype=np.float32)
+    queries = base + 0.3 * rng.standard_normal(base.shape).astype(np.float32)
+
+    exact_rows, _ = index.search_exact(queries, k)
+    modes = [("exact", index.search_exact)]
+    if index.has_approximate:
+        modes.append(("approx", index.search_approximate))
+
+    for name, search in modes:
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            rows, _ = search(queries, k)
+            timings.append(time.perf_counter() - started)
+        recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(rows.tolist(), exact_rows.tolist())])
+        best = min(timings)
+        print(f"{name:>6}: {best * 1000:8.1f} ms / {n_queries} tokens "
+              f"({best / n_queries * 1000:.2f} ms/token), recall@{k}={recall:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nearest-vocabulary-neighbor index")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="Build the index from the configured GGUF model")
+    build.add_argument("--no-approx", action="store_true", help="Skip IVF-PQ training")
+    build.add_argument("--lists", type=int, default=1024)
+    build.add_argument("--subspaces", type=int, default=64)
+
+    bench = sub.add_parser("bench", help="Measure exact vs approximate search latency")
+    bench.add_argument("--synthetic", action="store_true", help="Use a random vocabulary instead of the built index")
+    bench.add_argument("--vocab", type=int, default=128256)
+    bench.add_argument("--dim", type=int, default=2048)
+    bench.add_argument("--queries", type=int, default=50)
+    bench.add_argument("-k", type=int, default=5)
+    bench.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    from config import VOCAB_INDEX_DIR
+
+    if args.command == "build":
+        from model import GGUF_PATH, download_model_from_hf
+
+        if not GGUF_PATH.exists():
+            download_model_from_hf()
+        build_vocab_index(GGUF_PATH, Path(VOCAB_INDEX_DIR), approximate=not args.no_approx,
+                          n_lists=args.lists, n_subspaces=args.subspaces)
+    else:
+        if args.synthetic:
+            import tempfile
+
+            index = _synthetic_index(Path(tempfile.mkdtemp()), args.vocab, args.dim, approximate=True)
+        else:
+            index = get_vocab_index()
+            if index is None:
+                raise SystemExit(f"No index at {VOCAB_INDEX_DIR}; run `python vocab_index.py build` first")
+        _bench(index, args.queries, args.k, args.repeats)
+
+
+if __name__ == "__main__":
+    main()